@@ -5,30 +5,65 @@ Provides statistical analysis, anomaly detection, and network flow optimization
 
 import numpy as np
 from scipy import stats
-from typing import List, Dict, Tuple
-import networkx as nx
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
+from history_store import history_store
+from streaming_stats import streaming_stats
+from metro_topology import metro_topology
+from network_state import STATUS_LEVELS, NetworkState
+from train_index import train_index
+from telemetry import telemetry
 
 class AdvancedAnalytics:
-    def __init__(self):
-        self.historical_data = []
-        
-    def analyze_crowd_patterns(self, stations: List[Dict]) -> Dict:
-        """Analyze crowd patterns across all stations"""
-        passengers = [s["passengers"] for s in stations]
+    def __init__(self, store=history_store, stats_engine=streaming_stats, topology=metro_topology,
+                 trains=train_index):
+        self.historical_data = store
+        self.stream_stats = stats_engine
+        self.topology = topology
+        self.train_index = trains
+        # Busy trains within this many stations of a crowded station make it a bottleneck
+        self.bottleneck_radius_stations = 2
+        # Track distance in metres instead of stations, when set
+        self.bottleneck_radius_metres: Optional[float] = None
+        self.bottleneck_min_trains = 2
+    
+    @telemetry.timed("analytics")
+    def record_snapshot(self, stations):
+        """Append the live station counts (dicts or a NetworkState) to the history store and streaming statistics"""
+        state = NetworkState.ensure(stations)
+        self.historical_data.record_many(state.station_ids.tolist(), state.passengers)
+        self.stream_stats.update_state(state)
+    
+    @telemetry.timed("analytics")
+    def station_trend(self, station_id: int, minutes: int = 60) -> Dict:
+        """Summarize a station's recent history from a zero-copy window"""
+        window = self.historical_data.window(station_id, min(minutes, self.historical_data.length))
+        slope = np.polyfit(np.arange(len(window)), window, 1)[0] if len(window) > 1 else 0.0
         
         return {
-            "mean": round(np.mean(passengers), 2),
-            "median": round(np.median(passengers), 2),
-            "std_dev": round(np.std(passengers), 2),
-            "min": int(np.min(passengers)),
-            "max": int(np.max(passengers)),
-            "total": int(np.sum(passengers))
+            "station_id": station_id,
+            "window_minutes": len(window),
+            "mean": round(float(window.mean()), 2) if len(window) else 0.0,
+            "peak": int(window.max()) if len(window) else 0,
+            "trend_per_minute": round(float(slope), 3)
         }
+        
+    @telemetry.timed("analytics")
+    def analyze_crowd_patterns(self, stations=None, scope: str = "network", window: str = "current") -> Dict:
+        """Crowd statistics over every station's latest count; pass a window label for the rolling view"""
+        if stations is not None and len(stations):
+            # Unchanged stations are skipped, so repeated polls cost only a lookup each
+            self.stream_stats.update_state(NetworkState.ensure(stations))
+        
+        stats = self.stream_stats.get_stats(scope, window)
+        return {key: stats[key] for key in ("mean", "median", "std_dev", "min", "max", "total", "sample_total")
+                if key in stats}
     
-    def detect_anomalies(self, stations: List[Dict]) -> List[Dict]:
+    @telemetry.timed("analytics")
+    def detect_anomalies(self, stations) -> List[Dict]:
         """Detect anomalies using Z-score and IQR methods"""
-        passengers = np.array([s["passengers"] for s in stations])
+        state = NetworkState.ensure(stations)
+        passengers = state.passengers
         
         # Z-score method
         z_scores = np.abs(stats.zscore(passengers))
@@ -41,91 +76,85 @@ class AdvancedAnalytics:
         upper_bound = q3 + (1.5 * iqr)
         iqr_anomalies = (passengers < lower_bound) | (passengers > upper_bound)
         
-        # Combine results
-        anomalies = []
-        for i, station in enumerate(stations):
-            if z_anomalies[i] or iqr_anomalies[i]:
-                anomalies.append({
-                    "station_id": station["id"],
-                    "station_name": station["name"],
-                    "passengers": station["passengers"],
-                    "z_score": round(float(z_scores[i]), 2),
-                    "severity": "high" if z_scores[i] > 3 else "medium",
-                    "reason": "Unusually high crowd" if station["passengers"] > np.mean(passengers) else "Unusually low crowd"
-                })
-        
-        return anomalies
+        # Records are only built for the flagged rows
+        mean = passengers.mean()
+        return [{
+            "station_id": int(state.station_ids[i]),
+            "station_name": state.names[i],
+            "passengers": int(passengers[i]),
+            "z_score": round(float(z_scores[i]), 2),
+            "severity": "high" if z_scores[i] > 3 else "medium",
+            "reason": "Unusually high crowd" if passengers[i] > mean else "Unusually low crowd"
+        } for i in np.flatnonzero(z_anomalies | iqr_anomalies)]
     
-    def analyze_network_flow(self, stations: List[Dict]) -> Dict:
-        """Analyze network flow using graph algorithms"""
-        # Create network graph
-        G = nx.Graph()
-        
-        # Add stations as nodes
-        for station in stations:
-            G.add_node(station["id"], 
-                      name=station["name"],
-                      passengers=station["passengers"],
-                      line=station["line"])
-        
-        # Add edges based on metro lines
-        red_line = [s["id"] for s in stations if s["line"] == "red"]
-        green_line = [s["id"] for s in stations if s["line"] == "green"]
-        blue_line = [s["id"] for s in stations if s["line"] == "blue"]
-        
-        for line in [red_line, green_line, blue_line]:
-            for i in range(len(line) - 1):
-                G.add_edge(line[i], line[i + 1])
-        
-        # Calculate network metrics
-        degree_centrality = nx.degree_centrality(G)
-        betweenness_centrality = nx.betweenness_centrality(G)
+    @telemetry.timed("analytics")
+    def analyze_network_flow(self, stations) -> Dict:
+        """Analyze network flow by joining cached graph metrics with live passenger counts"""
+        state = NetworkState.ensure(stations)
+        self.topology.sync(state)
+        metrics = self.topology.metrics
+        betweenness_centrality = metrics["betweenness_centrality"]
         
         # Find critical stations (high centrality)
         critical_stations = []
-        for node_id, centrality in sorted(betweenness_centrality.items(), 
-                                          key=lambda x: x[1], reverse=True)[:5]:
-            station = next(s for s in stations if s["id"] == node_id)
+        for node_id in metrics["ranked_by_betweenness"][:5]:
+            row = state.index[node_id]
             critical_stations.append({
                 "station_id": node_id,
-                "station_name": station["name"],
-                "betweenness_centrality": round(centrality, 4),
-                "passengers": station["passengers"]
+                "station_name": state.names[row],
+                "betweenness_centrality": round(betweenness_centrality[node_id], 4),
+                "passengers": int(state.passengers[row])
             })
         
         return {
-            "total_nodes": G.number_of_nodes(),
-            "total_edges": G.number_of_edges(),
-            "network_density": round(nx.density(G), 4),
+            "total_nodes": metrics["total_nodes"],
+            "total_edges": metrics["total_edges"],
+            "network_density": metrics["network_density"],
             "critical_stations": critical_stations,
-            "average_degree": round(sum(dict(G.degree()).values()) / G.number_of_nodes(), 2)
+            "average_degree": metrics["average_degree"]
         }
     
-    def identify_bottlenecks(self, stations: List[Dict], trains: List[Dict]) -> List[Dict]:
-        """Identify bottlenecks in the metro network"""
-        bottlenecks = []
+    @telemetry.timed("analytics")
+    def identify_bottlenecks(self, stations, trains: List[Dict] = None) -> List[Dict]:
+        """Identify crowded stations with busy trains close by on the same line"""
+        state = NetworkState.ensure(stations, trains)
+        self.train_index.update(state)
+        busy = state.rush_mask("Moderate Rush", "High Rush")
+        crowded = np.flatnonzero(state.status_mask("HIGH", "PEAK"))
         
-        # Identify stations with high passengers and multiple trains
-        for station in stations:
-            if station["status"] in ["HIGH", "PEAK"]:
-                # Count trains near this station
-                nearby_trains = [t for t in trains 
-                               if t["line"] == station["line"] 
-                               and t["seat_rush_level"] in ["Moderate Rush", "High Rush"]]
-                
-                if len(nearby_trains) >= 2:
-                    bottlenecks.append({
-                        "station_id": station["id"],
-                        "station_name": station["name"],
-                        "passengers": station["passengers"],
-                        "status": station["status"],
-                        "nearby_trains": len(nearby_trains),
-                        "severity": "critical" if station["status"] == "PEAK" else "warning",
-                        "recommendation": f"Increase train frequency on {station['line']} line"
-                    })
+        bottlenecks = []
+        for code, line in enumerate(state.lines):
+            rows = crowded[state.station_line[crowded] == code]
+            located = [(row, self.train_index.station_offsets.get(int(state.station_ids[row]))) for row in rows]
+            located = [(row, position[1]) for row, position in located if position and position[0] == line]
+            if not located:
+                continue
+            rows = [row for row, _ in located]
+            nearby = self.train_index.count_nearby(line, [offset for _, offset in located],
+                                                   self.bottleneck_radius_stations, busy,
+                                                   metres=self.bottleneck_radius_metres)
+            first, last = self.train_index.terminals.get(line, (None, None))
+            
+            for i, row in enumerate(rows):
+                if nearby.total[i] < self.bottleneck_min_trains:
+                    continue
+                status = STATUS_LEVELS[state.status_code[row]]
+                toward_end, toward_start = int(nearby.toward_end[i]), int(nearby.toward_start[i])
+                bottlenecks.append({
+                    "station_id": int(state.station_ids[row]),
+                    "station_name": state.names[row],
+                    "passengers": int(state.passengers[row]),
+                    "status": status,
+                    "nearby_trains": int(nearby.total[i]),
+                    "approaching_trains": toward_end + toward_start,
+                    "direction": (last if toward_end >= toward_start else first) if toward_end + toward_start else None,
+                    "severity": "critical" if status == "PEAK" else "warning",
+                    "recommendation": f"Increase train frequency on {line} line"
+                })
         
         return bottlenecks
     
+    @telemetry.timed("analytics")
     def detect_peak_hours(self, current_hour: int) -> Dict:
         """Detect and classify peak hours"""
         morning_peak = 9 <= current_hour <= 11
@@ -3,50 +3,174 @@ AI Assistant Engine
 Context-aware conversational AI for metro travel assistance
 """
 
-from typing import Dict, List
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional
 from datetime import datetime
 
+import numpy as np
+
+from assistant_index import QueryMatch, QueryMatcher
+from incident_engine import incident_engine
+from network_state import NetworkState
+from revenue_engine import revenue_engine
+from route_planner import route_planner
+from telemetry import telemetry
+
+# Checked in order; the first intent present in the query wins
+INTENT_PRIORITY = ("route", "crowd", "incident", "timing", "fare")
+
 class AIAssistantEngine:
-    def __init__(self):
-        self.conversation_history = []
+    """Answers travel questions from the live network snapshot.
+
+    Each query is matched once by QueryMatcher (intents, station names and aliases,
+    from/to roles, fuzzy names). Answers read the latest NetworkState supplied by the
+    ``snapshot`` callable set in ``configure``. Per-session history keeps the last
+    history_limit turns, and the max_sessions most recent sessions are kept (LRU).
+    A follow-up without a station ("is it busy?") reuses the session's last stations.
+    """
+
+    def __init__(self, matcher: QueryMatcher = None, history_limit: int = 20, max_sessions: int = 10000):
+        self.matcher = matcher or QueryMatcher()
+        self.history_limit = history_limit
+        self.max_sessions = max_sessions
+        self.snapshot: Callable[[], Optional[NetworkState]] = lambda: None
+        self.conversation_history: "OrderedDict[str, Deque[Dict]]" = OrderedDict()
+        self._last_stations: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
         self.knowledge_base = {
             "routes": "Hyderabad Metro has 3 lines: Red (Miyapur-LB Nagar), Green (Nagole-JNTU), Blue (Raidurg-Hitech City)",
             "fares": "Metro fares start from ₹10 and go up to ₹60 based on distance",
             "timings": "Metro operates from 6:00 AM to 11:00 PM daily",
             "frequency": "Train frequency is 3-7 minutes during peak hours, 10-15 minutes during off-peak"
         }
-        
-    def process_query(self, query: str, context: Dict = None) -> Dict:
+
+    def configure(self, snapshot: Callable[[], Optional[NetworkState]]):
+        """Set the source of the latest NetworkState used for live answers"""
+        self.snapshot = snapshot
+
+    @telemetry.timed("assistant")
+    def process_query(self, query: str, context: Dict = None, session_id: Optional[str] = None) -> Dict:
         """Process user query with context awareness"""
-        query_lower = query.lower()
-        
-        # Simple keyword-based responses
-        if "route" in query_lower or "how to" in query_lower:
-            response = self._get_route_advice(context)
-        elif "crowd" in query_lower or "busy" in query_lower:
-            response = self._get_crowd_info(context)
-        elif "time" in query_lower or "when" in query_lower:
+        return self._answer(query, context or {}, session_id, self.snapshot())
+
+    @telemetry.timed("assistant")
+    def process_batch(self, queries: List[Dict]) -> List[Dict]:
+        """Answer many {query, context, session_id} items against one shared snapshot"""
+        state = self.snapshot()
+        return [self._answer(item["query"], item.get("context") or {}, item.get("session_id"), state)
+                for item in queries]
+
+    def _answer(self, query: str, context: Dict, session_id: Optional[str], state: Optional[NetworkState]) -> Dict:
+        match = self.matcher.match(query)
+        stations = [s.station_id for s in match.stations]
+        if not stations and session_id is not None:
+            stations = list(self._last_stations.get(session_id, ()))
+        intent = next((i for i in INTENT_PRIORITY if i in match.intents), None)
+
+        if intent == "route" or (intent in (None, "timing") and match.role("origin") and match.role("destination")):
+            intent, response = "route", self._get_route_advice(context, match)
+        elif intent == "crowd" or (intent is None and match.stations):
+            intent, response = "crowd", self._get_crowd_info(state, stations)
+        elif intent == "incident":
+            response = self._get_incident_info(stations)
+        elif intent == "timing":
             response = self._get_timing_info()
-        elif "fare" in query_lower or "cost" in query_lower:
-            response = self._get_fare_info()
+        elif intent == "fare":
+            response = self._get_fare_info(match)
         else:
             response = "I can help you with routes, crowd information, timings, and fares. What would you like to know?"
-        
-        return {
+
+        if match.stations:
+            confidence = round(0.95 * min(s.score for s in match.stations), 2)
+        else:
+            confidence = 0.85 if intent else 0.5
+        result = {
             "query": query,
             "response": response,
+            "intent": intent or "help",
+            "stations": [{"id": s.station_id, "name": s.name, "match_score": s.score} for s in match.stations],
             "timestamp": datetime.now().isoformat(),
-            "confidence": 0.85
+            "confidence": confidence
         }
-    
-    def _get_route_advice(self, context: Dict = None) -> str:
+        if session_id is not None:
+            self._remember(session_id, result, stations)
+            result["session_id"] = session_id
+        return result
+
+    def _remember(self, session_id: str, result: Dict, stations: List[int]):
+        with self._lock:
+            history = self.conversation_history.get(session_id)
+            if history is None:
+                history = self.conversation_history[session_id] = deque(maxlen=self.history_limit)
+                while len(self.conversation_history) > self.max_sessions:
+                    evicted, _ = self.conversation_history.popitem(last=False)
+                    self._last_stations.pop(evicted, None)
+            else:
+                self.conversation_history.move_to_end(session_id)
+            history.append({"query": result["query"], "intent": result["intent"], "timestamp": result["timestamp"]})
+            if stations:
+                self._last_stations[session_id] = stations[:3]
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            return list(self.conversation_history.get(session_id, ()))
+
+    def _get_route_advice(self, context: Dict = None, match: QueryMatch = None) -> str:
         """Provide route recommendations"""
+        route = self._plan_route(context, match)
+        if route:
+            stops = " → ".join(stop["station_name"] for stop in route["path"])
+            advice = (f"Take {stops}. About {route['travel_minutes']:.0f} minutes with "
+                      f"{route['interchanges']} interchange(s).")
+            if route["travel_minutes"] > route["fastest_travel_minutes"]:
+                advice += " This avoids crowded stations on the fastest route."
+            return advice
         return ("The Hyderabad Metro has 3 main lines. Red Line connects Miyapur to LB Nagar, "
                 "Green Line runs from Nagole to JNTU, and Blue Line serves the IT corridor from "
                 "Raidurg to Hitech City. Where would you like to go?")
-    
-    def _get_crowd_info(self, context: Dict = None) -> str:
-        """Provide crowd-related information"""
+
+    def _endpoints(self, context: Dict, match: Optional[QueryMatch]):
+        """Origin and destination ids from the context, else the query's from/to stations (or its first two)"""
+        origin, destination = context.get("origin"), context.get("destination")
+        if match is not None:
+            named = [s.station_id for s in match.stations]
+            from_station, to_station = match.role("origin"), match.role("destination")
+            if origin is None:
+                origin = from_station.station_id if from_station else next(
+                    (sid for sid in named if not to_station or sid != to_station.station_id), None)
+            if destination is None:
+                destination = to_station.station_id if to_station else next(
+                    (sid for sid in named if sid != origin), None)
+        if origin is None or destination is None:
+            return None, None
+        return route_planner.resolve_station(origin), route_planner.resolve_station(destination)
+
+    def _plan_route(self, context: Dict = None, match: QueryMatch = None) -> Optional[Dict]:
+        """Resolve origin and destination from context or the matched stations"""
+        origin_id, destination_id = self._endpoints(context or {}, match)
+        if origin_id is None or destination_id is None:
+            return None
+        try:
+            return route_planner.plan_route(origin_id, destination_id)
+        except (KeyError, ValueError):
+            return None
+
+    def _get_crowd_info(self, state: Optional[NetworkState], stations: List[int]) -> str:
+        """Provide crowd-related information from the live snapshot"""
+        if state is not None and len(state):
+            rows = [state.index[sid] for sid in stations[:3] if sid in state.index]
+            if rows:
+                return " ".join(
+                    f"{state.names[row]} ({state.lines[state.station_line[row]]} line) is "
+                    f"{state.stations[row].get('status', 'UNKNOWN')} right now with "
+                    f"{int(state.passengers[row])} passengers." for row in rows)
+            if not stations:
+                busiest = np.argsort(-state.passengers, kind="stable")[:3].tolist()
+                names = ", ".join(f"{state.names[row]} ({int(state.passengers[row])})" for row in busiest)
+                return (f"{int(state.passengers.sum())} passengers across {len(state)} stations right now. "
+                        f"Busiest: {names}.")
+
         current_hour = datetime.now().hour
         if 9 <= current_hour <= 11:
             return ("Currently in morning peak hours (9-11 AM). Stations like Ameerpet, "
@@ -57,14 +181,39 @@ class AIAssistantEngine:
                    "stations (Hitech City, Gachibowli) and major interchanges like Ameerpet.")
         else:
             return "Good time to travel! Off-peak hours mean less crowding and shorter wait times."
-    
+
+    def _get_incident_info(self, stations: List[int]) -> str:
+        """Active incidents at the mentioned stations, or across the network"""
+        if stations:
+            incidents = [i for sid in stations[:3] for i in incident_engine.get_active_incidents(sid)]
+            if not incidents:
+                return "No active disruptions reported at that station."
+        else:
+            incidents = incident_engine.get_active_incidents()
+            if not incidents:
+                return "No active disruptions on the network right now."
+        shown = "; ".join(f"{i['description']} at station {i['station_id']} (until about {i['resolves_at'][11:16]})"
+                          for i in incidents[:3])
+        more = f" and {len(incidents) - 3} more" if len(incidents) > 3 else ""
+        return f"{len(incidents)} active disruption(s): {shown}{more}."
+
     def _get_timing_info(self) -> str:
         """Provide timing information"""
         return ("Hyderabad Metro operates from 6:00 AM to 11:00 PM daily. First train starts at 6 AM, "
                 "last train departs around 10:30 PM from terminal stations.")
-    
-    def _get_fare_info(self) -> str:
-        """Provide fare information"""
+
+    def _get_fare_info(self, match: QueryMatch = None) -> str:
+        """Provide fare information; the exact fare when the query names two stations"""
+        origin_id, destination_id = self._endpoints({}, match)
+        if origin_id is not None and destination_id is not None:
+            fares = revenue_engine.fares
+            fares.ensure()
+            origin, destination = fares.positions([origin_id, destination_id])
+            if origin >= 0 and destination >= 0:
+                fare = float(fares.fares(np.array([origin]), np.array([destination]))[0])
+                if fare > 0:
+                    names = self.matcher.names
+                    return f"The fare from {names.get(origin_id)} to {names.get(destination_id)} is ₹{fare:.0f}."
         return ("Metro fares are distance-based, starting from ₹10 for short distances up to ₹60 for "
                 "longer journeys. You can use metro cards, QR codes, or mobile payment apps like "
                 "PhonePe, Paytm, and GPay.")
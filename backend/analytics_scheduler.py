@@ -0,0 +1,209 @@
+"""
+Analytics Snapshot Scheduler
+Builds one immutable analytics snapshot per data tick; endpoints only read the latest one
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional
+
+from engine_registry import engines
+from network_state import NetworkState
+from shared_state import StateBackend, shared_state, worker_id
+from telemetry import telemetry
+
+logger = logging.getLogger("HydroFlow.Scheduler")
+
+metro_topology = engines.proxy("topology")
+analytics_engine = engines.proxy("analytics")
+flow_analyzer = engines.proxy("flow")
+revenue_engine = engines.proxy("revenue")
+
+
+class AnalyticsSnapshot(NamedTuple):
+    seq: int
+    created_at: float
+    duration_ms: float
+    results: Mapping[str, object]
+    errors: Mapping[str, str]
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.created_at
+
+    def describe(self) -> Dict:
+        """Snapshot metadata for analytics response bodies (age goes in a header so bodies stay cacheable)"""
+        return {
+            "seq": self.seq,
+            "generated_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "build_ms": self.duration_ms
+        }
+
+
+def default_jobs() -> Dict[str, Callable[[NetworkState], object]]:
+    """Independent analytics run once per tick, keyed by the name endpoints read them under.
+
+    The engines are resolved when a job runs, so building the scheduler loads none of them.
+    """
+    return {
+        "crowd_patterns": lambda state: analytics_engine.analyze_crowd_patterns(),
+        "anomalies": lambda state: analytics_engine.detect_anomalies(state),
+        "bottlenecks": lambda state: analytics_engine.identify_bottlenecks(state),
+        "network_flow": lambda state: analytics_engine.analyze_network_flow(state),
+        "peak_hours": lambda state: analytics_engine.detect_peak_hours(datetime.now().hour),
+        "revenue": lambda state: revenue_engine.calculate_corridor_revenue(state),
+        "flow_path": lambda state: flow_analyzer.analyze_flow_path(state),
+    }
+
+
+class AnalyticsScheduler:
+    """Runs every analytics job concurrently on a thread pool once per tick.
+
+    Each tick's status is converted to a NetworkState once; the per-tick hooks and
+    every job share that columnar view instead of re-walking the station dicts. The
+    topology is synced with it before the hooks run, so the concurrent jobs find the
+    graph current and none of them rebuilds it.
+
+    With a shared state backend, only the worker holding the "scheduler" lease reads
+    the source, and it publishes each status to the backend. The other workers poll
+    the published version every follow_interval seconds and apply each new status.
+    So all workers build their snapshots, and run their hooks, on the same data. If
+    the leader stops renewing the lease, another worker takes over after lease_ticks
+    intervals.
+    """
+
+    def __init__(self, interval: float = 5.0, max_workers: int = 4, jobs: Dict[str, Callable] = None,
+                 state: StateBackend = shared_state, follow_interval: float = 0.5, lease_ticks: int = 3):
+        self.interval = interval
+        self.state = state
+        self.follow_interval = follow_interval
+        self.lease_ticks = lease_ticks
+        self.owner = worker_id()
+        self.leader = False
+        self.jobs = jobs or default_jobs()
+        self.source: Optional[Callable[[], Dict]] = None
+        self.on_tick: List[Callable[[NetworkState], None]] = []
+        self.latest: Optional[AnalyticsSnapshot] = None
+        self._first_snapshot = threading.Event()
+        self.latest_status: Optional[Dict] = None
+        self.latest_state: Optional[NetworkState] = None
+        self.status_seq = 0
+        self.overruns = 0
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analytics")
+        self._task: Optional[asyncio.Task] = None
+        self._seq = 0
+        self._published_version = 0
+
+    def configure(self, source: Callable[[], Dict], on_tick: List[Callable[[NetworkState], None]] = ()):
+        """Set the status source ({"stations", "trains"}) and per-tick hooks"""
+        self.source = source
+        self.on_tick = list(on_tick)
+
+    def read_status(self) -> NetworkState:
+        """Fetch one status from the source, build its NetworkState and run the per-tick hooks on it"""
+        status = self.source()
+        if self.state.shared:
+            self._published_version = self.state.put("snapshot", "status", status)
+        return self._apply(status)
+
+    def follow(self) -> Optional[NetworkState]:
+        """Apply the status the leader last published; None when there is nothing new"""
+        version = self.state.version("snapshot")
+        if version == self._published_version:
+            return None
+        status = self.state.get("snapshot", "status")
+        if status is None:
+            return None
+        self._published_version = version
+        return self._apply(status)
+
+    def _apply(self, status: Dict) -> NetworkState:
+        state = NetworkState.from_status(status)
+        metro_topology.sync(state)
+        for hook in self.on_tick:
+            hook(state)
+        self.latest_status = state.status
+        self.latest_state = state
+        self.status_seq += 1
+        return state
+
+    @telemetry.timed("scheduler")
+    def build_snapshot(self, state: NetworkState) -> AnalyticsSnapshot:
+        """Run all jobs against one state and publish the result as the latest snapshot"""
+        start = time.perf_counter()
+        futures = {name: self._executor.submit(job, state) for name, job in self.jobs.items()}
+
+        results, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.exception("Analytics job %s failed", name)
+                errors[name] = str(e)
+
+        self._seq += 1
+        snapshot = AnalyticsSnapshot(
+            seq=self._seq,
+            created_at=time.time(),
+            duration_ms=round((time.perf_counter() - start) * 1000, 2),
+            results=MappingProxyType(results),
+            errors=MappingProxyType(errors)
+        )
+        self.latest = snapshot
+        self._first_snapshot.set()
+        return snapshot
+
+    def get_snapshot(self, timeout: float = 0.0) -> Optional[AnalyticsSnapshot]:
+        """Latest snapshot, waiting up to timeout seconds for the first tick; None if it has not landed.
+
+        Snapshots are only ever built by the tick loop, so a request never runs the hooks
+        or, on a follower, reads the source behind the leader's back.
+        """
+        if self.latest is None:
+            self._first_snapshot.wait(timeout)
+        return self.latest
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                self.leader = not self.state.shared or await loop.run_in_executor(
+                    None, self.state.acquire_lease, "scheduler", self.owner, self.lease_ticks * self.interval)
+                # Off the event loop: the first tick's hooks import and build their engines
+                state = await loop.run_in_executor(None, self.read_status if self.leader else self.follow)
+                if state is not None:
+                    await loop.run_in_executor(None, self.build_snapshot, state)
+            except Exception:
+                logger.exception("Analytics tick failed")
+            elapsed = loop.time() - started
+            if elapsed > self.interval:
+                self.overruns += 1
+                logger.warning("Analytics tick took %.2fs, over the %.2fs budget", elapsed, self.interval)
+            await asyncio.sleep(max(0.0, (self.interval if self.leader else self.follow_interval) - elapsed))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # Threads start on first use, so the replacement costs nothing until the scheduler is used again
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analytics")
+
+
+# Global instance
+analytics_scheduler = AnalyticsScheduler()
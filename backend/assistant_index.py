@@ -0,0 +1,255 @@
+"""
+Assistant Query Index
+One-pass intent, marker and station matching for assistant queries, with trigram fuzzy lookup
+"""
+
+import re
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from metro_topology import metro_topology
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_ELIDED = re.compile(r"[.'’]")
+
+# Phrase -> intent; matched on word boundaries over the normalized query
+INTENT_KEYWORDS = {
+    "route": ("route", "routes", "how to", "how do i get", "how can i get", "directions", "way to", "get to",
+              "go to", "going to", "travel from", "reach", "path"),
+    "crowd": ("crowd", "crowded", "crowds", "busy", "rush", "packed", "full", "occupancy", "status", "people"),
+    "incident": ("delay", "delays", "delayed", "incident", "incidents", "disruption", "disruptions", "breakdown"),
+    "timing": ("time", "timing", "timings", "when", "first train", "last train", "schedule", "open", "close",
+               "frequency", "how often", "hours"),
+    "fare": ("fare", "fares", "cost", "costs", "price", "ticket", "tickets", "how much", "charge"),
+}
+# Words that give the station that follows them a role in the query
+ROLE_MARKERS = {"from": "origin", "to": "destination", "towards": "destination", "till": "destination",
+                "until": "destination", "at": "station", "near": "station"}
+STOPWORDS = frozenset(("the", "a", "an", "is", "are", "it", "i", "me", "my", "now", "right", "there", "in", "on",
+                       "of", "and", "or", "what", "how", "much", "many", "which", "station", "metro", "line",
+                       "train", "trains", "please", "today", "currently", "any", "go", "get", "can", "do", "does",
+                       "will", "be", "for", "with", "should", "take", "need", "want", "you", "tell", "about"))
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop dots and apostrophes, and collapse other punctuation to single spaces"""
+    return _NON_WORD.sub(" ", _ELIDED.sub("", text.lower())).strip()
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    kind: str       # "intent", "marker" or "station"
+    value: object   # intent name, role or station id
+
+
+class AhoCorasick:
+    """Character-level Aho-Corasick automaton over normalized phrases.
+
+    ``search`` walks the text once, following goto/fail transitions, and reports every
+    phrase occurrence that starts and ends on a word boundary.
+    """
+
+    def __init__(self, phrases: Iterable[Tuple[str, object]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[List[Tuple[int, object]]] = [[]]
+        for phrase, payload in phrases:
+            node = 0
+            for char in phrase:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][char] = nxt
+                    self._goto.append({})
+                    self._output.append([])
+                node = nxt
+            self._output[node].append((len(phrase), payload))
+
+        # Breadth-first fail links; each node also inherits the outputs of its fail node
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text: str) -> List[Tuple[int, int, object]]:
+        """(start, end, payload) for every word-bounded phrase occurrence in text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = []
+        node = 0
+        size = len(text)
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node] and (index + 1 == size or text[index + 1] == " "):
+                for length, payload in output[node]:
+                    start = index + 1 - length
+                    if start == 0 or text[start - 1] == " ":
+                        found.append((start, index + 1, payload))
+        return found
+
+
+class TrigramIndex:
+    """Station names by character trigram, scored with the Dice coefficient"""
+
+    def __init__(self, names: Dict[str, int]):
+        self._keys = list(names)
+        self._values = [names[key] for key in self._keys]
+        self._sizes = []
+        self._postings: Dict[str, List[int]] = {}
+        for slot, key in enumerate(self._keys):
+            grams = self.trigrams(key)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(slot)
+
+    @staticmethod
+    def trigrams(text: str) -> set:
+        padded = f"  {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def lookup(self, text: str, threshold: float = 0.6) -> Optional[Tuple[object, str, float]]:
+        """Best (value, key, score) at or above threshold, else None"""
+        grams = self.trigrams(text)
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for slot in self._postings.get(gram, ()):
+                shared[slot] = shared.get(slot, 0) + 1
+        best, best_score = None, threshold
+        for slot, count in shared.items():
+            score = 2.0 * count / (len(grams) + self._sizes[slot])
+            if score >= best_score:
+                best, best_score = slot, score
+        if best is None:
+            return None
+        return self._values[best], self._keys[best], round(best_score, 3)
+
+
+class StationMention(NamedTuple):
+    station_id: int
+    name: str
+    text: str
+    role: Optional[str]
+    score: float    # 1.0 for exact name/alias matches, the trigram score for fuzzy ones
+
+
+class QueryMatch(NamedTuple):
+    text: str
+    intents: List[str]
+    stations: List[StationMention]
+
+    def role(self, role: str) -> Optional[StationMention]:
+        return next((s for s in self.stations if s.role == role), None)
+
+
+class QueryMatcher:
+    """Intent keywords, role markers and every station name and alias in one automaton.
+
+    Aliases come from the topology config's ``aliases`` map (station name -> list of
+    alternative names). Each name also matches with its spaces removed
+    ("hitechcity"). The automaton and trigram index are rebuilt when the topology
+    version changes. Query words left unmatched are tried as 1-3 word spans against the
+    trigram index, so misspelled names still resolve.
+    """
+
+    def __init__(self, topology=metro_topology, fuzzy_threshold: float = 0.6, max_span_words: int = 3):
+        self.topology = topology
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_span_words = max_span_words
+        self.names: Dict[int, str] = {}
+        self._automaton = AhoCorasick(self._keyword_phrases())
+        self._trigrams = TrigramIndex({})
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keyword_phrases() -> List[Tuple[str, Tuple[str, object]]]:
+        phrases = [(phrase, ("intent", intent)) for intent, words in INTENT_KEYWORDS.items() for phrase in words]
+        phrases += [(word, ("marker", role)) for word, role in ROLE_MARKERS.items()]
+        return phrases
+
+    def _ensure(self):
+        if self._version == self.topology.version:
+            return
+        with self._lock:
+            if self._version == self.topology.version:
+                return
+            aliases = {normalize(name): names for name, names in self.topology.config.get("aliases", {}).items()}
+            self.names = {s["id"]: s["name"] for s in self.topology.stations}
+            station_phrases: Dict[str, int] = {}
+            for station_id, name in self.names.items():
+                key = normalize(name)
+                for variant in (key, key.replace(" ", ""), *map(normalize, aliases.get(key, ()))):
+                    if variant:
+                        station_phrases.setdefault(variant, station_id)
+            self._automaton = AhoCorasick(self._keyword_phrases()
+                                          + [(p, ("station", sid)) for p, sid in station_phrases.items()])
+            self._trigrams = TrigramIndex(station_phrases)
+            self._version = self.topology.version
+
+    @staticmethod
+    def _leftmost_longest(found: List[Tuple[int, int, object]]) -> List[Match]:
+        """Non-overlapping matches, preferring earlier then longer ones"""
+        selected, cursor = [], 0
+        for start, end, (kind, value) in sorted(found, key=lambda m: (m[0], m[0] - m[1])):
+            if start >= cursor:
+                selected.append(Match(start, end, kind, value))
+                cursor = end
+        return selected
+
+    def _fuzzy(self, text: str, matches: List[Match]) -> List[Match]:
+        """Station matches for runs of unmatched, non-stopword query words"""
+        covered = [False] * len(text)
+        for match in matches:
+            covered[match.start:match.end] = [True] * (match.end - match.start)
+        words = [(m.start(), m.end()) for m in re.finditer(r"\S+", text)
+                 if not covered[m.start()] and text[m.start():m.end()] not in STOPWORDS]
+
+        fuzzy, used = [], set()
+        for size in range(min(self.max_span_words, len(words)), 0, -1):
+            for first in range(len(words) - size + 1):
+                span = words[first:first + size]
+                if any(i in used for i in range(first, first + size)):
+                    continue
+                # Only contiguous words (a single space apart) form a span
+                if any(b[0] != a[1] + 1 for a, b in zip(span, span[1:])):
+                    continue
+                start, end = span[0][0], span[-1][1]
+                if end - start < 4:
+                    continue
+                hit = self._trigrams.lookup(text[start:end], self.fuzzy_threshold)
+                if hit is not None:
+                    fuzzy.append((Match(start, end, "station", hit[0]), hit[2]))
+                    used.update(range(first, first + size))
+        return fuzzy
+
+    def match(self, query: str) -> QueryMatch:
+        self._ensure()
+        text = normalize(query)
+        matches = self._leftmost_longest(self._automaton.search(text))
+        scored = [(m, 1.0) for m in matches] + self._fuzzy(text, matches)
+        scored.sort(key=lambda item: item[0].start)
+
+        intents, stations, role = [], [], None
+        for match, score in scored:
+            if match.kind == "intent":
+                if match.value not in intents:
+                    intents.append(match.value)
+                # "get to", "travel from": a trailing marker word still assigns the next station's role
+                role = ROLE_MARKERS.get(text[match.start:match.end].rsplit(" ", 1)[-1], role)
+            elif match.kind == "marker":
+                role = match.value
+            else:
+                stations.append(StationMention(match.value, self.names.get(match.value, ""),
+                                               text[match.start:match.end], role, score))
+                role = None
+        return QueryMatch(text, intents, stations)
@@ -0,0 +1,240 @@
+"""
+Forecast Backtesting
+Walk-forward evaluation of the forecast models, parallel over stations via shared memory
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ml_prediction_engine import MLPredictionEngine
+from shared_state import InProcessBackend, StateBackend, shared_state
+
+logger = logging.getLogger("HydroFlow.Backtesting")
+
+MODELS = ("sma", "exponential", "polynomial")
+# Per (station, horizon step): 3x3 error cross-products, 3 absolute errors, actual sum
+_OUTPUT_WIDTH = len(MODELS) ** 2 + len(MODELS) + 1
+
+
+_engine: Optional[MLPredictionEngine] = None
+
+
+def _forecaster() -> MLPredictionEngine:
+    # Stateless use only (no store, cache or shared state), one per worker process
+    global _engine
+    if _engine is None:
+        _engine = MLPredictionEngine(store=None, cache=None, state=InProcessBackend())
+    return _engine
+
+
+def evaluate_block(history: np.ndarray, lookback: int, horizon: int, step: int = 1) -> np.ndarray:
+    """Walk-forward error sums for a block of stations.
+
+    Every forecast origin of every station is evaluated in one batched
+    predict_crowd_batch call over all (station, origin) windows. Returns a
+    stations x horizon x _OUTPUT_WIDTH array of sums over origins.
+    """
+    windows = sliding_window_view(history, lookback + horizon, axis=1)[:, ::step]
+    stations, origins = windows.shape[:2]
+    train = windows[..., :lookback].reshape(-1, lookback)
+    actual = windows[..., lookback:]
+
+    forecasts = _forecaster().predict_crowd_batch(train, horizon, "ensemble")
+    errors = np.stack([forecasts[m].reshape(stations, origins, horizon) - actual for m in MODELS])
+
+    out = np.empty((stations, horizon, _OUTPUT_WIDTH))
+    out[..., :9] = np.einsum("isoh,jsoh->shij", errors, errors).reshape(stations, horizon, 9)
+    out[..., 9:12] = np.abs(errors).sum(axis=2).transpose(1, 2, 0)
+    out[..., 12] = actual.sum(axis=1)
+    return out
+
+
+def _evaluate_shared(history_name: str, output_name: str, shape: Tuple[int, int], rows: Tuple[int, int],
+                     lookback: int, horizon: int, step: int):
+    """Process pool task: read a row range of the shared history, write its sums to the shared output"""
+    history_block = shared_memory.SharedMemory(name=history_name)
+    output_block = shared_memory.SharedMemory(name=output_name)
+    try:
+        history = np.ndarray(shape, dtype=np.float64, buffer=history_block.buf)
+        output = np.ndarray((shape[0], horizon, _OUTPUT_WIDTH), dtype=np.float64, buffer=output_block.buf)
+        start, end = rows
+        output[start:end] = evaluate_block(history[start:end], lookback, horizon, step)
+        del history, output
+    finally:
+        history_block.close()
+        output_block.close()
+
+
+class BacktestResult(NamedTuple):
+    station_ids: List[int]
+    lookback: int
+    horizon: int
+    origins: int
+    covariance: np.ndarray     # stations x horizon x 3 x 3 mean error cross-products
+    mae: np.ndarray            # stations x horizon x 3
+    mean_actual: np.ndarray    # stations x horizon
+    weights: Dict[str, float]
+    duration_ms: float
+
+    @property
+    def ensemble_rmse(self) -> np.ndarray:
+        """Stations x horizon RMSE of the fitted ensemble, exact from the error covariance"""
+        w = np.array([self.weights[m] for m in MODELS])
+        return np.sqrt(np.maximum(np.einsum("i,shij,j->sh", w, self.covariance, w), 0))
+
+    @property
+    def relative_rmse(self) -> np.ndarray:
+        """Ensemble RMSE as a fraction of the mean observed count, stations x horizon"""
+        return self.ensemble_rmse / np.maximum(self.mean_actual, 1.0)
+
+    def describe(self) -> Dict:
+        model_rmse = np.sqrt(np.diagonal(self.covariance, axis1=2, axis2=3).mean(axis=0))
+        return {
+            "stations": len(self.station_ids),
+            "lookback_hours": self.lookback,
+            "horizon_hours": self.horizon,
+            "origins_per_station": self.origins,
+            "weights": self.weights,
+            "rmse_by_hour": {
+                **{m: model_rmse[:, i].round(2).tolist() for i, m in enumerate(MODELS)},
+                "ensemble": self.ensemble_rmse.mean(axis=0).round(2).tolist()
+            },
+            "mae_by_hour": {m: self.mae[..., i].mean(axis=0).round(2).tolist() for i, m in enumerate(MODELS)},
+            "median_relative_rmse_by_hour": np.median(self.relative_rmse, axis=0).round(4).tolist(),
+            "duration_ms": self.duration_ms
+        }
+
+
+def fit_weights(covariance: np.ndarray, mean_actual: np.ndarray, ridge: float = 1e-6) -> Dict[str, float]:
+    """Minimum-variance combination weights (summing to 1, non-negative).
+
+    Error cross-products are scaled by each station's level so busy stations do not
+    dominate, pooled over stations and horizons, then w = S^-1 1 / (1' S^-1 1).
+    """
+    scale = np.maximum(mean_actual, 1.0)[..., np.newaxis, np.newaxis] ** 2
+    pooled = (covariance / scale).mean(axis=(0, 1))
+    pooled += np.eye(len(MODELS)) * ridge * max(np.trace(pooled), 1e-12)
+    try:
+        w = np.linalg.solve(pooled, np.ones(len(MODELS)))
+    except np.linalg.LinAlgError:
+        w = 1.0 / np.maximum(np.diag(pooled), 1e-12)
+    w = np.clip(w, 0, None)
+    if w.sum() <= 0:
+        w = np.ones(len(MODELS))
+    w /= w.sum()
+    return {m: round(float(v), 4) for m, v in zip(MODELS, w)}
+
+
+class Backtester:
+    """Walk-forward backtests over a stations x hours history.
+
+    Stations are split into blocks evaluated by a process pool. The history and the
+    per-block results live in shared memory, so workers receive only block bounds.
+    Small jobs (under parallel_threshold windows) run in-process. Either way a block
+    holds at most block_windows (station, origin) windows at a time.
+    With a shared state backend the latest summary is published, so every worker
+    reports the same last backtest.
+    """
+
+    def __init__(self, lookback: int = 24, horizon: int = 3, step: int = 1, max_workers: Optional[int] = None,
+                 parallel_threshold: int = 200_000, block_windows: int = 100_000, state: StateBackend = shared_state):
+        self.lookback = lookback
+        self.horizon = horizon
+        self.step = step
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+        self.block_windows = block_windows
+        self.state = state
+        self.last_result: Optional[BacktestResult] = None
+
+    def last_summary(self) -> Optional[Dict]:
+        """describe() of the latest backtest run on any worker"""
+        if self.state.shared:
+            return self.state.get("backtest", "last")
+        return None if self.last_result is None else self.last_result.describe()
+
+    def _blocks(self, stations: int, origins: int, workers: int) -> List[Tuple[int, int]]:
+        """Station row ranges: a few per worker, each small enough to bound window memory"""
+        size = max(1, min(math.ceil(stations / (workers * 4)), self.block_windows // max(origins, 1)))
+        return [(start, min(start + size, stations)) for start in range(0, stations, size)]
+
+    def _evaluate(self, history: np.ndarray, origins: int) -> np.ndarray:
+        out = np.empty((history.shape[0], self.horizon, _OUTPUT_WIDTH))
+        for start, end in self._blocks(history.shape[0], origins, 1):
+            out[start:end] = evaluate_block(history[start:end], self.lookback, self.horizon, self.step)
+        return out
+
+    def _evaluate_parallel(self, history: np.ndarray, origins: int) -> np.ndarray:
+        shape = history.shape
+        history_block = shared_memory.SharedMemory(create=True, size=history.nbytes)
+        output_block = shared_memory.SharedMemory(create=True, size=shape[0] * self.horizon * _OUTPUT_WIDTH * 8)
+        try:
+            shared = np.ndarray(shape, dtype=np.float64, buffer=history_block.buf)
+            shared[:] = history
+            del shared
+            # spawn keeps workers clear of the server's threads and event loop
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context) as pool:
+                futures = [pool.submit(_evaluate_shared, history_block.name, output_block.name, shape, rows,
+                                       self.lookback, self.horizon, self.step)
+                           for rows in self._blocks(shape[0], origins, self.max_workers)]
+                for future in futures:
+                    future.result()
+            output = np.ndarray((shape[0], self.horizon, _OUTPUT_WIDTH), dtype=np.float64, buffer=output_block.buf)
+            sums = output.copy()
+            del output  # release the buffer export before closing the block
+            return sums
+        finally:
+            history_block.close()
+            history_block.unlink()
+            output_block.close()
+            output_block.unlink()
+
+    def run(self, history: np.ndarray, station_ids: Sequence[int] = None) -> BacktestResult:
+        """Backtest every station of a stations x hours history"""
+        start = time.perf_counter()
+        history = np.ascontiguousarray(history, dtype=np.float64)
+        if history.ndim != 2:
+            raise ValueError("history must be a 2-D stations x hours matrix")
+        if history.shape[1] < self.lookback + self.horizon:
+            raise ValueError(f"Backtest needs at least {self.lookback + self.horizon} hours of history")
+        station_ids = list(station_ids) if station_ids is not None else list(range(1, history.shape[0] + 1))
+
+        origins = len(range(0, history.shape[1] - self.lookback - self.horizon + 1, self.step))
+        if self.max_workers > 1 and history.shape[0] * origins >= self.parallel_threshold:
+            sums = self._evaluate_parallel(history, origins)
+        else:
+            sums = self._evaluate(history, origins)
+
+        covariance = sums[..., :9].reshape(-1, self.horizon, 3, 3) / origins
+        mae = sums[..., 9:12] / origins
+        mean_actual = sums[..., 12] / origins
+        result = BacktestResult(
+            station_ids=station_ids,
+            lookback=self.lookback,
+            horizon=self.horizon,
+            origins=origins,
+            covariance=covariance,
+            mae=mae,
+            mean_actual=mean_actual,
+            weights=fit_weights(covariance, mean_actual),
+            duration_ms=round((time.perf_counter() - start) * 1000, 1)
+        )
+        self.last_result = result
+        if self.state.shared:
+            self.state.put("backtest", "last", result.describe())
+        logger.info("Backtested %d stations x %d origins in %.1f ms", len(station_ids), origins, result.duration_ms)
+        return result
+
+
+# Global instance
+backtester = Backtester()
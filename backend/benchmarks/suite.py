@@ -0,0 +1,348 @@
+"""
+Benchmark Suite
+Throughput and p50/p99 latency of the engines and ASGI endpoints on synthetic networks
+
+Run from the backend directory:
+    python -m benchmarks.suite --output benchmarks/baselines/local.json
+    python -m benchmarks.suite --compare benchmarks/baselines/local.json --threshold 0.25
+
+Engine cases run against fresh, isolated engine instances for every network size.
+Endpoint cases drive main.app in-process through the ASGI interface with the metro
+feed replaced by a SyntheticNetwork. --compare exits with status 1 when any shared
+metric regresses by more than the threshold.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from benchmarks.synthetic import SyntheticNetwork
+
+DEFAULT_SIZES = "27,1000,10000"
+DEFAULT_ENDPOINT_SIZES = "27,1000"
+# Lower is better for latencies, higher for throughput
+METRIC_DIRECTIONS = {"p50_ms": 1, "p99_ms": 1, "mean_ms": 1, "ops_per_sec": -1}
+
+
+def summarize(durations_ns: List[int]) -> Dict:
+    samples = np.asarray(durations_ns, dtype=np.float64) / 1e6
+    return {
+        "iterations": len(samples),
+        "ops_per_sec": round(1000.0 / samples.mean(), 2),
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+    }
+
+
+def measure(fn: Callable[[], object], seconds: float, warmup: int = 3,
+            min_iterations: int = 5, max_iterations: int = 100000) -> Dict:
+    """Call fn repeatedly for about `seconds` and summarize per-call latency"""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    deadline = time.perf_counter() + seconds
+    while len(durations) < max_iterations and (len(durations) < min_iterations or time.perf_counter() < deadline):
+        start = time.perf_counter_ns()
+        fn()
+        durations.append(time.perf_counter_ns() - start)
+    return summarize(durations)
+
+
+async def measure_async(fn, seconds: float, warmup: int = 3,
+                        min_iterations: int = 5, max_iterations: int = 100000) -> Dict:
+    for _ in range(warmup):
+        await fn()
+    durations = []
+    deadline = time.perf_counter() + seconds
+    while len(durations) < max_iterations and (len(durations) < min_iterations or time.perf_counter() < deadline):
+        start = time.perf_counter_ns()
+        await fn()
+        durations.append(time.perf_counter_ns() - start)
+    return summarize(durations)
+
+
+class ASGIClient:
+    """Minimal in-process HTTP client that calls an ASGI app directly.
+
+    Each request comes from a new client address so the rate limiter never rejects
+    the benchmark traffic but still does its full per-request work.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._clients = itertools.count(1)
+
+    async def request(self, method: str, url: str, body: bytes = b"",
+                      headers: Iterable[Tuple[bytes, bytes]] = ()) -> Tuple[int, Dict[bytes, bytes], bytes]:
+        n = next(self._clients)
+        path, _, query = url.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": [(b"host", b"testserver"), *headers],
+            "client": (f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}", 50000),
+            "server": ("testserver", 80),
+        }
+        if body:
+            scope["headers"] += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        response = {"status": None, "headers": {}, "body": []}
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = dict(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return response["status"], response["headers"], b"".join(response["body"])
+
+
+def engine_cases(size: int, seed: int = 0) -> Dict[str, Callable[[], object]]:
+    """Engine method calls on isolated instances sized for a synthetic network"""
+    from advanced_analytics import AdvancedAnalytics
+    from flow_analysis_engine import FlowAnalysisEngine
+    from history_store import StationHistoryStore
+    from metro_topology import MetroTopology
+    from ml_prediction_engine import MLPredictionEngine
+    from network_state import NetworkState
+    from od_matrix import ODMatrixEngine
+    from prediction_cache import PredictionCache
+    from revenue_engine import RevenueEngine
+    from route_planner import RoutePlanner
+    from streaming_stats import StreamingStatsEngine
+    from train_index import TrainPositionIndex
+
+    network = SyntheticNetwork(size, seed=seed)
+    topology = MetroTopology()
+    store = StationHistoryStore(capacity=14 * 24, max_stations=size, resolution_seconds=3600)
+    network.fill_store(store, 48)
+    analytics = AdvancedAnalytics(store, StreamingStatsEngine(), topology, TrainPositionIndex(topology))
+    planner = RoutePlanner(topology)
+    ml = MLPredictionEngine(store, PredictionCache())
+    od = ODMatrixEngine(topology)
+    revenue, flow = RevenueEngine(topology, od), FlowAnalysisEngine(od)
+
+    statuses = []
+    for _ in range(8):
+        status = network.get_network_status()
+        status["trains"] = network.get_train_status()["trains"]
+        statuses.append(status)
+    states = [NetworkState.from_status(status) for status in statuses]
+    state = states[-1]
+    analytics.record_snapshot(state)
+    planner.update_crowding(state)
+    od.observe(state)
+    history = network.history(24)
+
+    rng = np.random.default_rng(seed)
+    pairs = itertools.cycle(rng.integers(1, size + 1, size=(64, 2)).tolist())
+    rotating_states = itertools.cycle(states)
+    trips = rng.integers(1, size + 1, size=(100_000, 2))
+    trip_times = rng.integers(1_700_000_000, 1_700_086_400, size=100_000)
+
+    def plan_route():
+        origin, destination = next(pairs)
+        try:
+            return planner.plan_route(origin, destination)
+        except (KeyError, ValueError):
+            return None
+
+    return {
+        "network_state.build": lambda: NetworkState.from_status(statuses[-1]),
+        "analytics.record_snapshot": lambda: analytics.record_snapshot(next(rotating_states)),
+        "analytics.crowd_patterns": analytics.analyze_crowd_patterns,
+        "analytics.detect_anomalies": lambda: analytics.detect_anomalies(state),
+        "analytics.identify_bottlenecks": lambda: analytics.identify_bottlenecks(next(rotating_states)),
+        "analytics.network_flow": lambda: analytics.analyze_network_flow(state),
+        "revenue.corridor_revenue": lambda: revenue.calculate_corridor_revenue(state),
+        "revenue.aggregate_trips_100k": lambda: revenue.aggregate_trips(trips[:, 0], trips[:, 1], trip_times),
+        "flow.analyze_flow_path": lambda: flow.analyze_flow_path(state),
+        "od.refit": lambda: od.refresh(force=True),
+        "route.update_crowding": lambda: planner.update_crowding(next(rotating_states)),
+        "route.plan_route": plan_route,
+        "ml.predict_crowd_batch": lambda: ml.predict_crowd_batch(history, 3),
+        "ml.predict_stations": lambda: ml.predict_stations(hours_ahead=3),
+    }
+
+
+def middleware_cases() -> Dict[str, Callable[[], object]]:
+    """Size-independent middleware costs"""
+    from security import RateLimitMiddleware, SecurityHeaderMiddleware
+    from telemetry import MetricsMiddleware, Telemetry
+
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    limiter = RateLimitMiddleware(endpoint, requests_per_minute=100)
+    headers = SecurityHeaderMiddleware(endpoint)
+    ips = itertools.cycle([f"10.0.{i // 256}.{i % 256}" for i in range(20000)])
+    paths = itertools.cycle(["/status", "/analytics/overview", "/predictions/batch", "/route"])
+    client = ASGIClient(headers)
+    metrics_client = ASGIClient(MetricsMiddleware(endpoint, Telemetry()))
+    loop = asyncio.new_event_loop()
+
+    return {
+        "security.rate_limit_allow": lambda: limiter.allow(next(ips), limiter.route_cost(next(paths))),
+        "security.headers_asgi": lambda: loop.run_until_complete(client.request("GET", "/status")),
+        "telemetry.metrics_asgi": lambda: loop.run_until_complete(metrics_client.request("GET", "/status")),
+    }
+
+
+def endpoint_requests(size: int, etag: bytes) -> Dict[str, Tuple[str, str, bytes, List[Tuple[bytes, bytes]], int]]:
+    """name -> (method, url, body, headers, expected status)"""
+    batch = json.dumps({"history": np.round(SyntheticNetwork(50).history(24), 1).tolist()}).encode()
+    gzip = [(b"accept-encoding", b"gzip")]
+    return {
+        "GET /status": ("GET", "/status", b"", gzip, 200),
+        "GET /status (304)": ("GET", "/status", b"", [(b"if-none-match", etag)], 304),
+        "GET /analytics/overview": ("GET", "/analytics/overview", b"", gzip, 200),
+        "GET /analytics/bottlenecks": ("GET", "/analytics/bottlenecks", b"", gzip, 200),
+        "GET /analytics/patterns": ("GET", "/analytics/patterns?scope=network&window=15m", b"", [], 200),
+        "GET /route": ("GET", f"/route?origin=1&destination={max(2, size // 2)}", b"", [], 200),
+        "GET /predictions/{id}": ("GET", "/predictions/1?hours_ahead=3", b"", [], 200),
+        "POST /predictions/batch": ("POST", "/predictions/batch", batch, [], 200),
+    }
+
+
+def import_main():
+    """The main module, or None (with a note) when its dependencies are missing from this tree"""
+    try:
+        import main
+    except ImportError as e:
+        print(f"Skipping endpoint cases: cannot import main ({e})", file=sys.stderr)
+        return None
+    return main
+
+
+async def run_endpoints(app_module, sizes: List[int], seconds: float) -> Dict[str, Dict]:
+    """Endpoint latencies through app_module.app for each network size"""
+    client = ASGIClient(app_module.app)
+    results = {}
+    for size in sizes:
+        app_module.metro_manager = SyntheticNetwork(size)
+        scheduler = app_module.analytics_scheduler
+        results[f"scheduler.tick[{size}]"] = measure(lambda: scheduler.build_snapshot(scheduler.read_status()),
+                                                     seconds, warmup=1)
+
+        status, headers, _ = await client.request("GET", "/status")
+        for name, (method, url, body, extra, expected) in endpoint_requests(size, headers.get(b"etag", b"")).items():
+            async def call(method=method, url=url, body=body, extra=extra, expected=expected, name=name):
+                code, _, _ = await client.request(method, url, body, extra)
+                if code != expected:
+                    raise RuntimeError(f"{name} returned {code}, expected {expected}")
+            results[f"endpoint.{name}[{size}]"] = await measure_async(call, seconds)
+    return results
+
+
+def run(sizes: List[int], endpoint_sizes: List[int], seconds: float, pattern: str = "") -> Dict[str, Dict]:
+    # The global history store (created on first import) must fit the largest endpoint network
+    os.environ.setdefault("HISTORY_STORE_STATIONS", str(max(endpoint_sizes, default=64)))
+    results = {}
+    for name, fn in middleware_cases().items():
+        if pattern in name:
+            results[name] = measure(fn, seconds)
+            print(f"{name:48s} {format_result(results[name])}", file=sys.stderr)
+    for size in sizes:
+        for name, fn in engine_cases(size).items():
+            key = f"{name}[{size}]"
+            if pattern in key:
+                results[key] = measure(fn, seconds)
+                print(f"{key:48s} {format_result(results[key])}", file=sys.stderr)
+    app_module = import_main() if endpoint_sizes else None
+    if app_module is not None:
+        for key, result in asyncio.run(run_endpoints(app_module, endpoint_sizes, seconds)).items():
+            if pattern in key:
+                results[key] = result
+                print(f"{key:48s} {format_result(result)}", file=sys.stderr)
+    return results
+
+
+def format_result(result: Dict) -> str:
+    return (f"{result['ops_per_sec']:>12.1f} ops/s  p50 {result['p50_ms']:>9.3f} ms  "
+            f"p99 {result['p99_ms']:>9.3f} ms  n={result['iterations']}")
+
+
+def compare(current: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float,
+            metrics: List[str]) -> List[str]:
+    """Human-readable regressions of current against baseline beyond threshold"""
+    regressions = []
+    for key in sorted(set(current) & set(baseline)):
+        for metric in metrics:
+            before, after = baseline[key].get(metric), current[key].get(metric)
+            if not before or after is None:
+                continue
+            # Positive change is always "worse", whichever way the metric points
+            change = (after - before) / before * METRIC_DIRECTIONS[metric]
+            if change > threshold:
+                regressions.append(f"{key} {metric}: {before} -> {after} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated station counts for engine cases")
+    parser.add_argument("--endpoint-sizes", default=DEFAULT_ENDPOINT_SIZES,
+                        help="comma-separated station counts for endpoint cases (empty to skip)")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time budget per case")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--output", help="write results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--metrics", default="p50_ms,ops_per_sec", help="metrics checked by --compare")
+    args = parser.parse_args()
+
+    parse = lambda text: [int(part) for part in text.split(",") if part.strip()]
+    results = run(parse(args.sizes), parse(args.endpoint_sizes), args.seconds, args.filter)
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "seconds_per_case": args.seconds,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.metrics.split(","))
+        missing = sorted(set(baseline) - set(results))
+        if missing and not args.filter:
+            print(f"{len(missing)} baseline cases were not run: {', '.join(missing)}", file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.threshold:.0%}:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} in {len(set(results) & set(baseline))} shared cases",
+              file=sys.stderr)
+    elif not args.output:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,3 +5,9 @@
 pip install -r requirements.txt
 
 echo "✅ Backend dependencies installed successfully!"
+
+# Precompress the frontend bundle (.gz/.br) when it has been built, so it is served without per-request compression
+DIST="$(dirname "$0")/../frontend/dist"
+if [ -d "$DIST" ]; then
+    python "$(dirname "$0")/static_assets.py" "$DIST"
+fi
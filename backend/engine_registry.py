@@ -0,0 +1,191 @@
+"""
+Engine Registry
+Deferred construction of the engine singletons, background warm-up and a startup-time report
+"""
+
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("HydroFlow.Engines")
+
+# Left out of the per-engine package lists
+STDLIB = frozenset(getattr(sys, "stdlib_module_names", ()))
+
+# name -> (module, global instance); also the warm-up order, per-tick engines first
+ENGINES = {
+    "topology": ("metro_topology", "metro_topology"),
+    "route_planner": ("route_planner", "route_planner"),
+    "incident_impact": ("incident_impact", "incident_impact"),
+    "analytics": ("advanced_analytics", "analytics_engine"),
+    "flow": ("flow_analysis_engine", "flow_analyzer"),
+    "revenue": ("revenue_engine", "revenue_engine"),
+    "ml": ("ml_prediction_engine", "ml_engine"),
+    "prediction_service": ("prediction_service", "prediction_service"),
+    "assistant": ("ai_assistant_engine", "ai_assistant"),
+    "backtester": ("backtesting", "backtester"),
+}
+
+
+def process_started_at() -> float:
+    """Wall-clock start of this process (Linux /proc), else the time this module was imported"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesised command name; starttime (clock ticks after boot) is field 22
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class EngineLoad(NamedTuple):
+    name: str
+    module: str
+    started_ms: float       # since process start
+    load_ms: float          # import of the module (and any not yet imported dependency) plus construction
+    thread: str
+    modules_imported: int
+    packages: Tuple[str, ...]   # top-level packages first imported by this load
+
+
+class LazyEngine:
+    """Stands in for an engine singleton; the first attribute access imports and builds it"""
+
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry: "EngineRegistry", name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attribute):
+        return getattr(self._registry.get(self._name), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._registry.get(self._name), attribute, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._registry.loaded(self._name) else "not loaded"
+        return f"<LazyEngine {self._name} ({state})>"
+
+
+class EngineRegistry:
+    """Imports engine modules (and so builds their global instances) on first use.
+
+    ``proxy(name)`` returns a LazyEngine that can be imported and held where the
+    instance would be. Modules that stay unused are never imported, along with
+    their scipy / networkx dependencies. ``start_warm_up`` loads everything on a
+    daemon thread once the server is up. ``report`` shows, per engine, when it
+    loaded, how long it took, and which packages it pulled in. It also gives the
+    time from process start to each marked startup phase.
+
+    Each engine name has its own load lock, so importing one engine never blocks a
+    request for another that is already loaded or loads independently. Packages
+    imported while two loads overlap may be counted against either of them.
+    """
+
+    def __init__(self, engines: Dict[str, Tuple[str, str]] = None):
+        self.engines = dict(ENGINES if engines is None else engines)
+        self.started_at = process_started_at()
+        self.phases: Dict[str, float] = {}
+        self._instances: Dict[str, object] = {}
+        self._loads: Dict[str, EngineLoad] = {}
+        self._on_load: Dict[str, List[Callable[[object], None]]] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.RLock] = {}
+        self._warm_up: Optional[threading.Thread] = None
+
+    def _elapsed_ms(self) -> float:
+        return round((time.time() - self.started_at) * 1000, 1)
+
+    def mark(self, phase: str):
+        """Record the first time a startup phase is reached"""
+        if phase not in self.phases:
+            self.phases[phase] = self._elapsed_ms()
+
+    def loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def proxy(self, name: str) -> LazyEngine:
+        if name not in self.engines:
+            raise KeyError(f"Unknown engine: {name}")
+        return LazyEngine(self, name)
+
+    def on_load(self, name: str, callback: Callable[[object], None]):
+        """Run callback(instance) once the engine is built, or now if it already is"""
+        with self._lock:
+            if name not in self._instances:
+                self._on_load.setdefault(name, []).append(callback)
+                return
+        callback(self._instances[name])
+
+    def get(self, name: str):
+        """The engine instance, importing its module on first use"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        module, attribute = self.engines[name]
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.RLock())
+        with load_lock:
+            instance = self._instances.get(name)
+            if instance is not None:
+                return instance
+            before = set(sys.modules)
+            started_ms = self._elapsed_ms()
+            start = time.perf_counter()
+            instance = getattr(importlib.import_module(module), attribute)
+            load_ms = round((time.perf_counter() - start) * 1000, 1)
+            new_modules = set(sys.modules) - before
+            self._loads[name] = EngineLoad(
+                name, module, started_ms, load_ms, threading.current_thread().name, len(new_modules),
+                tuple(sorted({m.split(".", 1)[0] for m in new_modules if not m.startswith("_")} - STDLIB - {module}))
+            )
+            with self._lock:
+                self._instances[name] = instance
+                callbacks = self._on_load.pop(name, ())
+            for callback in callbacks:
+                callback(instance)
+        logger.info("Loaded %s in %.0f ms", name, load_ms)
+        return instance
+
+    def warm_up(self, names: Iterable[str] = None) -> Dict:
+        """Load the named engines (all by default) in registry order and return the report"""
+        for name in names or self.engines:
+            try:
+                self.get(name)
+            except Exception:
+                logger.exception("Warm-up of %s failed", name)
+        self.mark("warm_up_done")
+        report = self.report()
+        logger.info("Startup: %s", ", ".join(f"{phase} at {ms:.0f} ms" for phase, ms in report["phases"].items()))
+        return report
+
+    def start_warm_up(self, delay: float = 0.0) -> threading.Thread:
+        """Warm up on a daemon thread after delay seconds, so the server starts accepting requests first"""
+        if self._warm_up is None:
+            def run():
+                time.sleep(delay)
+                self.warm_up()
+            self._warm_up = threading.Thread(target=run, name="engine-warm-up", daemon=True)
+            self._warm_up.start()
+        return self._warm_up
+
+    def report(self) -> Dict:
+        loads = sorted(self._loads.values(), key=lambda load: load.started_ms)
+        return {
+            "process_started_at": self.started_at,
+            "phases": dict(sorted(self.phases.items(), key=lambda item: item[1])),
+            "engines": [load._asdict() for load in loads],
+            "pending": [name for name in self.engines if name not in self._instances],
+            "engine_load_ms": round(sum(load.load_ms for load in loads), 1),
+        }
+
+
+# Global instance
+engines = EngineRegistry()
@@ -0,0 +1,184 @@
+"""
+Station History Store
+Fixed-capacity ring buffers of per-station passenger counts, optionally memory-mapped
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class StationHistoryStore:
+    """Lockstep ring buffer holding one column per time bucket for every station.
+
+    Each row is allocated at twice the capacity and every value is written to both
+    halves, so any trailing window is a contiguous slice and can be returned as a
+    zero-copy view without unwrapping the ring.
+
+    A row costs 8 * capacity bytes, about 1 MB for the default 90 days of minutes.
+    In memory, rows are allocated as stations register (doubling, up to
+    max_stations), so usage follows the live station count; views taken before a
+    resize keep showing the old buffer. With a path, the store is a memory-mapped
+    .npy file sized for max_stations. The file is sparse, so disk blocks are only
+    used by rows that have been written.
+
+    Writes (registration, growth, advancing the head) are serialized by one lock, as
+    the scheduler's job threads and request threads both record. Reads take no lock.
+    """
+
+    def __init__(self, capacity: int = 90 * MINUTES_PER_DAY, max_stations: int = 4096,
+                 resolution_seconds: int = 60, path: Optional[str] = None):
+        self.capacity = capacity
+        self.max_stations = max_stations
+        self.resolution_seconds = resolution_seconds
+        self.path = path
+        self.station_index: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+        if path:
+            self._data = self._open_memmap(path, (max_stations, 2 * capacity), np.float32)
+            self._state = self._open_memmap(path + ".state.npy", (2,), np.int64)
+            index_path = path + ".stations.json"
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    self.station_index = {int(k): v for k, v in json.load(f).items()}
+        else:
+            self._data = np.zeros((0, 2 * capacity), dtype=np.float32)
+            self._state = np.zeros(2, dtype=np.int64)
+
+    @staticmethod
+    def _open_memmap(path: str, shape: tuple, dtype) -> np.ndarray:
+        """Open an existing .npy memmap or create a zeroed one"""
+        if os.path.exists(path):
+            array = np.lib.format.open_memmap(path, mode="r+")
+            if array.shape != shape or array.dtype != dtype:
+                raise ValueError(f"{path} has shape {array.shape}, expected {shape}")
+            return array
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    @property
+    def length(self) -> int:
+        """Number of buckets currently held (at most capacity)"""
+        return int(min(self._state[0], self.capacity))
+
+    @property
+    def station_ids(self) -> List[int]:
+        """Registered station ids in row order"""
+        return sorted(self.station_index, key=self.station_index.get)
+
+    def register(self, station_id: int) -> int:
+        """Return the row for a station, allocating one on first sight"""
+        with self._lock:
+            return self._register(station_id)
+
+    def _register(self, station_id: int) -> int:
+        row = self.station_index.get(station_id)
+        if row is not None:
+            return row
+        if len(self.station_index) >= self.max_stations:
+            raise ValueError(f"History store is full ({self.max_stations} stations)")
+        row = len(self.station_index)
+        if row >= len(self._data):
+            self._grow(row + 1)
+        self.station_index[station_id] = row
+        if self.path:
+            with open(self.path + ".stations.json", "w") as f:
+                json.dump(self.station_index, f)
+        return row
+
+    def _grow(self, rows: int):
+        """Reallocate the in-memory buffer with room for at least rows stations"""
+        grown = np.zeros((min(self.max_stations, max(8, 2 * rows)), 2 * self.capacity), dtype=np.float32)
+        grown[:len(self._data)] = self._data
+        self._data = grown
+
+    def _advance(self, timestamp: Optional[float]) -> int:
+        """Move the head to the bucket for timestamp, carrying values forward over gaps; call under _lock"""
+        bucket = int((time.time() if timestamp is None else timestamp) // self.resolution_seconds)
+        head, last_bucket = self._state
+        if head == 0:
+            self._state[:] = (1, bucket)
+            return 0
+        if bucket > last_bucket:
+            steps = int(min(bucket - last_bucket, self.capacity))
+            prev = (head - 1) % self.capacity
+            positions = (head + np.arange(steps)) % self.capacity
+            rows = len(self.station_index)
+            carried = self._data[:rows, prev][:, np.newaxis]
+            self._data[:rows, positions] = carried
+            self._data[:rows, positions + self.capacity] = carried
+            self._state[:] = (head + steps, bucket)
+        return int((self._state[0] - 1) % self.capacity)
+
+    def record(self, station_id: int, passengers: float, timestamp: Optional[float] = None):
+        """Record one station count into its current time bucket in O(1)"""
+        with self._lock:
+            row = self._register(station_id)
+            pos = self._advance(timestamp)
+            self._data[row, pos] = passengers
+            self._data[row, pos + self.capacity] = passengers
+
+    def record_many(self, station_ids: Sequence[int], passengers: Sequence[float],
+                    timestamp: Optional[float] = None):
+        """Record counts for many stations into the same time bucket"""
+        values = np.asarray(passengers, dtype=np.float32)
+        with self._lock:
+            rows = np.fromiter((self._register(s) for s in station_ids), dtype=np.intp)
+            pos = self._advance(timestamp)
+            self._data[rows, pos] = values
+            self._data[rows, pos + self.capacity] = values
+
+    def record_stations(self, stations: List[Dict], timestamp: Optional[float] = None):
+        """Record a live network snapshot of station dicts"""
+        self.record_many([s["id"] for s in stations], [s["passengers"] for s in stations], timestamp)
+
+    def _slice(self, samples: int) -> slice:
+        if samples > self.length:
+            raise ValueError(f"Only {self.length} samples available, requested {samples}")
+        end = (self._state[0] - 1) % self.capacity + self.capacity + 1
+        return slice(int(end - samples), int(end))
+
+    def window(self, station_id: int, samples: int) -> np.ndarray:
+        """Zero-copy view of the trailing samples for one station, oldest first"""
+        view = self._data[self.station_index[station_id], self._slice(samples)]
+        view.flags.writeable = False
+        return view
+
+    def matrix(self, samples: int, station_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Stations x samples trailing window; a view when reading all stations in row order"""
+        columns = self._slice(samples)
+        if station_ids is None:
+            view = self._data[:len(self.station_index), columns]
+            view.flags.writeable = False
+            return view
+        rows = [self.station_index[s] for s in station_ids]
+        return self._data[rows, columns]
+
+    def hourly(self, hours: int, station_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Stations x hours mean counts over the trailing window"""
+        per_hour = max(1, 3600 // self.resolution_seconds)
+        window = self.matrix(hours * per_hour, station_ids)
+        return window.reshape(window.shape[0], hours, per_hour).mean(axis=2)
+
+    def has_hours(self, hours: int) -> bool:
+        """Whether a full trailing window of the given hours is available"""
+        return self.length >= hours * max(1, 3600 // self.resolution_seconds)
+
+    def flush(self):
+        """Persist memory-mapped buffers to disk"""
+        if self.path:
+            self._data.flush()
+            self._state.flush()
+
+
+# Global instance
+history_store = StationHistoryStore(
+    max_stations=int(os.environ.get("HISTORY_STORE_STATIONS", 4096)),
+    path=os.environ.get("HISTORY_STORE_PATH")
+)
@@ -3,39 +3,244 @@ Incident Management Engine
 Simulates and manages service disruptions
 """
 
-from typing import List, Dict
-from datetime import datetime
+import heapq
+import itertools
 import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional
+
+from shared_state import StateBackend, shared_state
+from telemetry import telemetry
+
+INCIDENT_TYPES = {
+    "delay": "Train delay due to technical issue",
+    "overcrowding": "Platform overcrowding detected",
+    "signal_failure": "Signal failure on track",
+    "medical_emergency": "Medical emergency on platform"
+}
+
 
 class IncidentEngine:
-    def __init__(self):
-        self.active_incidents = []
-        
-    def simulate_incident(self, incident_type: str, station_id: int = None) -> Dict:
+    """Indexed incident store with deadline-driven auto-resolution.
+
+    Active incidents are indexed by id, station and type, so dashboard queries cost
+    O(matches) however many incidents have been raised. Each incident's resolution
+    deadline goes on a min-heap, and every read or write first pops the deadlines that
+    have passed (O(log n) each). Manually resolved incidents leave a stale heap entry
+    that is skipped when it surfaces. Resolved incidents are kept in a bounded
+    history of the most recent history_limit.
+
+    Listeners added with add_listener are called as listener(event, incident), with
+    event "reported" or "resolved", once the store's lock has been released.
+
+    With a shared state backend, the active set, the resolved history and the id
+    sequence live in the backend. Every call first checks the backend's "incidents"
+    version and, if another worker changed it, reloads the active set and applies the
+    difference to the local indexes. Listeners then see other workers' incidents too.
+    Only the worker whose remove() succeeds records a resolution in the history.
+    """
+
+    def __init__(self, history_limit: int = 1000, clock: Callable[[], float] = time.time,
+                 state: StateBackend = shared_state):
+        self.history_limit = history_limit
+        self.clock = clock
+        self.state = state
+        self._state_version = 0
+        self._ids = itertools.count(1001)
+        self._active: Dict[str, Dict] = {}
+        self._by_station: Dict[int, Dict[str, Dict]] = {}
+        self._by_type: Dict[str, Dict[str, Dict]] = {}
+        self._deadlines: List = []
+        self._history: Deque[Dict] = deque()
+        self._resolved: Dict[str, Dict] = {}
+        self._listeners: List[Callable[[str, Dict], None]] = []
+        self._events: List = []
+        self._lock = threading.Lock()
+
+    @property
+    def active_incidents(self) -> List[Dict]:
+        return self.get_active_incidents()
+
+    def add_listener(self, listener: Callable[[str, Dict], None]):
+        self._listeners.append(listener)
+
+    def _notify(self):
+        """Deliver the changes queued under the lock"""
+        if not self._events:
+            return
+        with self._lock:
+            events, self._events = self._events, []
+        for event, incident in events:
+            for listener in self._listeners:
+                listener(event, incident)
+
+    def _index(self, incident: Dict):
+        self._active[incident["id"]] = incident
+        self._by_station.setdefault(incident["station_id"], {})[incident["id"]] = incident
+        self._by_type.setdefault(incident["type"], {})[incident["id"]] = incident
+
+    def _unindex(self, incident: Dict):
+        incident_id = incident["id"]
+        del self._active[incident_id]
+        for index, key in ((self._by_station, incident["station_id"]), (self._by_type, incident["type"])):
+            bucket = index[key]
+            del bucket[incident_id]
+            if not bucket:
+                del index[key]
+
+    def _retire(self, incident: Dict, now: float, resolution: str):
+        """Move an active incident into the bounded resolved history"""
+        self._unindex(incident)
+        if self.state.shared and not self.state.remove("incidents", incident["id"]):
+            # Another worker resolved it first and recorded the history entry
+            incident = self.state.get("incident_history", incident["id"], incident)
+            if self._listeners:
+                self._events.append(("resolved", incident))
+            return
+        incident["status"] = "resolved"
+        incident["resolution"] = resolution
+        incident["resolved_at"] = datetime.fromtimestamp(now).isoformat()
+        if self.state.shared:
+            self.state.put("incident_history", incident["id"], incident)
+            self.state.trim("incident_history", self.history_limit)
+        self._history.append(incident)
+        self._resolved[incident["id"]] = incident
+        if self._listeners:
+            self._events.append(("resolved", incident))
+        while len(self._history) > self.history_limit:
+            del self._resolved[self._history.popleft()["id"]]
+
+    def _sync(self):
+        """Apply incidents reported or resolved by other workers since the last sync"""
+        version = self.state.version("incidents")
+        if version == self._state_version:
+            return
+        current = self.state.items("incidents")
+        for incident in [i for incident_id, i in self._active.items() if incident_id not in current]:
+            self._unindex(incident)
+            incident = self.state.get("incident_history", incident["id"], incident)
+            if self._listeners:
+                self._events.append(("resolved", incident))
+        for incident_id, incident in current.items():
+            if incident_id not in self._active:
+                self._index(incident)
+                if self._listeners:
+                    self._events.append(("reported", incident))
+                deadline = datetime.fromisoformat(incident["resolves_at"]).timestamp()
+                heapq.heappush(self._deadlines, (deadline, int(incident_id[3:]), incident_id))
+        self._state_version = version
+
+    def _expire(self, now: float) -> int:
+        """Auto-resolve every incident whose deadline has passed"""
+        if self.state.shared:
+            self._sync()
+        expired = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, incident_id = heapq.heappop(self._deadlines)
+            incident = self._active.get(incident_id)
+            if incident is not None:
+                self._retire(incident, now, "auto")
+                expired += 1
+        return expired
+
+    @telemetry.timed("incident")
+    def simulate_incident(self, incident_type: str, station_id: int = None,
+                          severity: Optional[str] = None, resolution_minutes: Optional[int] = None) -> Dict:
         """Simulate a service disruption"""
-        incident_types = {
-            "delay": "Train delay due to technical issue",
-            "overcrowding": "Platform overcrowding detected",
-            "signal_failure": "Signal failure on track",
-            "medical_emergency": "Medical emergency on platform"
-        }
-        
-        incident = {
-            "id": f"INC{random.randint(1000, 9999)}",
-            "type": incident_type,
-            "description": incident_types.get(incident_type, "Unknown incident"),
-            "station_id": station_id or random.randint(1, 27),
-            "severity": random.choice(["low", "medium", "high"]),
-            "status": "active",
-            "reported_at": datetime.now().isoformat(),
-            "estimated_resolution_minutes": random.randint(5, 30)
-        }
-        
-        self.active_incidents.append(incident)
+        now = self.clock()
+        minutes = resolution_minutes if resolution_minutes is not None else random.randint(5, 30)
+        with self._lock:
+            self._expire(now)
+            number = self.state.next_id("incident", 1001) if self.state.shared else next(self._ids)
+            incident = {
+                "id": f"INC{number}",
+                "type": incident_type,
+                "description": INCIDENT_TYPES.get(incident_type, "Unknown incident"),
+                "station_id": station_id or random.randint(1, 27),
+                "severity": severity or random.choice(["low", "medium", "high"]),
+                "status": "active",
+                "reported_at": datetime.fromtimestamp(now).isoformat(),
+                "estimated_resolution_minutes": minutes,
+                "resolves_at": datetime.fromtimestamp(now + minutes * 60).isoformat()
+            }
+            self._index(incident)
+            if self.state.shared:
+                self.state.put("incidents", incident["id"], incident)
+            if self._listeners:
+                self._events.append(("reported", incident))
+            # Equal deadlines pop in reporting order
+            heapq.heappush(self._deadlines, (now + minutes * 60, number, incident["id"]))
+        self._notify()
+        return incident
+
+    @telemetry.timed("incident")
+    def resolve_incident(self, incident_id: str) -> Optional[Dict]:
+        """Resolve an active incident ahead of its deadline; None if it is not active"""
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            incident = self._active.get(incident_id)
+            if incident is not None:
+                self._retire(incident, now, "manual")
+                if len(self._deadlines) > 2 * len(self._active) + 64:
+                    # Drop the stale entries of manually resolved incidents
+                    self._deadlines = [entry for entry in self._deadlines if entry[2] in self._active]
+                    heapq.heapify(self._deadlines)
+        self._notify()
         return incident
-    
-    def get_active_incidents(self) -> List[Dict]:
-        """Get all active incidents"""
-        return [i for i in self.active_incidents if i["status"] == "active"]
+
+    def expire(self) -> int:
+        """Auto-resolve the incidents whose deadline has passed; returns how many"""
+        with self._lock:
+            expired = self._expire(self.clock())
+        self._notify()
+        return expired
+
+    def get_incident(self, incident_id: str) -> Optional[Dict]:
+        """Look up an active or recently resolved incident"""
+        self.expire()
+        with self._lock:
+            incident = self._active.get(incident_id)
+        if incident is None and self.state.shared:
+            return self.state.get("incident_history", incident_id)
+        return incident or self._resolved.get(incident_id)
+
+    @telemetry.timed("incident")
+    def get_active_incidents(self, station_id: Optional[int] = None,
+                             incident_type: Optional[str] = None) -> List[Dict]:
+        """Get active incidents, optionally for one station and/or type"""
+        self.expire()
+        with self._lock:
+            if station_id is not None:
+                matches = self._by_station.get(station_id, {})
+                if incident_type is not None:
+                    return [i for i in matches.values() if i["type"] == incident_type]
+                return list(matches.values())
+            if incident_type is not None:
+                return list(self._by_type.get(incident_type, {}).values())
+            return list(self._active.values())
+
+    @telemetry.timed("incident")
+    def get_resolved_incidents(self, limit: int = 50) -> List[Dict]:
+        """Most recently resolved incidents, newest first"""
+        self.expire()
+        if self.state.shared:
+            return list(itertools.islice(reversed(self.state.items("incident_history").values()), max(limit, 0)))
+        with self._lock:
+            return list(itertools.islice(reversed(self._history), max(limit, 0)))
+
+    def summary(self) -> Dict:
+        self.expire()
+        with self._lock:
+            return {
+                "active": len(self._active),
+                "resolved_retained": len(self.state.items("incident_history")) if self.state.shared else len(self._history),
+                "by_type": {t: len(bucket) for t, bucket in self._by_type.items()},
+                "stations_affected": len(self._by_station),
+                "pending_deadlines": len(self._deadlines)
+            }
 
 incident_engine = IncidentEngine()
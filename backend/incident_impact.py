@@ -0,0 +1,232 @@
+"""
+Incident Impact Engine
+Propagates active incidents over the station graph to estimate crowd spill-over
+"""
+
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from incident_engine import incident_engine
+from metro_topology import metro_topology
+from network_state import NetworkState
+from telemetry import telemetry
+
+RELATIONS = ("upstream", "downstream", "alternative_line")
+_UPSTREAM, _DOWNSTREAM, _ALTERNATIVE = range(len(RELATIONS))
+
+
+class Impact(NamedTuple):
+    """One incident's footprint: affected topology positions with hop distance and spill-over"""
+    source: int
+    positions: np.ndarray
+    hops: np.ndarray
+    relations: np.ndarray
+    spillover: np.ndarray
+    displaced: float
+
+
+class IncidentImpactEngine:
+    """Incremental k-hop impact of active incidents.
+
+    The topology graph is cached as a CSR adjacency array (neighbour positions per
+    station), rebuilt only when the topology version changes. Impacts are found with a
+    level-synchronous BFS that expands the frontiers of many incidents at once, each
+    labelled with its source. Reporting an incident runs the BFS from that station alone
+    and adds its footprint to the per-station aggregates. Resolving one subtracts its
+    stored footprint, so nothing else is recomputed. The whole set is propagated again
+    only when the topology changes.
+
+    An incident displaces severity_share of its station's passengers at report time.
+    They spill over to the stations it reaches, weighted by hop_decay ** (hops - 1), and
+    stations on other lines take alternative_line_weight times their share.
+    """
+
+    def __init__(self, topology=metro_topology, incidents=incident_engine, max_hops: int = 2,
+                 hop_decay: float = 0.5, alternative_line_weight: float = 1.5):
+        self.topology = topology
+        self.incidents = incidents
+        self.max_hops = max_hops
+        self.hop_decay = hop_decay
+        self.alternative_line_weight = alternative_line_weight
+        self.severity_share = {"low": 0.1, "medium": 0.25, "high": 0.5}
+        self.version = 0
+        self._impacts: Dict[str, Impact] = {}
+        self._pending: Dict[str, Dict] = {}
+        self._passengers: Optional[np.ndarray] = None
+        self._topology_version = None
+        # Re-entrant: reading active incidents can expire some, which calls back into on_incident
+        self._lock = threading.RLock()
+        incidents.add_listener(self.on_incident)
+
+    def _rebuild(self):
+        """Cache the adjacency arrays and per-station line data for the current topology"""
+        position = self.topology.station_index
+        n = len(position)
+        src, dst = [], []
+        for a, b in self.topology.graph.edges():
+            src += [position[a], position[b]]
+            dst += [position[b], position[a]]
+        src, dst = np.array(src, dtype=np.intp), np.array(dst, dtype=np.intp)
+        order = np.argsort(src, kind="stable")
+        self._indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))]).astype(np.intp)
+        self._indices = dst[order]
+
+        lines = {}
+        self._ids = [s["id"] for s in self.topology.stations]
+        self._line = np.array([lines.setdefault(s["line"], len(lines)) for s in self.topology.stations], dtype=np.intp)
+        self._line_names = list(lines)
+        # Offset along the station's own line; -1 where the line sequence omits it
+        self._offset = np.full(n, -1, dtype=np.intp)
+        for sequence in self.topology.line_sequences.values():
+            for offset, station_id in enumerate(sequence):
+                self._offset[position[station_id]] = offset
+
+        self._spillover = np.zeros(n)
+        self._hop_counts = np.zeros((n, self.max_hops), dtype=np.int32)
+        self._impacts.clear()
+        self._topology_version = self.topology.version
+
+    def _propagate(self, sources: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Multi-source BFS to max_hops; (source label, position, hops) for every station reached"""
+        n = len(self._line)
+        labels = np.arange(len(sources), dtype=np.intp)
+        frontier = np.asarray(sources, dtype=np.intp)
+        seen = labels * n + frontier
+        found = [(labels, frontier, np.zeros(len(frontier), dtype=np.intp))]
+        for hop in range(1, self.max_hops + 1):
+            starts = self._indptr[frontier]
+            counts = self._indptr[frontier + 1] - starts
+            total = int(counts.sum())
+            if not total:
+                break
+            # Gather every frontier node's neighbour slice in one pass
+            within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            neighbours = self._indices[np.repeat(starts, counts) + within]
+            keys = np.unique(np.repeat(labels, counts) * n + neighbours)
+            keys = keys[~np.isin(keys, seen, assume_unique=True)]
+            if not len(keys):
+                break
+            seen = np.union1d(seen, keys)
+            labels, frontier = keys // n, keys % n
+            found.append((labels, frontier, np.full(len(keys), hop, dtype=np.intp)))
+        return tuple(np.concatenate(column) for column in zip(*found))
+
+    def _footprint(self, incident: Dict, source: int, positions: np.ndarray, hops: np.ndarray) -> Impact:
+        keep = hops > 0
+        positions, hops = positions[keep], hops[keep]
+        relations = np.where(self._offset[positions] < self._offset[source], _UPSTREAM, _DOWNSTREAM)
+        relations[self._line[positions] != self._line[source]] = _ALTERNATIVE
+
+        weights = self.hop_decay ** (hops - 1.0)
+        weights[relations == _ALTERNATIVE] *= self.alternative_line_weight
+        share = self.severity_share.get(incident.get("severity"), 0.25)
+        displaced = float(self._passengers[source]) * share if self._passengers is not None else 0.0
+        spillover = displaced * weights / weights.sum() if len(weights) else weights
+        return Impact(source, positions, hops, relations, spillover, displaced)
+
+    def _apply(self, impact: Impact, sign: int):
+        self._spillover[impact.positions] += sign * impact.spillover
+        self._hop_counts[impact.positions, impact.hops - 1] += sign
+
+    def _describe(self, impact: Impact, limit: int = 10) -> Dict:
+        ids, names = self._ids, self._line_names
+        top = np.argsort(-impact.spillover, kind="stable")[:limit]
+        alternative = impact.relations == _ALTERNATIVE
+        return {
+            "hops": self.max_hops,
+            "displaced_passengers": round(impact.displaced),
+            "affected_station_count": len(impact.positions),
+            "upstream": [ids[p] for p in impact.positions[impact.relations == _UPSTREAM].tolist()],
+            "downstream": [ids[p] for p in impact.positions[impact.relations == _DOWNSTREAM].tolist()],
+            "alternative_lines": sorted({names[c] for c in self._line[impact.positions[alternative]].tolist()}),
+            "spillover": [{
+                "station_id": ids[position],
+                "line": names[self._line[position]],
+                "hops": int(impact.hops[i]),
+                "relation": RELATIONS[impact.relations[i]],
+                "passengers": round(float(impact.spillover[i]), 1)
+            } for i, position in ((i, int(impact.positions[i])) for i in top.tolist())]
+        }
+
+    def _add(self, incidents: List[Dict]):
+        """Propagate a batch of incidents together and fold their footprints into the aggregates"""
+        position = self.topology.station_index
+        placed = [(incident, position[incident["station_id"]]) for incident in incidents
+                  if incident["station_id"] in position]
+        for incident in incidents:
+            if incident["station_id"] not in position:
+                self._pending[incident["id"]] = incident
+        if not placed:
+            return
+        sources = np.array([source for _, source in placed], dtype=np.intp)
+        labels, positions, hops = self._propagate(sources)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(len(placed) + 1))
+        for label, (incident, source) in enumerate(placed):
+            rows = order[bounds[label]:bounds[label + 1]]
+            impact = self._footprint(incident, source, positions[rows], hops[rows])
+            self._impacts[incident["id"]] = impact
+            self._apply(impact, 1)
+            incident["impact"] = self._describe(impact)
+            self._pending.pop(incident["id"], None)
+
+    @telemetry.timed("incident_impact")
+    def on_incident(self, event: str, incident: Dict):
+        """IncidentEngine listener: add or remove one incident's footprint"""
+        with self._lock:
+            if event == "reported":
+                if self._topology_version is None:
+                    self._pending[incident["id"]] = incident
+                else:
+                    self._add([incident])
+            else:
+                self._pending.pop(incident["id"], None)
+                impact = self._impacts.pop(incident["id"], None)
+                if impact is not None:
+                    self._apply(impact, -1)
+                    if not self._impacts:
+                        self._spillover[:] = 0  # drop accumulated rounding error
+            self.version += 1
+
+    @telemetry.timed("incident_impact")
+    def update(self, state: NetworkState):
+        """Tick hook: keep passenger counts current and re-propagate after a topology change"""
+        self.topology.sync(state)
+        self.incidents.expire()
+        with self._lock:
+            self._passengers = state.passengers
+            if self._topology_version != self.topology.version:
+                self._rebuild()
+                self._pending.clear()
+                self._add(self.incidents.get_active_incidents())
+                self.version += 1
+            elif self._pending:
+                self._add(list(self._pending.values()))
+                self.version += 1
+
+    @telemetry.timed("incident_impact")
+    def status_view(self) -> Dict:
+        """Per-station incident pressure for /status"""
+        with self._lock:
+            if self._topology_version is None:
+                return {"active": len(self._impacts), "affected_stations": []}
+            hit = self._hop_counts.any(axis=1)
+            affected = np.flatnonzero(hit)
+            nearest = (self._hop_counts[affected] > 0).argmax(axis=1) + 1
+            order = np.argsort(-self._spillover[affected], kind="stable")
+            return {
+                "active": len(self._impacts),
+                "max_hops": self.max_hops,
+                "affected_stations": [{
+                    "station_id": self._ids[position],
+                    "nearest_incident_hops": int(nearest[i]),
+                    "incidents": int(self._hop_counts[position].sum()),
+                    "spillover_passengers": round(float(self._spillover[position]), 1)
+                } for i, position in ((i, int(affected[i])) for i in order.tolist())]
+            }
+
+
+# Global instance
+incident_impact = IncidentImpactEngine()
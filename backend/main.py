@@ -1,44 +1,416 @@
 import logging
+import math
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field, NonNegativeFloat
 from models import StatusResponse, Feedback
 from metro_service import metro_manager
-from security import RateLimitMiddleware, SecurityHeaderMiddleware, validate_input_sanitization
+from security import RateLimitMiddleware, SecurityHeaderMiddleware, require_admin, validate_input_sanitization
+from engine_registry import engines
+from incident_engine import incident_engine, INCIDENT_TYPES
+from prediction_cache import prediction_cache
+from static_assets import StaticAssets
+from status_broadcaster import status_broadcaster
+from analytics_scheduler import analytics_scheduler
+from network_state import NetworkState
+from response_cache import response_cache
+from telemetry import MetricsMiddleware, telemetry
+from fastapi.encoders import jsonable_encoder
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(name)s] %(message)s")
 logger = logging.getLogger("HydroFlow.API")
 
-app = FastAPI(title="HydroFlow: Metro Crowd Predictor API", version="2.0.0")
+# Engines are imported and built on first use (or by the warm-up), not when main is imported
+ml_engine = engines.proxy("ml")
+analytics_engine = engines.proxy("analytics")
+route_planner = engines.proxy("route_planner")
+prediction_service = engines.proxy("prediction_service")
+backtester = engines.proxy("backtester")
+incident_impact = engines.proxy("incident_impact")
+ai_assistant = engines.proxy("assistant")
+flow_analyzer = engines.proxy("flow")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    analytics_scheduler.start()
+    if os.environ.get("ENGINE_WARMUP", "1") != "0":
+        # Sleeps first, so the server is accepting requests before the heavy imports start
+        engines.start_warm_up(delay=float(os.environ.get("ENGINE_WARMUP_DELAY", 0.5)))
+    engines.mark("lifespan_started")
+    yield
+    await analytics_scheduler.stop()
+
+app = FastAPI(title="HydroFlow: Metro Crowd Predictor API", version="2.0.0", lifespan=lifespan)
 app.add_middleware(RateLimitMiddleware, requests_per_minute=100)
 app.add_middleware(SecurityHeaderMiddleware)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["GET", "POST", "OPTIONS"], allow_headers=["*"])
+# Outermost, so request latency includes the middleware stack and 429s are recorded too
+app.add_middleware(MetricsMiddleware)
+
+
+class BacktestRequest(BaseModel):
+    history_hours: int = Field(168, ge=27, le=90 * 24, description="Trailing hours of recorded history to evaluate")
+    apply: bool = Field(True, description="Adopt the fitted ensemble weights and confidence calibration")
+
+class IncidentRequest(BaseModel):
+    type: str = Field(..., description="One of: " + ", ".join(INCIDENT_TYPES))
+    station_id: Optional[int] = Field(None, ge=1)
+    severity: Optional[str] = Field(None, pattern="^(low|medium|high)$")
+    resolution_minutes: Optional[int] = Field(None, ge=1, le=24 * 60)
+
+class ChatRequest(BaseModel):
+    query: str = Field(..., min_length=1, max_length=500)
+    context: Optional[dict] = None
+    session_id: Optional[str] = Field(None, max_length=64)
+
+class BatchChatRequest(BaseModel):
+    queries: List[ChatRequest] = Field(..., min_length=1, max_length=100)
+
+class ProfilerRequest(BaseModel):
+    interval_ms: float = Field(10, ge=1, le=1000, description="Sampling interval")
+    max_seconds: float = Field(60, ge=1, le=600, description="Stop automatically after this long")
+
+class FlowEventsRequest(BaseModel):
+    boardings: Dict[int, NonNegativeFloat] = Field(default_factory=dict, description="Station id -> tap-ins since the last post")
+    alightings: Dict[int, NonNegativeFloat] = Field(default_factory=dict, description="Station id -> tap-outs since the last post")
+    trips: List[List[int]] = Field(default_factory=list, max_length=100_000,
+                                   description="[origin id, destination id] or [origin id, destination id, count]")
+
+class BatchPredictionRequest(BaseModel):
+    history: List[List[float]] = Field(..., description="Stations x hours passenger counts")
+    station_ids: Optional[List[int]] = None
+    hours_ahead: int = Field(3, ge=1, le=24)
+    model: str = "ensemble"
+
+
+def record_network_snapshot(state: NetworkState):
+    analytics_engine.record_snapshot(state)
+    route_planner.update_crowding(state)
+    incident_impact.update(state)
+
+def network_snapshot() -> dict:
+    status = dict(metro_manager.get_network_status())
+    status["trains"] = metro_manager.get_train_status()["trains"]
+    return status
+
+analytics_scheduler.configure(network_snapshot, on_tick=[record_network_snapshot])
+# Streams the status the scheduler last applied: the tick hooks run once, off the event loop, and
+# subscribers see the same data as /status (with a shared backend, the leader's status on every worker)
+status_broadcaster.configure(lambda: analytics_scheduler.latest_status)
+engines.on_load("assistant", lambda assistant: assistant.configure(lambda: analytics_scheduler.latest_state))
+
+def cache_events() -> dict:
+    predictions = prediction_cache
+    return {
+        ("response", "hit"): response_cache.hits,
+        ("response", "miss"): response_cache.misses,
+        ("response", "not_modified"): response_cache.not_modified,
+        ("prediction", "hit"): predictions.hits,
+        ("prediction", "miss"): predictions.misses,
+        ("prediction", "coalesced"): predictions.coalesced,
+        ("prediction", "shared_hit"): predictions.shared_hits,
+        ("prediction", "eviction"): predictions.evictions,
+        ("prediction", "expiration"): predictions.expirations,
+    }
+
+# Read from the owning engines at scrape time rather than counted again on the hot path
+telemetry.collect("cache_events", "counter", "Cache lookups and evictions by cache and outcome",
+                  ("cache", "event"), cache_events)
+telemetry.collect("active_incidents", "gauge", "Active incidents by type", ("type",),
+                  lambda: {(t,): n for t, n in incident_engine.summary()["by_type"].items()})
+
+# Public analytics paths -> analytics snapshot job names
+ANALYTICS_VIEWS = {
+    "crowd-patterns": "crowd_patterns",
+    "anomalies": "anomalies",
+    "bottlenecks": "bottlenecks",
+    "network-flow": "network_flow",
+    "peak-hours": "peak_hours",
+    "revenue": "revenue",
+    "flow-path": "flow_path",
+}
+
 
 @app.get("/status", response_model=StatusResponse)
 async def get_network_status(request: Request):
-        try:
-                    return metro_manager.get_network_status()
-except Exception as e:
+    try:
+        status, version = analytics_scheduler.latest_status, analytics_scheduler.status_seq
+        if status is None:
+            # Before the scheduler's first tick; the tick hooks (and their engines) run on that tick
+            status, version = metro_manager.get_network_status(), None
+        # Until the impact engine is loaded there is nothing propagated to report
+        impact = incident_impact if engines.loaded("incident_impact") else None
+        # Validated and encoded once per tick; pollers with a current ETag get a 304
+        incident_engine.expire()
+        encoded = response_cache.encode(
+            "status", None if version is None else (version, impact.version if impact else None),
+            lambda: {**jsonable_encoder(StatusResponse(**{k: v for k, v in status.items() if k != "trains"})),
+                     "incidents": impact.status_view() if impact else
+                     {"active": len(incident_engine.active_incidents), "affected_stations": []}}
+        )
+        engines.mark("first_status")
+        return response_cache.respond(request, encoded)
+    except Exception as e:
         raise HTTPException(status_code=500, detail="Service currently unavailable")
 
+@app.get("/status/stream")
+async def stream_network_status(request: Request):
+    subscriber = status_broadcaster.subscribe()
+
+    async def events():
+        try:
+            while not subscriber.closed:
+                message = await subscriber.next_message(timeout=15.0)
+                yield message.sse if message else ": keepalive\n\n"
+        except ConnectionError:
+            yield "event: dropped\ndata: {}\n\n"
+        finally:
+            status_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/status/ws")
+async def websocket_network_status(websocket: WebSocket):
+    await websocket.accept()
+    subscriber = status_broadcaster.subscribe()
+    try:
+        while True:
+            message = await subscriber.next_message(timeout=15.0)
+            if message:
+                await websocket.send_text(message.ws)
+    except ConnectionError:
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        status_broadcaster.unsubscribe(subscriber)
+
 @app.post("/feedback")
 async def post_feedback(feedback: Feedback, background_tasks: BackgroundTasks):
-        sanitized_desc = validate_input_sanitization(feedback.description)
-        background_tasks.add_task(logger.info, "Feedback processed.")
-        return {"status": "accepted"}
+    sanitized_desc = validate_input_sanitization(feedback.description)
+    background_tasks.add_task(logger.info, "Feedback processed.")
+    return {"status": "accepted"}
+
+@app.post("/predictions/batch")
+async def predict_crowd_batch(payload: BatchPredictionRequest):
+    station_ids = payload.station_ids or list(range(1, len(payload.history) + 1))
+    if len(station_ids) != len(payload.history):
+        raise HTTPException(status_code=400, detail="station_ids must match the number of history rows")
+    if len({len(row) for row in payload.history}) > 1:
+        raise HTTPException(status_code=400, detail="Every history row must have the same length")
+    try:
+        forecasts = ml_engine.predict_crowd_batch(payload.history, payload.hours_ahead, payload.model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "model_used": payload.model,
+        "prediction_horizon_hours": payload.hours_ahead,
+        "generated_at": datetime.now().isoformat(),
+        "stations": [
+            {
+                "station_id": station_id,
+                "predictions": {name: values[row].round(1).tolist() for name, values in forecasts.items()}
+            }
+            for row, station_id in enumerate(station_ids)
+        ]
+    }
+
+@app.post("/flow/events")
+def ingest_flow_events(payload: FlowEventsRequest):
+    if any(len(trip) not in (2, 3) or (len(trip) == 3 and trip[2] <= 0) for trip in payload.trips):
+        raise HTTPException(status_code=400,
+                            detail="Each trip is [origin, destination] or [origin, destination, count] with count > 0")
+    od = flow_analyzer.od
+    trips = [trip + [1] * (3 - len(trip)) for trip in payload.trips]
+    accepted = {
+        "boardings": od.record_boardings(list(payload.boardings), list(payload.boardings.values())),
+        "alightings": od.record_alightings(list(payload.alightings), list(payload.alightings.values())),
+        "trips": od.record_trips([t[0] for t in trips], [t[1] for t in trips], [t[2] for t in trips]) if trips else 0
+    }
+    received = {"boardings": len(payload.boardings), "alightings": len(payload.alightings), "trips": len(trips)}
+    # Events before the first flow fit, or for unknown stations, are dropped
+    return {"accepted": accepted, "rejected": {k: received[k] - accepted[k] for k in received}}
+
+@app.get("/analytics/patterns")
+async def get_crowd_patterns(scope: str = "network", window: str = "current"):
+    try:
+        return analytics_engine.stream_stats.get_stats(scope, window)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No statistics recorded for {scope}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/predictions/cache")
+async def get_prediction_cache_stats():
+    return prediction_service.cache.stats()
+
+@app.post("/predictions/backtest")
+def run_prediction_backtest(payload: BacktestRequest):
+    store = prediction_service.history_store
+    if not store.has_hours(payload.history_hours):
+        raise HTTPException(status_code=400, detail=f"Fewer than {payload.history_hours} hours of recorded history")
+    station_ids = store.station_ids
+    try:
+        result = backtester.run(store.hourly(payload.history_hours, station_ids), station_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if payload.apply:
+        ml_engine.apply_backtest(result)
+    return {**result.describe(), "applied": payload.apply}
+
+@app.get("/predictions/backtest")
+async def get_prediction_backtest():
+    summary = backtester.last_summary()
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No backtest has been run yet")
+    return {**summary, "weights_in_use": ml_engine.weights_in_use()}
+
+@app.get("/predictions/{station_id}")
+def get_station_prediction(station_id: int, hours_ahead: int = 3, model: str = "ensemble"):
+    if not 1 <= hours_ahead <= 24:
+        raise HTTPException(status_code=400, detail="hours_ahead must be between 1 and 24")
+    try:
+        return prediction_service.get_station_prediction(station_id, hours_ahead, model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/predictions/{station_id}/peaks")
+def get_station_peak_times(station_id: int, date: Optional[str] = None):
+    try:
+        return ml_engine.predict_peak_times(station_id, date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/route")
+async def get_route(origin: str, destination: str):
+    if not route_planner.topology.stations:
+        route_planner.update_crowding(metro_manager.get_network_status()["stations"])
+    origin_id = route_planner.resolve_station(origin)
+    destination_id = route_planner.resolve_station(destination)
+    if origin_id is None or destination_id is None:
+        raise HTTPException(status_code=404, detail="Unknown station")
+    try:
+        return route_planner.plan_route(origin_id, destination_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown station")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def current_snapshot():
+    # The first tick also loads the analytics engines, so give it a moment before answering 503
+    snapshot = analytics_scheduler.get_snapshot(timeout=analytics_scheduler.interval)
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Analytics not available yet",
+                            headers={"Retry-After": str(math.ceil(analytics_scheduler.interval))})
+    return snapshot
+
+def snapshot_response(request: Request, key: str, snapshot, build):
+    encoded = response_cache.encode(key, snapshot.seq, build)
+    return response_cache.respond(request, encoded, {"X-Snapshot-Age-Seconds": f"{snapshot.age_seconds:.3f}"})
+
+@app.get("/analytics/overview")
+def get_analytics_overview(request: Request):
+    snapshot = current_snapshot()
+    return snapshot_response(request, "analytics:overview", snapshot, lambda: {
+        "data": dict(snapshot.results), "errors": dict(snapshot.errors), "snapshot": snapshot.describe()
+    })
+
+@app.get("/analytics/{view}")
+def get_analytics_view(view: str, request: Request):
+    job = ANALYTICS_VIEWS.get(view)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown analytics view")
+    snapshot = current_snapshot()
+    if job not in snapshot.results:
+        raise HTTPException(status_code=503, detail=snapshot.errors.get(job, "Analytics not available yet"))
+    return snapshot_response(request, f"analytics:{job}", snapshot, lambda: {
+        "data": snapshot.results[job], "snapshot": snapshot.describe()
+    })
+
+@app.get("/analytics/history/{station_id}")
+async def get_station_history(station_id: int, minutes: int = 60):
+    if station_id not in analytics_engine.historical_data.station_index:
+        raise HTTPException(status_code=404, detail="No recorded history for this station")
+    return analytics_engine.station_trend(station_id, minutes)
+
+@app.get("/incident/active")
+async def get_active_incidents(station_id: Optional[int] = None, type: Optional[str] = None):
+    incidents = incident_engine.get_active_incidents(station_id, type)
+    return {"count": len(incidents), "incidents": incidents}
+
+@app.get("/incident/history")
+async def get_resolved_incidents(limit: int = 50):
+    return {"incidents": incident_engine.get_resolved_incidents(min(limit, incident_engine.history_limit))}
+
+@app.post("/incident/simulate")
+async def report_incident(payload: IncidentRequest):
+    if payload.type not in INCIDENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown incident type: {payload.type}")
+    engines.get("incident_impact")  # its listener attaches the k-hop impact to the response
+    return incident_engine.simulate_incident(payload.type, payload.station_id, payload.severity,
+                                             payload.resolution_minutes)
+
+@app.post("/incident/{incident_id}/resolve")
+async def resolve_incident(incident_id: str):
+    incident = incident_engine.resolve_incident(incident_id)
+    if incident is None:
+        raise HTTPException(status_code=404, detail="No active incident with this id")
+    return incident
+
+@app.post("/ai/chat")
+async def chat(payload: ChatRequest):
+    query = validate_input_sanitization(payload.query)
+    return ai_assistant.process_query(query, payload.context, payload.session_id)
+
+@app.post("/ai/chat/batch")
+async def chat_batch(payload: BatchChatRequest):
+    items = [{"query": validate_input_sanitization(item.query), "context": item.context, "session_id": item.session_id}
+             for item in payload.queries]
+    return {"responses": ai_assistant.process_batch(items)}
+
+@app.get("/ai/history/{session_id}")
+async def get_chat_history(session_id: str):
+    return {"session_id": session_id, "history": ai_assistant.get_history(session_id)}
+
+@app.get("/startup")
+async def get_startup_report():
+    return engines.report()
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(telemetry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+async def get_profiler_status():
+    return telemetry.profiler.describe()
+
+@app.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+async def start_profiler(payload: ProfilerRequest):
+    if not telemetry.profiler.start(payload.interval_ms / 1000, payload.max_seconds):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return telemetry.profiler.describe()
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(require_admin)])
+def stop_profiler():
+    # Folded stacks: flamegraph.pl profile.folded > profile.svg, or open in speedscope
+    return PlainTextResponse(telemetry.profiler.stop(),
+                             headers={"Content-Disposition": 'attachment; filename="profile.folded"'})
 
 dist_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend/dist")
 if os.path.exists(dist_path):
-        app.mount("/", StaticFiles(directory=dist_path, html=True), name="static")
-        @app.exception_handler(404)
-        async def not_found_handler(request: Request, exc: HTTPException):
-                    return FileResponse(os.path.join(dist_path, "index.html"))
-
-    if __name__ == "__main__":
-            import uvicorn
-            port = int(os.environ.get("PORT", 8000))
-            uvicorn.run(app, host="0.0.0.0", port=port)
-        
+    # Assets are held in memory; unknown SPA routes fall back to the in-memory index.html
+    app.mount("/", StaticAssets(dist_path), name="static")
+
+engines.mark("main_imported")
+
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.environ.get("PORT", 8000))
+    uvicorn.run(app, host="0.0.0.0", port=port)
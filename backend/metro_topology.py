@@ -0,0 +1,155 @@
+"""
+Metro Topology
+Station graph built once from line configuration, with cached network metrics
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import networkx as nx
+
+from network_state import NetworkState
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config", "metro_topology.json")
+
+
+class MetroTopology:
+    """Cached station graph and centrality metrics, rebuilt only when the topology changes.
+
+    Config format (``config/metro_topology.json``, overridable via METRO_TOPOLOGY_PATH):
+    ``lines`` maps a line code to an ordered ``stations`` list of ids; an empty list
+    keeps the order the stations arrive in. ``interchanges`` lists station pairs by id
+    or name, and ``link_shared_names`` joins same-named stations on different lines. Those
+    interchange edges let routes change lines, and they also count in the graph metrics.
+    ``segment_minutes`` (global or per line) and ``interchange_minutes`` set edge travel times,
+    and ``segment_km`` (global or per line) sets track distances; interchanges are 0 km.
+    ``betweenness_samples`` caps the pivots used for betweenness centrality on large networks.
+    ``aliases`` maps a station name to alternative names the assistant should recognise.
+    """
+
+    def __init__(self, config_path: Optional[str] = None):
+        self.config_path = config_path or os.environ.get("METRO_TOPOLOGY_PATH", DEFAULT_CONFIG_PATH)
+        self.config = self._load_config(self.config_path)
+        self.graph = nx.Graph()
+        self.station_index: Dict[int, int] = {}
+        self.name_index: Dict[str, int] = {}
+        self.stations: List[Dict] = []
+        self.metrics: Dict = {}
+        self.version = 0
+        self._signature: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_config(path: str) -> Dict:
+        if not os.path.exists(path):
+            return {"lines": {}, "interchanges": [], "link_shared_names": True}
+        with open(path) as f:
+            return json.load(f)
+
+    def sync(self, stations) -> bool:
+        """Rebuild the graph if station ids, names or lines changed; returns True on rebuild.
+
+        Accepts station dicts or a NetworkState, whose signature is computed once per tick.
+        """
+        if isinstance(stations, NetworkState):
+            signature, stations = stations.signature, stations.stations
+        else:
+            signature = tuple((s["id"], s["name"], s["line"]) for s in stations)
+        if signature == self._signature:
+            return False
+        with self._lock:
+            if signature != self._signature:
+                self._rebuild(stations)
+                self._signature = signature
+                return True
+        return False
+
+    def _line_sequences(self, stations: List[Dict]) -> Dict[str, List[int]]:
+        """Ordered station ids per line, from config where given, else arrival order"""
+        sequences: Dict[str, List[int]] = {}
+        for station in stations:
+            sequences.setdefault(station["line"], []).append(station["id"])
+        known = set(self.station_index)
+        for line, spec in self.config.get("lines", {}).items():
+            configured = [sid for sid in spec.get("stations", []) if sid in known]
+            if configured:
+                sequences[line] = configured
+        return sequences
+
+    def _resolve(self, ref, by_name: Dict[str, List[int]]) -> List[int]:
+        if isinstance(ref, int):
+            return [ref] if ref in self.station_index else []
+        return by_name.get(str(ref).lower(), [])
+
+    def _rebuild(self, stations: List[Dict]):
+        self.stations = stations
+        self.station_index = {s["id"]: i for i, s in enumerate(stations)}
+
+        graph = nx.Graph()
+        for station in stations:
+            graph.add_node(station["id"], name=station["name"], line=station["line"])
+
+        lines = self.config.get("lines", {})
+        default_minutes = self.config.get("segment_minutes", 2.5)
+        default_km = self.config.get("segment_km", 1.2)
+        self.line_sequences = self._line_sequences(stations)
+        for line, sequence in self.line_sequences.items():
+            minutes = lines.get(line, {}).get("segment_minutes", default_minutes)
+            km = lines.get(line, {}).get("segment_km", default_km)
+            for a, b in zip(sequence, sequence[1:]):
+                graph.add_edge(a, b, line=line, interchange=False, minutes=minutes, km=km)
+
+        by_name: Dict[str, List[int]] = {}
+        for station in stations:
+            by_name.setdefault(station["name"].lower(), []).append(station["id"])
+        self.name_index = {name: ids[0] for name, ids in by_name.items()}
+
+        interchange_pairs = []
+        if self.config.get("link_shared_names", True):
+            for ids in by_name.values():
+                interchange_pairs.extend(zip(ids, ids[1:]))
+        for a_ref, b_ref in self.config.get("interchanges", []):
+            for a in self._resolve(a_ref, by_name):
+                for b in self._resolve(b_ref, by_name):
+                    if a != b:
+                        interchange_pairs.append((a, b))
+        interchange_minutes = self.config.get("interchange_minutes", 4.0)
+        for a, b in interchange_pairs:
+            graph.add_edge(a, b, line=None, interchange=True, minutes=interchange_minutes, km=0.0)
+
+        self.graph = graph
+        self.metrics = self._compute_metrics(graph, self.config.get("betweenness_samples", 256))
+        self.version += 1
+
+    @staticmethod
+    def _compute_metrics(graph: nx.Graph, betweenness_samples: int = 256) -> Dict:
+        nodes = graph.number_of_nodes()
+        # Exact up to betweenness_samples nodes; larger networks use a seeded pivot sample
+        sample = betweenness_samples if nodes > betweenness_samples else None
+        betweenness = nx.betweenness_centrality(graph, k=sample, seed=0) if nodes else {}
+        return {
+            "total_nodes": nodes,
+            "total_edges": graph.number_of_edges(),
+            "network_density": round(nx.density(graph), 4) if nodes else 0.0,
+            "average_degree": round(sum(dict(graph.degree()).values()) / nodes, 2) if nodes else 0.0,
+            "degree_centrality": nx.degree_centrality(graph) if nodes else {},
+            "betweenness_centrality": betweenness,
+            "ranked_by_betweenness": [node for node, _ in sorted(betweenness.items(), key=lambda x: x[1], reverse=True)]
+        }
+
+    def find_station(self, name: str) -> Optional[int]:
+        """Resolve a station name (case-insensitive) to its id"""
+        return self.name_index.get(name.strip().lower())
+
+    def station(self, station_id: int, stations: Optional[List[Dict]] = None) -> Dict:
+        """Look up a station by id in the given snapshot (or the one the graph was built from)"""
+        return (stations or self.stations)[self.station_index[station_id]]
+
+    def neighbors(self, station_id: int) -> List[int]:
+        return list(self.graph.neighbors(station_id))
+
+
+# Global instance
+metro_topology = MetroTopology()
@@ -6,11 +6,25 @@ Implements multiple prediction models with ensemble methods
 import numpy as np
 from typing import List, Dict, Tuple
 from datetime import datetime, timedelta
+from history_store import history_store
+from prediction_cache import prediction_cache
+from shared_state import StateBackend, shared_state
+from simulation_feed import hourly_history, seeded_rng
+from telemetry import telemetry
 
 class MLPredictionEngine:
-    def __init__(self):
+    def __init__(self, store=history_store, cache=prediction_cache, state: StateBackend = shared_state):
         self.models = ["sma", "exponential_smoothing", "polynomial", "ensemble"]
+        self.history_store = store
+        self.cache = cache
+        # Replaced by backtest-fitted weights and error calibration via apply_backtest()
+        # With a shared state backend, a backtest applied on any worker is adopted by all of them
+        self.ensemble_weights = {"sma": 0.3, "exponential": 0.3, "polynomial": 0.4}
+        self.calibration = None
+        self.state = state
+        self._state_version = 0
         
+    @telemetry.timed("ml")
     def predict_crowd(self, historical_data: List[int], hours_ahead: int = 3, 
                      model: str = "ensemble") -> Dict:
         """Predict crowd levels for future hours"""
@@ -18,120 +32,176 @@ class MLPredictionEngine:
             # Generate synthetic historical data if insufficient
             historical_data = self._generate_synthetic_history()
         
+        history = np.asarray(historical_data, dtype=float)[np.newaxis, :]
+        predictions = self.predict_crowd_batch(history, hours_ahead, model)
+        
+        return self._format_prediction(predictions[self.result_key(model)][0].tolist(), hours_ahead)
+    
+    @staticmethod
+    def result_key(model: str) -> str:
+        """Key under which predict_crowd_batch returns a model's forecast"""
+        return "exponential" if model == "exponential_smoothing" else model
+    
+    @telemetry.timed("ml")
+    def predict_crowd_batch(self, history: np.ndarray, hours_ahead: int = 3,
+                            model: str = "ensemble") -> Dict[str, np.ndarray]:
+        """Forecast every station in one vectorized pass over a stations x hours matrix"""
+        if self.state.shared:
+            self._sync()
+        history = np.asarray(history, dtype=float)
+        if history.ndim != 2:
+            raise ValueError("history must be a 2-D stations x hours matrix")
+        if history.shape[1] < 10:
+            raise ValueError("history needs at least 10 observations per station")
+        if model not in self.models:
+            raise ValueError(f"Unknown model '{model}', expected one of {self.models}")
+        
         predictions = {}
         
         if model == "sma" or model == "ensemble":
-            predictions["sma"] = self._simple_moving_average(historical_data, hours_ahead)
+            predictions["sma"] = self._simple_moving_average(history, hours_ahead)
         
         if model == "exponential_smoothing" or model == "ensemble":
-            predictions["exponential"] = self._exponential_smoothing(historical_data, hours_ahead)
+            predictions["exponential"] = self._exponential_smoothing(history, hours_ahead)
         
         if model == "polynomial" or model == "ensemble":
-            predictions["polynomial"] = self._polynomial_regression(historical_data, hours_ahead)
+            predictions["polynomial"] = self._polynomial_regression(history, hours_ahead)
         
         if model == "ensemble":
             predictions["ensemble"] = self._ensemble_prediction(predictions)
-            return self._format_prediction(predictions["ensemble"], hours_ahead)
-        else:
-            return self._format_prediction(predictions[model], hours_ahead)
+        
+        return predictions
+    
+    @telemetry.timed("ml")
+    def predict_stations(self, station_ids: List[int] = None, hours_ahead: int = 3,
+                         model: str = "ensemble", lookback_hours: int = 24) -> Dict:
+        """Forecast stations straight from the recorded history store"""
+        if not self.history_store.has_hours(lookback_hours):
+            raise ValueError(f"Fewer than {lookback_hours} hours of recorded history")
+        
+        station_ids = station_ids or self.history_store.station_ids
+        history = self.history_store.hourly(lookback_hours, station_ids)
+        return {
+            "station_ids": station_ids,
+            "predictions": self.predict_crowd_batch(history, hours_ahead, model)
+        }
     
-    def _simple_moving_average(self, data: List[int], hours: int, window: int = 5) -> List[float]:
-        """Simple Moving Average prediction"""
-        predictions = []
+    def _simple_moving_average(self, data: np.ndarray, hours: int, window: int = 5) -> np.ndarray:
+        """Simple Moving Average prediction, feeding each forecast into the next window"""
+        window = min(window, data.shape[1])
+        # Trailing window sum from the cumulative sum, then a running update per step
+        csum = np.cumsum(data, axis=1)
+        running = csum[:, -1] - (csum[:, -window - 1] if data.shape[1] > window else 0)
+        tail = data[:, -window:].copy()
+        
+        predictions = np.empty((data.shape[0], hours))
         for i in range(hours):
-            if len(data) >= window:
-                pred = np.mean(data[-window:])
-            else:
-                pred = np.mean(data)
-            predictions.append(pred)
-            data.append(pred)  # Use prediction for next iteration
+            pred = running / window
+            predictions[:, i] = pred
+            running += pred - tail[:, i % window]
+            tail[:, i % window] = pred
         return predictions
     
-    def _exponential_smoothing(self, data: List[int], hours: int, alpha: float = 0.3) -> List[float]:
+    def _exponential_smoothing(self, data: np.ndarray, hours: int, alpha: float = 0.3) -> np.ndarray:
         """Exponential Smoothing prediction"""
-        if len(data) == 0:
-            return [0] * hours
-        
-        predictions = []
-        last_value = data[-1]
+        level = data[:, -10:].mean(axis=1, keepdims=True)
+        last_value = data[:, -1:]
         
-        for _ in range(hours):
-            # Simple exponential smoothing
-            pred = alpha * last_value + (1 - alpha) * np.mean(data[-10:] if len(data) >= 10 else data)
-            predictions.append(pred)
-            last_value = pred
-        
-        return predictions
+        # p_k = alpha * p_{k-1} + (1 - alpha) * level, unrolled in closed form
+        decay = alpha ** np.arange(1, hours + 1)
+        return level + decay * (last_value - level)
     
-    def _polynomial_regression(self, data: List[int], hours: int, degree: int = 2) -> List[float]:
+    def _polynomial_regression(self, data: np.ndarray, hours: int, degree: int = 2) -> np.ndarray:
         """Polynomial Regression prediction"""
-        if len(data) < degree + 1:
-            return [np.mean(data)] * hours
+        x = np.arange(data.shape[1])
         
-        x = np.arange(len(data))
-        y = np.array(data)
-        
-        # Fit polynomial
-        coefficients = np.polyfit(x, y, degree)
-        poly = np.poly1d(coefficients)
+        # Fit every station at once: polyfit accepts one column per series
+        coefficients = np.polyfit(x, data.T, degree)
         
         # Predict future values
-        future_x = np.arange(len(data), len(data) + hours)
-        predictions = poly(future_x)
+        future_x = np.arange(data.shape[1], data.shape[1] + hours)
+        predictions = (np.vander(future_x, degree + 1) @ coefficients).T
         
         # Ensure non-negative predictions
-        predictions = np.maximum(predictions, 0)
-        
-        return predictions.tolist()
+        return np.maximum(predictions, 0)
     
-    def _ensemble_prediction(self, predictions: Dict[str, List[float]]) -> List[float]:
+    def _ensemble_prediction(self, predictions: Dict[str, np.ndarray]) -> np.ndarray:
         """Combine predictions using weighted average"""
-        # Weights for different models
-        weights = {
-            "sma": 0.3,
-            "exponential": 0.3,
-            "polynomial": 0.4
-        }
-        
-        ensemble = []
-        num_predictions = len(predictions["sma"])
-        
-        for i in range(num_predictions):
-            weighted_sum = 0
-            for model, weight in weights.items():
-                if model in predictions:
-                    weighted_sum += predictions[model][i] * weight
-            ensemble.append(weighted_sum)
-        
-        return ensemble
+        weights = self.ensemble_weights
+        names = [name for name in weights if name in predictions]
+        stacked = np.stack([predictions[name] for name in names], axis=-1)
+        return stacked @ np.array([weights[name] for name in names])
+    
+    @telemetry.timed("ml")
+    def apply_backtest(self, result) -> Dict[str, float]:
+        """Adopt a BacktestResult's fitted weights and its per-station, per-hour error levels"""
+        relative = result.relative_rmse
+        self._adopt(dict(result.weights), np.median(relative, axis=0), dict(zip(result.station_ids, relative)))
+        if self.state.shared:
+            self._state_version = self.state.put("backtest_weights", "applied", {
+                "weights": self.ensemble_weights,
+                "network": self.calibration["network"].tolist(),
+                "stations": {str(station_id): errors.tolist()
+                             for station_id, errors in self.calibration["stations"].items()}
+            })
+        return self.ensemble_weights
+
+    def _adopt(self, weights: Dict[str, float], network: np.ndarray, stations: Dict[int, np.ndarray]):
+        self.ensemble_weights = weights
+        self.calibration = {"network": network, "stations": stations}
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def _sync(self):
+        """Adopt weights and calibration applied by another worker since the last sync"""
+        version = self.state.version("backtest_weights")
+        if version == self._state_version:
+            return
+        applied = self.state.get("backtest_weights", "applied")
+        if applied is not None:
+            self._adopt(applied["weights"], np.array(applied["network"]),
+                        {int(station_id): np.array(errors) for station_id, errors in applied["stations"].items()})
+        self._state_version = version
+
+    def weights_in_use(self) -> Dict[str, float]:
+        if self.state.shared:
+            self._sync()
+        return self.ensemble_weights
+    
+    def relative_error(self, hours: int, station_id: int = None) -> np.ndarray:
+        """Backtested ensemble RMSE / level for 1..hours ahead (station-specific when known)"""
+        if self.calibration is None:
+            # Uncalibrated: the historical +-15% band read as a 90% interval
+            return np.full(hours, 0.15 / 1.645)
+        errors = self.calibration["stations"].get(station_id, self.calibration["network"])
+        # Beyond the backtested horizon, hold the last measured error level
+        return errors[np.minimum(np.arange(hours), len(errors) - 1)]
+    
+    def confidence(self, hours: int, station_id: int = None) -> np.ndarray:
+        """Confidence in [0, 1] per hour ahead: one minus the relative backtest error"""
+        if self.state.shared:
+            self._sync()
+        if self.calibration is None:
+            return np.full(hours, 0.85)
+        return np.clip(1.0 - self.relative_error(hours, station_id), 0.0, 1.0)
     
     def _generate_synthetic_history(self, hours: int = 24) -> List[int]:
-        """Generate synthetic historical data for testing"""
-        current_hour = datetime.now().hour
-        history = []
-        
-        for i in range(hours):
-            hour = (current_hour - hours + i) % 24
-            # Simulate peak hours
-            if 9 <= hour <= 11 or 17 <= hour <= 20:
-                base = np.random.randint(250, 400)
-            else:
-                base = np.random.randint(50, 200)
-            history.append(base)
-        
-        return history
+        """Generate seeded synthetic historical data for testing"""
+        return hourly_history(hours).tolist()
     
     def _format_prediction(self, predictions: List[float], hours: int) -> Dict:
         """Format prediction output with confidence intervals"""
         current_time = datetime.now()
+        relative_error = self.relative_error(hours)
+        confidence = self.confidence(hours)
         
         formatted_predictions = []
         for i, pred in enumerate(predictions):
             hour_ahead = i + 1
             future_time = current_time + timedelta(hours=hour_ahead)
             
-            # Calculate confidence interval (±15% for demonstration)
-            confidence_margin = pred * 0.15
+            # 90% interval from the backtested relative error at this horizon
+            confidence_margin = pred * 1.645 * relative_error[i]
             
             formatted_predictions.append({
                 "hour": hour_ahead,
@@ -141,7 +211,7 @@ class MLPredictionEngine:
                     "lower": int(pred - confidence_margin),
                     "upper": int(pred + confidence_margin)
                 },
-                "confidence_score": round(85 + np.random.uniform(-5, 5), 1)
+                "confidence_score": round(float(confidence[i]) * 100, 1)
             })
         
         return {
@@ -151,10 +221,21 @@ class MLPredictionEngine:
             "generated_at": current_time.isoformat()
         }
     
+    @telemetry.timed("ml")
     def predict_peak_times(self, station_id: int, date: str = None) -> Dict:
         """Predict peak times for a specific station"""
-        # Simulated peak time predictions
+        date = date or datetime.now().strftime("%Y-%m-%d")
+        return self.cache.get_or_compute(
+            (station_id, date, "peak_times"),
+            lambda: self._predict_peak_times(station_id, date)
+        )
+    
+    def _predict_peak_times(self, station_id: int, date: str) -> Dict:
+        """Compute peak time predictions for a station"""
+        # Simulated peak time predictions, reproducible per station and date
         current_hour = datetime.now().hour
+        rng = seeded_rng(station_id, datetime.strptime(date, "%Y-%m-%d").toordinal())
+        morning_expected, evening_expected = rng.integers([300, 350], [450, 500])
         
         peaks = []
         
@@ -163,7 +244,7 @@ class MLPredictionEngine:
             peaks.append({
                 "time": "09:00-11:00",
                 "type": "morning_peak",
-                "expected_passengers": np.random.randint(300, 450),
+                "expected_passengers": int(morning_expected),
                 "confidence": 0.88
             })
         
@@ -172,13 +253,13 @@ class MLPredictionEngine:
             peaks.append({
                 "time": "17:00-20:00",
                 "type": "evening_peak",
-                "expected_passengers": np.random.randint(350, 500),
+                "expected_passengers": int(evening_expected),
                 "confidence": 0.85
             })
         
         return {
             "station_id": station_id,
-            "date": date or datetime.now().strftime("%Y-%m-%d"),
+            "date": date,
             "predicted_peaks": peaks,
             "recommendation": "Increase train frequency during predicted peak times"
         }
@@ -0,0 +1,126 @@
+"""
+Columnar Network State
+One tick of station and train data as NumPy columns, built once and shared by every engine
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+STATUS_LEVELS = ("LOW", "MEDIUM", "HIGH", "PEAK")
+RUSH_LEVELS = ("Low Rush", "Moderate Rush", "High Rush")
+
+_STATUS_CODES = {level: code for code, level in enumerate(STATUS_LEVELS)}
+_RUSH_CODES = {level: code for code, level in enumerate(RUSH_LEVELS)}
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+class NetworkState:
+    """Struct-of-arrays view of a network status.
+
+    Station columns (``station_ids``, ``station_line``, ``passengers``, ``status_code``)
+    and train columns (``train_line``, ``occupancy``, ``capacity``, ``occupancy_percent``,
+    ``rush_code``) are read-only arrays. Lines are encoded as small integers in order of
+    first appearance, shared by stations and trains, so ``lines[code]`` gives the name
+    and per-line aggregates are a single ``np.bincount``. Statuses and rush levels index
+    into ``STATUS_LEVELS`` and ``RUSH_LEVELS`` (-1 for unknown values). The source
+    records are kept in ``stations``/``trains`` for the few outputs that need them, with
+    ``names``, ``train_ids`` and ``next_stations`` as plain lists.
+    """
+
+    def __init__(self, stations: List[Dict], trains: List[Dict] = (), status: Optional[Dict] = None):
+        self.stations = stations
+        self.trains = list(trains)
+        self.status = status
+        line_codes: Dict[str, int] = {}
+        encode_line = lambda line: line_codes.setdefault(line, len(line_codes))
+
+        n = len(stations)
+        self.station_ids = _frozen(np.fromiter((s["id"] for s in stations), dtype=np.int64, count=n))
+        self.station_line = _frozen(np.fromiter((encode_line(s["line"]) for s in stations), dtype=np.int16, count=n))
+        self.passengers = _frozen(np.fromiter((s["passengers"] for s in stations), dtype=np.int64, count=n))
+        self.status_code = _frozen(np.fromiter((_STATUS_CODES.get(s["status"], -1) for s in stations),
+                                               dtype=np.int8, count=n))
+        self.names: List[str] = [s["name"] for s in stations]
+
+        t = len(self.trains)
+        self.train_ids: List = [tr["id"] for tr in self.trains]
+        self.next_stations: List[Optional[str]] = [tr.get("nextStation") for tr in self.trains]
+        self.train_line = _frozen(np.fromiter((encode_line(tr["line"]) for tr in self.trains), dtype=np.int16, count=t))
+        self.occupancy = _frozen(np.fromiter((tr.get("current_occupancy", 0) for tr in self.trains),
+                                             dtype=np.int64, count=t))
+        self.capacity = _frozen(np.fromiter((tr.get("total_capacity", 0) for tr in self.trains),
+                                            dtype=np.int64, count=t))
+        self.occupancy_percent = _frozen(np.fromiter((tr.get("occupancy_percent", 0.0) for tr in self.trains),
+                                                     dtype=np.float64, count=t))
+        self.rush_code = _frozen(np.fromiter((_RUSH_CODES.get(tr.get("seat_rush_level"), -1) for tr in self.trains),
+                                             dtype=np.int8, count=t))
+
+        self.lines: Tuple[str, ...] = tuple(line_codes)
+        self._line_codes = line_codes
+        self._index: Optional[Dict[int, int]] = None
+        self._signature: Optional[Tuple] = None
+
+    @classmethod
+    def from_status(cls, status: Dict) -> "NetworkState":
+        """State for a status dict with ``stations`` and optional ``trains``"""
+        return cls(status.get("stations", []), status.get("trains", []), status)
+
+    @classmethod
+    def ensure(cls, stations, trains: Sequence[Dict] = ()) -> "NetworkState":
+        """Pass a NetworkState through, or build one from station/train dicts"""
+        if isinstance(stations, NetworkState):
+            return stations
+        return cls(stations or [], trains or [])
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    @property
+    def index(self) -> Dict[int, int]:
+        """Station id -> row, built on first use"""
+        if self._index is None:
+            self._index = {int(sid): row for row, sid in enumerate(self.station_ids)}
+        return self._index
+
+    @property
+    def signature(self) -> Tuple:
+        """(id, name, line) per station, the key the topology is cached under"""
+        if self._signature is None:
+            self._signature = tuple(zip(self.station_ids.tolist(), self.names,
+                                        (self.lines[c] for c in self.station_line)))
+        return self._signature
+
+    def line_code(self, line: str) -> int:
+        """Integer code for a line name, -1 if the line is absent from this tick"""
+        return self._line_codes.get(line, -1)
+
+    def status_mask(self, *levels: str) -> np.ndarray:
+        """Boolean station mask for the given status names"""
+        return np.isin(self.status_code, [_STATUS_CODES[level] for level in levels])
+
+    def rush_mask(self, *levels: str) -> np.ndarray:
+        """Boolean train mask for the given seat rush levels"""
+        return np.isin(self.rush_code, [_RUSH_CODES[level] for level in levels])
+
+    def line_totals(self, values: Optional[np.ndarray] = None) -> np.ndarray:
+        """Per-line sum of a station column (passengers by default), indexed by line code"""
+        weights = self.passengers if values is None else values
+        return np.bincount(self.station_line, weights=weights, minlength=len(self.lines))
+
+    def line_counts(self) -> np.ndarray:
+        """Stations per line, indexed by line code"""
+        return np.bincount(self.station_line, minlength=len(self.lines))
+
+    def train_line_counts(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Trains per line (optionally only those in mask), indexed by line code"""
+        lines = self.train_line if mask is None else self.train_line[mask]
+        return np.bincount(lines, minlength=len(self.lines))
+
+    @property
+    def timestamp(self) -> Optional[str]:
+        return self.stations[0].get("lastUpdated") if self.stations else None
@@ -0,0 +1,129 @@
+"""
+Prediction Cache
+Time-bucketed, LRU-bounded cache with single-flight computation for forecasts
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+from shared_state import StateBackend, shared_state, state_key
+
+_MISSING = object()
+
+class PredictionCache:
+    """Entries live until the wall clock leaves the ttl bucket they were computed in.
+
+    Concurrent callers asking for a key that is already being computed wait on the
+    in-flight result instead of computing it again.
+
+    With a shared state backend, a local miss next looks in the backend's
+    "predictions" namespace, where every worker stores what it computes until the end
+    of the bucket. Local hits never touch the backend.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: int = 60, state: StateBackend = shared_state):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.state = state
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        # Bumped by invalidate(), so computations started before it do not store their result
+        # (and later lookups start a fresh computation instead of waiting on theirs)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def _bucket(self) -> int:
+        return int(time.time() // self.ttl_seconds)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for key, computing it at most once per bucket"""
+        bucket = self._bucket()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == bucket:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                self.misses += 1
+                future = Future()
+                self._in_flight[key] = future
+                owner = True
+            generation = self._generation
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = self.state.get("predictions", state_key(key), _MISSING) if self.state.shared else _MISSING
+            if value is _MISSING:
+                value = compute()
+                if self.state.shared and generation == self._generation:
+                    self.state.put("predictions", state_key(key), value, expires_at=(bucket + 1) * self.ttl_seconds)
+            else:
+                self.shared_hits += 1
+        except BaseException as e:
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            if generation == self._generation:
+                self._entries[key] = (bucket, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key: Hashable = None):
+        """Drop one key, or everything when key is None"""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+                self._in_flight.clear()
+            else:
+                self._entries.pop(key, None)
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.coalesced + self.shared_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global instance
+prediction_cache = PredictionCache()
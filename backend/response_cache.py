@@ -0,0 +1,104 @@
+"""
+Response Encoding Cache
+Serializes each payload version once, with a content-hash ETag and an optional gzip variant
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from static_assets import accepts_encoding, encoding_qualities
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+GZIP_MIN_BYTES = 1024
+
+
+def _default(obj):
+    # NumPy scalars and arrays leak out of the engines
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class EncodedPayload:
+    __slots__ = ("body", "etag", "gzip_body", "gzip_etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.etag = f'"{digest}"'
+        # Each representation gets its own strong validator
+        self.gzip_body = gzip.compress(body, compresslevel=6, mtime=0) if len(body) >= GZIP_MIN_BYTES else None
+        self.gzip_etag = f'"{digest}-gz"'
+
+
+class ResponseCache:
+    """Keeps the encoded bytes of the latest version of each response key"""
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[Hashable, EncodedPayload]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def encode(self, key: Hashable, version: Optional[Hashable], build: Callable[[], object]) -> EncodedPayload:
+        """Encoded payload for key at version; build() runs only when the version changes.
+
+        With version None the payload is always built, but identical content still
+        yields the same ETag.
+        """
+        if version is not None:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        encoded = EncodedPayload(dumps(build()))
+        if version is not None:
+            with self._lock:
+                self._entries[key] = (version, encoded)
+        return encoded
+
+    def respond(self, request: Request, encoded: EncodedPayload, headers: Dict[str, str] = None) -> Response:
+        """200 with the (possibly gzipped) cached body, or 304 when the client holds either variant's ETag"""
+        use_gzip = (encoded.gzip_body is not None and
+                    accepts_encoding(encoding_qualities(request.headers.get("accept-encoding", "")), "gzip"))
+        response_headers = {"ETag": encoded.gzip_etag if use_gzip else encoded.etag,
+                            "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if headers:
+            response_headers.update(headers)
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            if "*" in tags or encoded.etag in tags or encoded.gzip_etag in tags:
+                self.not_modified += 1
+                return Response(status_code=304, headers=response_headers)
+
+        if use_gzip:
+            response_headers["Content-Encoding"] = "gzip"
+            return Response(encoded.gzip_body, media_type="application/json", headers=response_headers)
+        return Response(encoded.body, media_type="application/json", headers=response_headers)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
+
+
+# Global instance
+response_cache = ResponseCache()
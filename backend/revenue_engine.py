@@ -3,39 +3,331 @@ Revenue Analytics Engine
 Financial analytics for metro operations
 """
 
-from typing import Dict, List
-import random
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
+from metro_topology import metro_topology
+from network_state import NetworkState
+from od_matrix import od_engine
+from telemetry import telemetry
+
+TRIP_COLUMNS = ("origin_id", "destination_id", "timestamp")
+
+
+class FareMatrix:
+    """Station-to-station track distances and fares for one topology version.
+
+    Distances are shortest paths over the ``km`` edge weights (interchanges are free),
+    and a trip costs base_fare + per_km_rate per started km. Networks up to dense_limit
+    stations keep the whole fare matrix (float32). Larger ones compute fare rows per
+    origin on demand and keep the most recent cache_rows in an LRU.
+    """
+
+    def __init__(self, topology=metro_topology, base_fare: float = 10, per_km_rate: float = 2,
+                 dense_limit: int = 4096, cache_rows: int = 2048):
+        self.topology = topology
+        self.base_fare = base_fare
+        self.per_km_rate = per_km_rate
+        self.dense_limit = dense_limit
+        self.cache_rows = cache_rows
+        self.fare: Optional[np.ndarray] = None
+        self.version = None
+        self._lock = threading.Lock()
+
+    def ensure(self) -> bool:
+        """Rebuild for the current topology version; returns True on rebuild"""
+        if self.version == self.topology.version:
+            return False
+        with self._lock:
+            if self.version == self.topology.version:
+                return False
+            position = self.topology.station_index
+            n = len(position)
+            rows, cols, km = [], [], []
+            for a, b, data in self.topology.graph.edges(data=True):
+                rows.append(position[a])
+                cols.append(position[b])
+                # Explicit zeros would be dropped by csgraph, so free interchanges get a tiny weight
+                km.append(max(data.get("km", 0.0), 1e-6))
+            self._km = csr_matrix((km, (rows, cols)), shape=(n, n))
+
+            ids = np.array([s["id"] for s in self.topology.stations], dtype=np.int64)
+            lines = {}
+            self.line_code = np.array([lines.setdefault(s["line"], len(lines)) for s in self.topology.stations],
+                                      dtype=np.intp)
+            self.lines = list(lines)
+            self.ids = ids
+            # Direct id -> position table for compact ids, else a sorted-id search
+            if len(ids) and ids.min() >= 0 and ids.max() <= 16 * len(ids):
+                self._lookup = np.full(ids.max() + 1, -1, dtype=np.intp)
+                self._lookup[ids] = np.arange(len(ids))
+            else:
+                self._lookup = None
+                self._id_order = np.argsort(ids, kind="stable")
+
+            self._rows: "OrderedDict[int, np.ndarray]" = OrderedDict()
+            self.fare = self._price(shortest_path(self._km, directed=False)) if n <= self.dense_limit else None
+            self.version = self.topology.version
+            return True
+
+    def _price(self, km: np.ndarray) -> np.ndarray:
+        # Unreachable pairs cost nothing and are counted as rejected by callers
+        return np.where(np.isfinite(km), self.base_fare + self.per_km_rate * np.ceil(km - 1e-3), 0).astype(np.float32)
+
+    def positions(self, station_ids: Sequence[int]) -> np.ndarray:
+        """Topology positions of station ids; -1 for unknown ids"""
+        ids = np.asarray(station_ids, dtype=np.int64)
+        if self._lookup is not None:
+            known = (ids >= 0) & (ids < len(self._lookup))
+            return np.where(known, self._lookup[np.where(known, ids, 0)], -1)
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype=np.intp)
+        sorted_ids = self.ids[self._id_order]
+        found = np.searchsorted(sorted_ids, ids).clip(0, len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == ids, self._id_order[found], -1)
+
+    def _fare_rows(self, origins: np.ndarray) -> np.ndarray:
+        missing = [o for o in origins.tolist() if o not in self._rows]
+        if missing:
+            priced = self._price(shortest_path(self._km, directed=False, indices=missing))
+            for origin, row in zip(missing, priced):
+                self._rows[origin] = row
+        rows = []
+        for origin in origins.tolist():
+            self._rows.move_to_end(origin)
+            rows.append(self._rows[origin])
+        while len(self._rows) > self.cache_rows:
+            self._rows.popitem(last=False)
+        return np.stack(rows)
+
+    def fares(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        """Fares for pairs of topology positions"""
+        if self.fare is not None:
+            return self.fare[origins, destinations]
+        out = np.empty(len(origins), dtype=np.float32)
+        unique, inverse = np.unique(origins, return_inverse=True)
+        # Bounded batches of origin rows keep memory flat on large networks
+        batch = max(1, min(256, self.cache_rows))
+        with self._lock:
+            for start in range(0, len(unique), batch):
+                rows = self._fare_rows(unique[start:start + batch])
+                picked = (inverse >= start) & (inverse < start + batch)
+                out[picked] = rows[inverse[picked] - start, destinations[picked]]
+        return out
+
 
 class RevenueEngine:
-    def __init__(self):
+    """Corridor revenue estimates plus exact aggregates over ingested trip records.
+
+    Trip records (origin id, destination id, epoch-seconds timestamp) are priced with
+    the fare matrix. They are counted with one ``np.bincount`` over a combined
+    (origin line, destination line, hour of day) key, and by line, corridor and hour
+    are marginals of that cube. ``ingest`` streams CSV or ``.npy`` trip logs in
+    chunk_rows chunks, so memory stays flat whatever the file size.
+    """
+
+    def __init__(self, topology=metro_topology, od=od_engine, chunk_rows: int = 1_000_000,
+                 utc_offset_seconds: Optional[int] = None):
         self.base_fare = 10  # Rupees
         self.per_km_rate = 2
-        
-    def calculate_corridor_revenue(self, stations: List[Dict]) -> Dict:
-        """Calculate revenue by corridor"""
-        corridors = {}
-        
-        for station in stations:
-            line = station["line"]
-            if line not in corridors:
-                corridors[line] = {
+        self.topology = topology
+        self.od = od
+        self.chunk_rows = chunk_rows
+        self.utc_offset_seconds = time.localtime().tm_gmtoff if utc_offset_seconds is None else utc_offset_seconds
+        self.fares = FareMatrix(topology, self.base_fare, self.per_km_rate)
+        self._lock = threading.Lock()
+        self._cube_version = None
+        self.trip_count = 0
+        self.rejected = 0
+
+    def _ensure(self):
+        """Fare matrix and trip accumulators for the current topology"""
+        self.fares.base_fare, self.fares.per_km_rate = self.base_fare, self.per_km_rate
+        self.fares.ensure()
+        if self._cube_version != self.fares.version:
+            lines = len(self.fares.lines)
+            self._trips = np.zeros(lines * lines * 24, dtype=np.int64)
+            self._revenue = np.zeros(lines * lines * 24)
+            self.trip_count = self.rejected = 0
+            self._cube_version = self.fares.version
+
+    @telemetry.timed("revenue")
+    def aggregate_trips(self, origin_ids: Sequence[int], destination_ids: Sequence[int],
+                        timestamps: Sequence[int]) -> Dict:
+        """Price a batch of trip records and add them to the line/corridor/hour aggregates"""
+        with self._lock:
+            self._ensure()
+            origin = self.fares.positions(origin_ids)
+            destination = self.fares.positions(destination_ids)
+            valid = (origin >= 0) & (destination >= 0)
+            origin, destination = origin[valid], destination[valid]
+            fare = self.fares.fares(origin, destination)
+            priced = fare > 0
+            origin, destination, fare = origin[priced], destination[priced], fare[priced]
+            hours = (np.asarray(timestamps, dtype=np.int64)[valid][priced] + self.utc_offset_seconds) // 3600 % 24
+
+            lines = len(self.fares.lines)
+            key = (self.fares.line_code[origin] * lines + self.fares.line_code[destination]) * 24 + hours
+            self._trips += np.bincount(key, minlength=len(self._trips))
+            self._revenue += np.bincount(key, weights=fare, minlength=len(self._revenue))
+            rejected = len(valid) - len(fare)
+            self.trip_count += len(fare)
+            self.rejected += rejected
+            return {"rows": len(valid), "priced": len(fare), "rejected": rejected,
+                    "revenue": float(fare.sum(dtype=np.float64))}
+
+    def _csv_chunks(self, path: str, chunk_rows: int) -> Iterator[np.ndarray]:
+        with open(path) as f:
+            first = f.readline()
+            if first and first.split(",")[0].strip().lstrip("-").isdigit():
+                yield np.loadtxt([first], delimiter=",", dtype=np.int64, ndmin=2)
+            while True:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", UserWarning)  # "input contained no data" at EOF
+                    chunk = np.loadtxt(f, delimiter=",", dtype=np.int64, max_rows=chunk_rows, ndmin=2)
+                if not len(chunk):
+                    return
+                yield chunk
+                if len(chunk) < chunk_rows:
+                    return
+
+    def _npy_chunks(self, path: str, chunk_rows: int) -> Iterator[np.ndarray]:
+        trips = np.load(path, mmap_mode="r")
+        if trips.dtype.names:
+            columns = [trips[name] for name in TRIP_COLUMNS]
+            for start in range(0, len(trips), chunk_rows):
+                yield np.stack([np.asarray(c[start:start + chunk_rows], dtype=np.int64) for c in columns], axis=1)
+        else:
+            for start in range(0, len(trips), chunk_rows):
+                yield np.asarray(trips[start:start + chunk_rows], dtype=np.int64)
+
+    @telemetry.timed("revenue")
+    def ingest(self, path: str, chunk_rows: Optional[int] = None) -> Dict:
+        """Stream a trip log into the aggregates.
+
+        CSV files hold integer ``origin_id,destination_id,timestamp`` rows (an optional
+        header line is skipped). ``.npy`` files hold an N x 3 integer array or a
+        structured array with those fields, and are memory-mapped.
+        """
+        chunk_rows = chunk_rows or self.chunk_rows
+        chunks = self._npy_chunks(path, chunk_rows) if path.endswith(".npy") else self._csv_chunks(path, chunk_rows)
+        start = time.perf_counter()
+        rows = rejected = 0
+        revenue = 0.0
+        for chunk in chunks:
+            if chunk.shape[1] < 3:
+                raise ValueError(f"{path}: expected columns {', '.join(TRIP_COLUMNS)}")
+            result = self.aggregate_trips(chunk[:, 0], chunk[:, 1], chunk[:, 2])
+            rows += result["rows"]
+            rejected += result["rejected"]
+            revenue += result["revenue"]
+        seconds = time.perf_counter() - start
+        return {
+            "path": os.path.basename(path),
+            "rows": rows,
+            "rejected": rejected,
+            "revenue": round(revenue, 2),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(rows / max(seconds, 1e-9))
+        }
+
+    @telemetry.timed("revenue")
+    def trip_revenue(self, top_corridors: int = 10) -> Dict:
+        """Ingested trip aggregates by line, corridor and hour of day"""
+        with self._lock:
+            if self._cube_version is None or not self.trip_count:
+                return {"trips": 0, "revenue": 0.0, "by_line": [], "top_corridors": [], "by_hour": []}
+            lines = self.fares.lines
+            trips = self._trips.reshape(len(lines), len(lines), 24)
+            revenue = self._revenue.reshape(len(lines), len(lines), 24)
+
+            corridor_trips, corridor_revenue = trips.sum(axis=2), revenue.sum(axis=2)
+            flat = np.argsort(-corridor_revenue, axis=None, kind="stable")[:top_corridors]
+            return {
+                "trips": self.trip_count,
+                "rejected": self.rejected,
+                "revenue": round(float(revenue.sum()), 2),
+                "by_line": [{
                     "line": line,
-                    "total_passengers": 0,
-                    "estimated_revenue": 0,
-                    "stations": 0
-                }
-            
-            passengers = station["passengers"]
-            avg_fare = self.base_fare + (random.randint(1, 10) * self.per_km_rate)
-            revenue = passengers * avg_fare
-            
-            corridors[line]["total_passengers"] += passengers
-            corridors[line]["estimated_revenue"] += revenue
-            corridors[line]["stations"] += 1
-        
+                    "trips": int(corridor_trips[code].sum()),
+                    "revenue": round(float(corridor_revenue[code].sum()), 2)
+                } for code, line in enumerate(lines)],
+                "top_corridors": [{
+                    "from_line": lines[o],
+                    "to_line": lines[d],
+                    "trips": int(corridor_trips[o, d]),
+                    "revenue": round(float(corridor_revenue[o, d]), 2)
+                } for o, d in zip(*np.unravel_index(flat, corridor_revenue.shape)) if corridor_trips[o, d]],
+                "by_hour": [{
+                    "hour": hour,
+                    "trips": int(t),
+                    "revenue": round(float(r), 2)
+                } for hour, (t, r) in enumerate(zip(trips.sum(axis=(0, 1)).tolist(), revenue.sum(axis=(0, 1)).tolist()))]
+            }
+
+    def _average_fares(self, n: int) -> Optional[np.ndarray]:
+        """Trip-weighted mean fare per origin position from the latest O-D fit"""
+        fit = self.od.latest if self.od is not None else None
+        if fit is None or fit.matrix.shape[0] != n or not fit.matrix.nnz:
+            return None
+        coo = fit.matrix.tocoo()
+        trips = np.bincount(coo.row, weights=coo.data, minlength=n)
+        fares = np.bincount(coo.row, weights=coo.data * self.fares.fares(coo.row, coo.col), minlength=n)
+        return np.divide(fares, trips, out=np.full(n, float(self.base_fare + self.per_km_rate)), where=trips > 0)
+
+    @telemetry.timed("revenue")
+    def calculate_corridor_revenue(self, stations) -> Dict:
+        """Calculate revenue by corridor"""
+        state = NetworkState.ensure(stations)
+        self.topology.sync(state)
+        with self._lock:
+            self._ensure()
+        # The topology was synced from this state, so its positions are state rows
+        avg_fares = self._average_fares(len(state))
+        basis = "od_matrix"
+        if avg_fares is None:
+            avg_fares, basis = np.full(len(state), float(self.base_fare + self.per_km_rate)), "minimum_fare"
+        revenue = state.line_totals(state.passengers * avg_fares)
+        passengers = state.line_totals()
+        station_counts = state.line_counts()
+
+        corridors = [{
+            "line": line,
+            "total_passengers": int(passengers[code]),
+            "estimated_revenue": int(revenue[code]),
+            "average_fare": round(float(revenue[code] / max(passengers[code], 1)), 2),
+            "stations": int(station_counts[code])
+        } for code, line in enumerate(state.lines) if station_counts[code]]
+
         return {
-            "corridors": list(corridors.values()),
-            "total_revenue": sum(c["estimated_revenue"] for c in corridors.values())
+            "corridors": corridors,
+            "total_revenue": sum(c["estimated_revenue"] for c in corridors),
+            "fare_basis": basis,
+            "trip_revenue": self.trip_revenue()
         }
 
 revenue_engine = RevenueEngine()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Aggregate trip-log revenue by line, corridor and hour")
+    parser.add_argument("paths", nargs="+", help="CSV or .npy trip logs (origin_id, destination_id, timestamp)")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    from metro_service import metro_manager
+    revenue_engine.topology.sync(NetworkState.from_status(metro_manager.get_network_status()))
+    for path in args.paths:
+        print(json.dumps(revenue_engine.ingest(path, args.chunk_rows)))
+    print(json.dumps(revenue_engine.trip_revenue(), indent=2))
@@ -0,0 +1,239 @@
+"""
+Route Planning Engine
+Crowd-aware origin-destination routing over the cached metro topology
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
+from metro_topology import metro_topology
+from network_state import STATUS_LEVELS, NetworkState
+from telemetry import telemetry
+
+
+class RoutePlanner:
+    """Shortest-path trees plus a few candidate paths per station pair, built on demand.
+
+    A topology change only rebuilds the sparse weight matrix. Shortest-path trees
+    (travel minutes and predecessors) are computed for all stations at once up to
+    precompute_limit stations. Above that they are computed per station as needed and
+    kept in an LRU of travel_cache_rows. A pair's candidates are generated on its
+    first query from the two trees of its ends: each station v gives the route
+    origin -> v -> destination, and the cheapest loop-free routes within detour_factor
+    of the fastest are kept. Candidates for at most candidate_cache_pairs pairs are
+    kept (LRU); an evicted pair's path ids are released for reuse. Each candidate
+    path carries a crowd penalty that is adjusted incrementally when a station's
+    status changes, so a repeated query is just an argmin over its candidates.
+    """
+
+    def __init__(self, topology=metro_topology, alternatives: int = 3, detour_factor: float = 1.6,
+                 precompute_limit: int = 200, candidate_cache_pairs: int = 4096, max_via_stations: int = 64):
+        self.topology = topology
+        self.alternatives = alternatives
+        self.detour_factor = detour_factor
+        self.precompute_limit = precompute_limit
+        self.candidate_cache_pairs = candidate_cache_pairs
+        self.max_via_stations = max_via_stations
+        self.travel_cache_rows = 1024
+        self.crowd_penalty_minutes = {"LOW": 0.0, "MEDIUM": 0.5, "HIGH": 2.0, "PEAK": 4.0}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        """Reset the weight matrix, penalties and caches for the current topology"""
+        ids = [s["id"] for s in self.topology.stations]
+        position = self.topology.station_index
+        rows, cols, minutes = [], [], []
+        for a, b, data in self.topology.graph.edges(data=True):
+            rows.append(position[a])
+            cols.append(position[b])
+            minutes.append(data.get("minutes", 1.0))
+        weights = csr_matrix((minutes, (rows, cols)), shape=(len(ids), len(ids)))
+
+        self.ids = ids
+        self._weights = weights
+        self._trees: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        # Full matrices only for small networks; large ones compute rows on demand
+        self._all_trees = (shortest_path(weights, directed=False, return_predecessors=True)
+                           if len(ids) <= self.precompute_limit else None)
+        self.penalty = np.zeros(len(ids))
+        self._status_code = np.full(len(ids), -2, dtype=np.int8)
+        # Indexed by NetworkState status code; the trailing entry catches unknown statuses (-1)
+        self._penalty_table = np.array([self.crowd_penalty_minutes.get(level, 0.0) for level in STATUS_LEVELS] + [0.0])
+        self._path_stations: List[Optional[np.ndarray]] = []
+        self._path_minutes: List[float] = []
+        self._path_cost = np.zeros(64)
+        self._free_paths: List[int] = []
+        self._station_paths: List[Set[int]] = [set() for _ in ids]
+        self._candidates: "OrderedDict[Tuple[int, int], List[int]]" = OrderedDict()
+        self._version = self.topology.version
+
+    def _tree(self, station: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Travel minutes and predecessors of the shortest-path tree rooted at one station position"""
+        if self._all_trees is not None:
+            return self._all_trees[0][station], self._all_trees[1][station]
+        tree = self._trees.get(station)
+        if tree is None:
+            tree = shortest_path(self._weights, directed=False, indices=station, return_predecessors=True)
+            self._trees[station] = tree
+            if len(self._trees) > self.travel_cache_rows:
+                self._trees.popitem(last=False)
+        else:
+            self._trees.move_to_end(station)
+        return tree
+
+    @staticmethod
+    def _walk_to_root(predecessors: np.ndarray, station: int) -> List[int]:
+        """Stations from station back to the root of a predecessor tree"""
+        path = [station]
+        while predecessors[station] >= 0:
+            station = int(predecessors[station])
+            path.append(station)
+        return path
+
+    def _register_path(self, stations: List[int], minutes: float) -> int:
+        if self._free_paths:
+            path_id = self._free_paths.pop()
+        else:
+            path_id = len(self._path_stations)
+            self._path_stations.append(None)
+            self._path_minutes.append(0.0)
+            if path_id >= len(self._path_cost):
+                self._path_cost = np.concatenate([self._path_cost, np.zeros(len(self._path_cost))])
+        indices = np.array(stations, dtype=np.intp)
+        self._path_stations[path_id] = indices
+        self._path_minutes[path_id] = minutes
+        self._path_cost[path_id] = self.penalty[indices].sum()
+        for station in stations:
+            self._station_paths[station].add(path_id)
+        return path_id
+
+    def _release_paths(self, path_ids: List[int]):
+        for path_id in path_ids:
+            for station in self._path_stations[path_id].tolist():
+                self._station_paths[station].discard(path_id)
+            self._path_stations[path_id] = None
+            self._free_paths.append(path_id)
+
+    def _candidate_paths(self, origin: int, destination: int) -> List[int]:
+        """Candidate path ids for a pair, generated on first use and kept in the LRU; call under _lock"""
+        key = (origin, destination)
+        candidates = self._candidates.get(key)
+        if candidates is not None:
+            self._candidates.move_to_end(key)
+            return candidates
+
+        from_origin, origin_predecessors = self._tree(origin)
+        to_destination, destination_predecessors = self._tree(destination)
+        via = from_origin + to_destination
+        fastest = via[destination]
+        admissible = np.flatnonzero(via <= fastest * self.detour_factor)
+        # The destination itself gives the fastest route, so it sorts first
+        order = admissible[np.lexsort((admissible != destination, via[admissible]))]
+
+        candidates, covered = [], set()
+        for station in order[:self.max_via_stations].tolist():
+            if station in covered:
+                continue
+            head = self._walk_to_root(origin_predecessors, station)[::-1]
+            tail = self._walk_to_root(destination_predecessors, station)[1:]
+            path = head + tail
+            if len(set(path)) != len(path):
+                continue    # the two halves meet before the via station
+            covered.update(path)
+            candidates.append(self._register_path(path, float(via[station])))
+            if len(candidates) >= self.alternatives:
+                break
+
+        self._candidates[key] = candidates
+        while len(self._candidates) > self.candidate_cache_pairs:
+            _, evicted = self._candidates.popitem(last=False)
+            self._release_paths(evicted)
+        return candidates
+
+    @telemetry.timed("route_planner")
+    def update_crowding(self, stations):
+        """Apply live station statuses (dicts or a NetworkState), touching only the paths through changed stations"""
+        state = NetworkState.ensure(stations)
+        self.topology.sync(state)
+        with self._lock:
+            if self._version != self.topology.version:
+                self._rebuild()
+            # The topology was synced from this state, so rows line up with topology positions
+            changed = np.flatnonzero(state.status_code != self._status_code)
+            if not len(changed):
+                return
+            self._status_code[changed] = state.status_code[changed]
+            new_penalty = self._penalty_table[state.status_code[changed]]
+            delta = new_penalty - self.penalty[changed]
+            self.penalty[changed] = new_penalty
+            for index, step in zip(changed[delta != 0].tolist(), delta[delta != 0].tolist()):
+                paths = self._station_paths[index]
+                if paths:
+                    self._path_cost[list(paths)] += step
+
+    @telemetry.timed("route_planner")
+    def plan_route(self, origin_id: int, destination_id: int) -> Dict:
+        """Least crowded reasonable route between two stations"""
+        if not self.topology.stations:
+            raise KeyError("Station topology not loaded yet")
+        with self._lock:
+            if self._version != self.topology.version:
+                self._rebuild()
+            position = self.topology.station_index
+            if origin_id not in position or destination_id not in position:
+                raise KeyError("Unknown station")
+            origin, destination = position[origin_id], position[destination_id]
+            fastest = float(self._tree(origin)[0][destination])
+            if not np.isfinite(fastest):
+                raise ValueError("No route between these stations")
+
+            if origin == destination:
+                candidates = []
+                best_path, best_minutes, best_penalty = np.array([origin]), 0.0, float(self.penalty[origin])
+            else:
+                candidates = self._candidate_paths(origin, destination)
+                totals = [self._path_minutes[p] + self._path_cost[p] for p in candidates]
+                best = candidates[int(np.argmin(totals))]
+                best_path = self._path_stations[best]
+                best_minutes, best_penalty = self._path_minutes[best], float(self._path_cost[best])
+            status_codes = self._status_code[best_path].tolist()
+
+        stations = self.topology.stations
+        graph = self.topology.graph
+        path_ids = [self.ids[i] for i in best_path]
+        interchanges = sum(1 for a, b in zip(path_ids, path_ids[1:]) if graph.edges[a, b].get("interchange"))
+        return {
+            "origin": {"station_id": origin_id, "station_name": stations[origin]["name"]},
+            "destination": {"station_id": destination_id, "station_name": stations[destination]["name"]},
+            "path": [
+                {
+                    "station_id": self.ids[i],
+                    "station_name": stations[i]["name"],
+                    "line": stations[i]["line"],
+                    "status": STATUS_LEVELS[code] if code >= 0 else stations[i].get("status")
+                }
+                for i, code in zip(best_path.tolist(), status_codes)
+            ],
+            "travel_minutes": round(best_minutes, 1),
+            "fastest_travel_minutes": round(fastest, 1),
+            "crowd_penalty_minutes": round(best_penalty, 1),
+            "interchanges": interchanges,
+            "alternatives_considered": len(candidates)
+        }
+
+    def resolve_station(self, ref: str) -> Optional[int]:
+        """Accept either a numeric station id or a station name"""
+        ref = str(ref).strip()
+        if ref.isdigit():
+            return int(ref)
+        return self.topology.find_station(ref)
+
+
+# Global instance
+route_planner = RoutePlanner()
@@ -1,43 +1,193 @@
+import hmac
+import os
+from collections import OrderedDict
+from typing import Dict
 from fastapi import Request, HTTPException, Response
-from starlette.middleware.base import BaseHTTPMiddleware
 import time
+from shared_state import StateBackend, shared_state
+from telemetry import telemetry
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-      def __init__(self, app, requests_per_minute: int = 60):
-                super().__init__(app)
-                self.requests_per_minute = requests_per_minute
-                self.clients = {}
-
-      async def dispatch(self, request: Request, call_next):
-                client_ip = request.client.host
-                current_time = time.time()
-                if client_ip not in self.clients:
-                              self.clients[client_ip] = []
-                          self.clients[client_ip] = [t for t in self.clients[client_ip] if current_time - t < 60]
-                if len(self.clients[client_ip]) >= self.requests_per_minute:
-                              raise HTTPException(status_code=429, detail="Too many requests. Please slow down.")
-                          self.clients[client_ip].append(current_time)
-                response = await call_next(request)
-                return response
-
-  class SecurityHeaderMiddleware(BaseHTTPMiddleware):
-        async def dispatch(self, request: Request, call_next):
-                  response = await call_next(request)
-                  response.headers["X-Frame-Options"] = "DENY"
-                  response.headers["X-Content-Type-Options"] = "nosniff"
-                  response.headers["X-XSS-Protection"] = "1; mode=block"
-                  response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-                  response.headers["Content-Security-Policy"] = (
-                      "default-src 'self'; "
-                      "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://pagead2.googlesyndication.com https://adservice.google.com https://www.googletagmanager.com https://www.google-analytics.com; "
-                      "connect-src 'self' https://pagead2.googlesyndication.com https://www.google-analytics.com; "
-                      "frame-src 'self' https://googleads.g.doubleclick.net https://tpc.googlesyndication.com https://www.google.com; "
-                      "img-src 'self' data: https://pagead2.googlesyndication.com https://www.google-analytics.com https://www.googletagmanager.com;"
-                  )
-                  return response
-
-    def validate_input_sanitization(data: str) -> str:
-          if not data: return ""
-                import re
+# Heavier endpoints draw more from a client's per-minute budget (longest prefix wins)
+DEFAULT_ROUTE_COSTS = {
+    "/analytics": 3,
+    "/predictions": 2,
+    "/predictions/batch": 10,
+    "/predictions/backtest": 20,
+    "/ai/chat/batch": 10,
+    "/route": 2,
+}
+
+rate_limit_rejections = telemetry.counter("rate_limit_rejections", "Requests rejected by the rate limiter")
+
+class RateLimitMiddleware:
+    """Sliding-window-counter rate limiter as a pure ASGI middleware.
+
+    Each client keeps only the previous and current window counts, so a request is
+    O(1). Clients live in an LRU map capped at max_clients, which evicts idle IPs first.
+    With a shared state backend the counts are kept there instead, so every worker
+    charges the same per-client budget. A worker reserves reserve_units at a time
+    there and spends them locally, so only about one request in reserve_units writes
+    to the backend. Near the limit it reserves just the request's cost. Units reserved
+    but unspent when the window rolls over still count, so a client may be refused up
+    to reserve_units per worker early. After a refusal, the client is refused locally
+    for the time it takes one unit to expire.
+    """
+
+    def __init__(self, app, requests_per_minute: int = 60, max_clients: int = 10000,
+                 route_costs: Dict[str, int] = None, window_seconds: int = 60,
+                 state: StateBackend = shared_state, reserve_units: int = 10):
+        self.app = app
+        self.state = state
+        self.reserve_units = reserve_units
+        self.requests_per_minute = requests_per_minute
+        self.max_clients = max_clients
+        self.window_seconds = window_seconds
+        costs = DEFAULT_ROUTE_COSTS if route_costs is None else route_costs
+        self.route_prefixes = sorted(costs.items(), key=lambda item: len(item[0]), reverse=True)
+        self.clients: "OrderedDict[str, list]" = OrderedDict()
+        self.rejected = 0
+
+    def route_cost(self, path: str) -> int:
+        """Cost of the longest matching prefix; prefixes match whole path segments only"""
+        for prefix, cost in self.route_prefixes:
+            if path == prefix or path.startswith(prefix + "/"):
+                return cost
+        return 1
+
+    def allow(self, client_ip: str, cost: int = 1, now: float = None) -> bool:
+        """Charge cost to the client's budget; False when it would exceed the limit"""
+        now = time.time() if now is None else now
+        if self.state.shared:
+            return self._allow_shared(client_ip, cost, now)
+
+        window = int(now // self.window_seconds)
+        state = self.clients.get(client_ip)
+        if state is None:
+            state = [window, 0, 0]
+            self.clients[client_ip] = state
+            if len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+        else:
+            self.clients.move_to_end(client_ip)
+            if state[0] != window:
+                # Roll forward; anything older than one window no longer counts
+                state[1] = state[2] if state[0] == window - 1 else 0
+                state[2] = 0
+                state[0] = window
+
+        elapsed = (now % self.window_seconds) / self.window_seconds
+        estimated = state[1] * (1 - elapsed) + state[2]
+        if estimated + cost > self.requests_per_minute:
+            self.rejected += 1
+            rate_limit_rejections.inc()
+            return False
+        state[2] += cost
+        return True
+
+    def _allow_shared(self, client_ip: str, cost: int, now: float) -> bool:
+        """Spend from the client's locally held reservation, reserving more in the backend when it runs out"""
+        window = int(now // self.window_seconds)
+        # [window, units left, refused at]
+        grant = self.clients.get(client_ip)
+        if grant is not None:
+            self.clients.move_to_end(client_ip)
+            if grant[0] == window and grant[1] >= cost:
+                grant[1] -= cost
+                return True
+            if now - grant[2] < self.window_seconds / self.requests_per_minute:
+                self.rejected += 1
+                rate_limit_rejections.inc()
+                return False
+
+        allowed = False
+        for units in sorted({max(cost, self.reserve_units), cost}, reverse=True):
+            allowed = self.state.charge(client_ip, now, self.window_seconds, units, self.requests_per_minute)
+            if allowed:
+                break
+        self.clients[client_ip] = [window, units - cost, float("-inf")] if allowed else [window, 0, now]
+        self.clients.move_to_end(client_ip)
+        if len(self.clients) > self.max_clients:
+            self.clients.popitem(last=False)
+        if not allowed:
+            self.rejected += 1
+            rate_limit_rejections.inc()
+        return allowed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        if self.allow(client_ip, self.route_cost(scope["path"])):
+            return await self.app(scope, receive, send)
+
+        body = b'{"detail":"Too many requests. Please slow down."}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.window_seconds).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+DEFAULT_CONTENT_SECURITY_POLICY = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://pagead2.googlesyndication.com https://adservice.google.com https://www.googletagmanager.com https://www.google-analytics.com; "
+    "connect-src 'self' https://pagead2.googlesyndication.com https://www.google-analytics.com; "
+    "frame-src 'self' https://googleads.g.doubleclick.net https://tpc.googlesyndication.com https://www.google.com; "
+    "img-src 'self' data: https://pagead2.googlesyndication.com https://www.google-analytics.com https://www.googletagmanager.com;"
+)
+
+class SecurityHeaderMiddleware:
+    """Pure ASGI middleware appending a header block encoded once at startup.
+
+    The CSP comes from the content_security_policy argument, then the
+    CONTENT_SECURITY_POLICY environment variable, then the default above.
+    """
+
+    def __init__(self, app, content_security_policy: str = None):
+        self.app = app
+        csp = content_security_policy or os.environ.get("CONTENT_SECURITY_POLICY", DEFAULT_CONTENT_SECURITY_POLICY)
+        self.headers = [
+            (b"x-frame-options", b"DENY"),
+            (b"x-content-type-options", b"nosniff"),
+            (b"x-xss-protection", b"1; mode=block"),
+            (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+            (b"content-security-policy", csp.encode("latin-1")),
+        ]
+        self.header_names = frozenset(name for name, _ in self.headers)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                # Replace rather than duplicate any of these the app already set
+                names = self.header_names
+                message["headers"] = [h for h in message.get("headers", ()) if h[0].lower() not in names] + self.headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+def require_admin(request: Request):
+    """Dependency for admin-only endpoints: the X-Admin-Token header must equal ADMIN_TOKEN.
+
+    Admin endpoints answer 404 while the ADMIN_TOKEN environment variable is unset.
+    """
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def validate_input_sanitization(data: str) -> str:
+    if not data: return ""
+    import re
     clean = re.sub(r'<.*?>', '', data)
     return clean.replace("'", "''").strip()
@@ -0,0 +1,332 @@
+"""
+Shared State
+Pluggable store for state that must agree across uvicorn workers: incidents, rate limits, caches, the snapshot
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Hashable, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+_MISSING = object()
+
+
+def _default(obj):
+    # NumPy scalars and arrays leak out of the engines
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def encode(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+
+def decode(blob: bytes):
+    return orjson.loads(blob) if orjson is not None else json.loads(blob)
+
+
+class StateBackend(ABC):
+    """Namespaced key-value store with per-namespace versions, counters, rate limits and leases.
+
+    Every write to a namespace bumps its version, so a reader can poll version()
+    (one small read) and reload the namespace only when it has changed. ``shared`` is
+    False for the in-process backend, letting callers keep their existing local-only
+    fast paths. Values must be JSON-serializable (NumPy values come back as lists);
+    the in-process backend keeps them as they are.
+    """
+
+    shared = False
+
+    @abstractmethod
+    def version(self, namespace: str) -> int:
+        """Number of writes to namespace so far"""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, default=None):
+        """Value for key, or default when it is missing or expired"""
+
+    @abstractmethod
+    def put(self, namespace: str, key: str, value, expires_at: Optional[float] = None) -> int:
+        """Store value (until expires_at, if given) and return the namespace's new version"""
+
+    @abstractmethod
+    def remove(self, namespace: str, key: str) -> bool:
+        """Delete key; True only for the caller that actually removed it"""
+
+    @abstractmethod
+    def items(self, namespace: str) -> Dict[str, object]:
+        """Unexpired entries in insertion order"""
+
+    @abstractmethod
+    def trim(self, namespace: str, keep: int):
+        """Drop the oldest entries beyond the newest keep"""
+
+    @abstractmethod
+    def next_id(self, name: str, start: int = 1) -> int:
+        """Next value of a named sequence that starts at start"""
+
+    @abstractmethod
+    def charge(self, client: str, now: float, window_seconds: int, cost: int, limit: int) -> bool:
+        """Sliding-window-counter admission: charge cost unless it would exceed limit"""
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float, now: float = None) -> bool:
+        """Take or renew a named lease; False while another owner holds an unexpired one"""
+
+
+def sliding_window(state: Optional[Tuple[int, float, float]], now: float, window_seconds: int,
+                   cost: int, limit: int) -> Tuple[bool, Tuple[int, float, float]]:
+    """(allowed, new state) for a (window, previous count, current count) rate-limit state"""
+    window = int(now // window_seconds)
+    if state is None:
+        previous = current = 0
+    elif state[0] == window:
+        previous, current = state[1], state[2]
+    else:
+        # Roll forward; anything older than one window no longer counts
+        previous, current = (state[2] if state[0] == window - 1 else 0), 0
+    elapsed = (now % window_seconds) / window_seconds
+    if previous * (1 - elapsed) + current + cost > limit:
+        return False, (window, previous, current)
+    return True, (window, previous, current + cost)
+
+
+class InProcessBackend(StateBackend):
+    """Dicts behind one lock; the default for a single worker"""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Tuple[object, Optional[float]]]] = {}
+        self._versions: Dict[str, int] = {}
+        self._counters: Dict[str, int] = {}
+        self._rates: Dict[str, Tuple[int, float, float]] = {}
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def get(self, namespace: str, key: str, default=None):
+        entry = self._data.get(namespace, {}).get(key)
+        if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+            return default
+        return entry[0]
+
+    def put(self, namespace: str, key: str, value, expires_at: Optional[float] = None) -> int:
+        with self._lock:
+            entries = self._data.setdefault(namespace, {})
+            entries.pop(key, None)
+            entries[key] = (value, expires_at)
+            version = self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return version
+
+    def remove(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            if self._data.get(namespace, {}).pop(key, _MISSING) is _MISSING:
+                return False
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return True
+
+    def items(self, namespace: str) -> Dict[str, object]:
+        now = time.time()
+        with self._lock:
+            return {key: value for key, (value, expires_at) in self._data.get(namespace, {}).items()
+                    if expires_at is None or expires_at > now}
+
+    def trim(self, namespace: str, keep: int):
+        with self._lock:
+            entries = self._data.get(namespace, {})
+            for key in list(entries)[:max(len(entries) - keep, 0)]:
+                del entries[key]
+
+    def next_id(self, name: str, start: int = 1) -> int:
+        with self._lock:
+            value = self._counters[name] = self._counters.get(name, start - 1) + 1
+            return value
+
+    def charge(self, client: str, now: float, window_seconds: int, cost: int, limit: int) -> bool:
+        with self._lock:
+            allowed, self._rates[client] = sliding_window(self._rates.get(client), now, window_seconds, cost, limit)
+            return allowed
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            holder = self._leases.get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False
+            self._leases[name] = (owner, now + ttl_seconds)
+            return True
+
+
+class SQLiteBackend(StateBackend):
+    """One SQLite database in WAL mode shared by every worker on the host.
+
+    Readers never block writers (or each other) under WAL, so the hot-path reads
+    (version checks, cache lookups) are plain SELECTs. Writes that read first (rate
+    limits, leases, ids) run in BEGIN IMMEDIATE transactions. Each thread keeps its
+    own connection. Values are stored as JSON. The database file is created readable
+    and writable by its owner only.
+    """
+
+    shared = True
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS kv (namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+        "expires_at REAL, PRIMARY KEY (namespace, key))",
+        "CREATE TABLE IF NOT EXISTS versions (namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS rate_limits (client TEXT PRIMARY KEY, window INTEGER NOT NULL, "
+        "previous REAL NOT NULL, current REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)",
+    )
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000, purge_every: int = 1024):
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        with self._transaction() as db:
+            for statement in self.SCHEMA:
+                db.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Immediate(self._connection())
+
+    def _bump(self, db: sqlite3.Connection, namespace: str) -> int:
+        return db.execute("INSERT INTO versions VALUES (?, 1) ON CONFLICT (namespace) DO UPDATE "
+                          "SET version = version + 1 RETURNING version", (namespace,)).fetchone()[0]
+
+    def _purge(self, db: sqlite3.Connection, now: float):
+        """Every purge_every writes, drop expired entries and leases"""
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            db.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            db.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+
+    def version(self, namespace: str) -> int:
+        row = self._connection().execute("SELECT version FROM versions WHERE namespace = ?", (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, namespace: str, key: str, default=None):
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())).fetchone()
+        return decode(row[0]) if row else default
+
+    def put(self, namespace: str, key: str, value, expires_at: Optional[float] = None) -> int:
+        blob = encode(value)
+        with self._transaction() as db:
+            # Delete first so the entry moves to the end of the insertion order
+            db.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+            db.execute("INSERT INTO kv VALUES (?, ?, ?, ?)", (namespace, key, blob, expires_at))
+            self._purge(db, time.time())
+            return self._bump(db, namespace)
+
+    def remove(self, namespace: str, key: str) -> bool:
+        with self._transaction() as db:
+            if db.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).rowcount == 0:
+                return False
+            self._bump(db, namespace)
+            return True
+
+    def items(self, namespace: str) -> Dict[str, object]:
+        rows = self._connection().execute(
+            "SELECT key, value FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?) ORDER BY rowid",
+            (namespace, time.time()))
+        return {key: decode(value) for key, value in rows}
+
+    def trim(self, namespace: str, keep: int):
+        with self._transaction() as db:
+            db.execute("DELETE FROM kv WHERE namespace = ? AND rowid NOT IN "
+                       "(SELECT rowid FROM kv WHERE namespace = ? ORDER BY rowid DESC LIMIT ?)",
+                       (namespace, namespace, keep))
+
+    def next_id(self, name: str, start: int = 1) -> int:
+        with self._transaction() as db:
+            return db.execute("INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE "
+                              "SET value = value + 1 RETURNING value", (name, start)).fetchone()[0]
+
+    def charge(self, client: str, now: float, window_seconds: int, cost: int, limit: int) -> bool:
+        with self._transaction() as db:
+            row = db.execute("SELECT window, previous, current FROM rate_limits WHERE client = ?", (client,)).fetchone()
+            allowed, state = sliding_window(row, now, window_seconds, cost, limit)
+            if state != row:
+                db.execute("INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?)", (client, *state))
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                db.execute("DELETE FROM rate_limits WHERE window < ?", (int(now // window_seconds) - 1,))
+            return allowed
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: float, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        with self._transaction() as db:
+            row = db.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, owner, now + ttl_seconds))
+            return True
+
+
+class _Immediate:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error) on an autocommit connection"""
+
+    __slots__ = ("db",)
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def state_key(key: Hashable) -> str:
+    """Stable text key for tuples of ids and names"""
+    return key if isinstance(key, str) else repr(key)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def from_env() -> StateBackend:
+    """STATE_BACKEND=memory (default) or sqlite; sqlite needs STATE_PATH, the SQLite file"""
+    kind = os.environ.get("STATE_BACKEND", "memory").lower()
+    if kind == "memory":
+        return InProcessBackend()
+    if kind == "sqlite":
+        path = os.environ.get("STATE_PATH")
+        if not path:
+            raise ValueError("STATE_BACKEND=sqlite needs STATE_PATH, a file in a directory only this service can write")
+        return SQLiteBackend(path)
+    raise ValueError(f"Unknown STATE_BACKEND '{kind}', expected memory or sqlite")
+
+
+# Global instance
+shared_state = from_env()
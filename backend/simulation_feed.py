@@ -0,0 +1,347 @@
+"""
+Simulation Feed
+Seeded, vectorized station and train streams with peak profiles, trace replay and paced delivery
+"""
+
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.signal import lfilter
+
+# Deterministic unless overridden; every generator derives its stream from this
+SIMULATION_SEED = int(os.environ.get("SIMULATION_SEED", 0))
+
+
+def is_peak_hour(hour_of_day: np.ndarray) -> np.ndarray:
+    """The service's peak windows: 09:00-11:59 and 17:00-20:59"""
+    return ((hour_of_day >= 9) & (hour_of_day <= 11)) | ((hour_of_day >= 17) & (hour_of_day <= 20))
+
+
+def seeded_rng(*keys: int, seed: int = None) -> np.random.Generator:
+    """Generator keyed by the simulation seed plus integers such as a station id and a date"""
+    return np.random.default_rng([SIMULATION_SEED if seed is None else seed, *keys])
+
+
+def hourly_history(hours: int, station_id: int = 0, end: Optional[float] = None,
+                   peak: Tuple[int, int] = (250, 400), off_peak: Tuple[int, int] = (50, 200),
+                   seed: int = None) -> np.ndarray:
+    """Counts for the hours before the one containing end (default now), uniform in the peak or off-peak range.
+
+    Draws are seeded per station and local day, so each day differs and an hour has
+    the same count in every window that includes it.
+    """
+    end = time.time() if end is None else end
+    current_hour = int((end + time.localtime(end).tm_gmtoff) // 3600)
+    epoch_hours = current_hour - hours + np.arange(hours)
+    first_day = int(epoch_hours[0] // 24) if hours else 0
+    draws = np.concatenate([seeded_rng(station_id, day, seed=seed).random(24)
+                            for day in range(first_day, current_hour // 24 + 1)])
+    uniform = draws[epoch_hours - first_day * 24]
+    peak_hours = is_peak_hour(epoch_hours % 24)
+    low = np.where(peak_hours, peak[0], off_peak[0])
+    high = np.where(peak_hours, peak[1], off_peak[1])
+    return (low + uniform * (high - low)).astype(np.int64)
+
+
+def demand_profile(timestamps: np.ndarray) -> np.ndarray:
+    """Demand multiplier per timestamp: weekday morning/evening peaks, flatter weekends, quiet nights"""
+    local = timestamps + time.localtime().tm_gmtoff
+    hours = (local % 86400) / 3600.0
+    weekday = ((local // 86400 + 3) % 7) < 5  # the epoch was a Thursday
+    morning = np.exp(-((hours - 9.5) ** 2) / 2.5)
+    evening = np.exp(-((hours - 18.5) ** 2) / 3.5)
+    midday = np.exp(-((hours - 14.0) ** 2) / 8.0)
+    night = np.clip(1.0 - np.exp(-((hours - 3.0) ** 2) / 6.0), 0.05, 1.0)
+    weekday_curve = 0.35 + 1.6 * morning + 1.4 * evening + 0.3 * midday
+    weekend_curve = 0.45 + 0.7 * midday + 0.3 * evening
+    return np.where(weekday, weekday_curve, weekend_curve) * night
+
+
+class FeedFrame(NamedTuple):
+    """One time step: passengers per station and occupancy per train"""
+    timestamp: float
+    passengers: np.ndarray
+    occupancy: np.ndarray
+
+
+class FeedBlock(NamedTuple):
+    """Consecutive time steps: steps x stations and steps x trains matrices"""
+    timestamps: np.ndarray
+    passengers: np.ndarray
+    occupancy: np.ndarray
+
+    def frames(self) -> Iterator[FeedFrame]:
+        for i, timestamp in enumerate(self.timestamps.tolist()):
+            yield FeedFrame(timestamp, self.passengers[i], self.occupancy[i])
+
+
+class EventBatch(NamedTuple):
+    """Flat (timestamp, station_id, passengers) events, one array per field"""
+    timestamps: np.ndarray
+    station_ids: np.ndarray
+    passengers: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+
+class _Feed(ABC):
+    """Iteration, batching and pacing shared by simulated and replayed feeds.
+
+    Subclasses provide station_ids, train_ids, resolution_seconds and block().
+    """
+
+    station_ids: np.ndarray
+    train_ids: List[str]
+    resolution_seconds: float
+
+    @abstractmethod
+    def block(self, steps: int) -> Optional[FeedBlock]:
+        """The next steps time steps, or None when the feed is exhausted"""
+
+    def blocks(self, steps: Optional[int] = None, block_steps: int = 1440) -> Iterator[FeedBlock]:
+        """Blocks of up to block_steps until steps have been produced (forever if None)"""
+        remaining = steps
+        while remaining is None or remaining > 0:
+            block = self.block(block_steps if remaining is None else min(block_steps, remaining))
+            if block is None or not len(block.timestamps):
+                return
+            if remaining is not None:
+                remaining -= len(block.timestamps)
+            yield block
+
+    def frames(self, steps: Optional[int] = None) -> Iterator[FeedFrame]:
+        for block in self.blocks(steps):
+            yield from block.frames()
+
+    def batches(self, batch_events: int = 65536, steps: Optional[int] = None) -> Iterator[EventBatch]:
+        """Event batches of whole frames, about batch_events events each"""
+        stations = len(self.station_ids)
+        block_steps = max(1, batch_events // max(stations, 1))
+        for block in self.blocks(steps, block_steps):
+            rows = len(block.timestamps)
+            yield EventBatch(np.repeat(block.timestamps, stations), np.tile(self.station_ids, rows),
+                             block.passengers.reshape(-1))
+
+    def events(self, steps: Optional[int] = None) -> Iterator[Tuple[float, int, int]]:
+        """Single (timestamp, station_id, passengers) events"""
+        for batch in self.batches(steps=steps):
+            yield from zip(batch.timestamps.tolist(), batch.station_ids.tolist(), batch.passengers.tolist())
+
+    async def stream(self, rate: Optional[float] = None, batch_events: int = 16384,
+                     steps: Optional[int] = None) -> AsyncIterator[EventBatch]:
+        """Event batches paced to `rate` events per second (unpaced when None)"""
+        started = time.perf_counter()
+        delivered = 0
+        for batch in self.batches(batch_events, steps):
+            if rate:
+                delay = started + delivered / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)
+            delivered += len(batch)
+            yield batch
+
+    async def drive(self, sinks: Sequence[Callable[[FeedFrame], None]], rate: Optional[float] = None,
+                    steps: Optional[int] = None) -> Dict:
+        """Push frames into backend sinks at `rate` station events per second; returns throughput"""
+        stations = max(len(self.station_ids), 1)
+        started = time.perf_counter()
+        frames = 0
+        for frame in self.frames(steps):
+            if rate:
+                delay = started + frames * stations / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            for sink in sinks:
+                sink(frame)
+            frames += 1
+            if not rate and frames % 64 == 0:
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+        return {
+            "frames": frames,
+            "events": frames * stations,
+            "seconds": round(elapsed, 3),
+            "events_per_second": round(frames * stations / elapsed, 1) if elapsed else None,
+            "simulated_seconds": frames * self.resolution_seconds
+        }
+
+    def record(self, path: str, steps: int):
+        """Write the next steps of this feed as a replayable .npz trace"""
+        blocks = list(self.blocks(steps))
+        np.savez_compressed(
+            path,
+            station_ids=self.station_ids,
+            train_ids=np.array(self.train_ids, dtype=str),
+            resolution_seconds=self.resolution_seconds,
+            timestamps=np.concatenate([b.timestamps for b in blocks]),
+            passengers=np.concatenate([b.passengers for b in blocks]),
+            occupancy=np.concatenate([b.occupancy for b in blocks])
+        )
+
+
+class SimulationFeed(_Feed):
+    """Seeded synthetic network feed running at any speed.
+
+    Station demand is a per-station base level times demand_profile(), with AR(1)
+    log-noise so that counts drift smoothly instead of jumping. Train occupancy
+    follows the same profile, capped at capacity. All steps of a block are
+    generated in one vectorized pass, and the noise state carries across blocks,
+    so any block size gives the same stream for the same seed.
+    """
+
+    def __init__(self, stations=27, trains: int = 12, seed: int = None, start: Optional[float] = None,
+                 resolution_seconds: float = 60, train_capacity: int = 300,
+                 noise: float = 0.12, persistence: float = 0.9):
+        self.station_ids = (np.arange(1, stations + 1) if isinstance(stations, int)
+                            else np.asarray(stations, dtype=np.int64))
+        self.train_ids = [f"T{100 + i}" for i in range(trains)]
+        self.resolution_seconds = resolution_seconds
+        self.train_capacity = train_capacity
+        self.noise = noise
+        self.persistence = persistence
+        self.rng = seeded_rng(len(self.station_ids), trains, seed=seed)
+
+        self.base = self.rng.lognormal(mean=4.9, sigma=0.5, size=len(self.station_ids))
+        self.train_base = self.rng.uniform(0.25, 0.55, size=trains) * train_capacity
+        now = time.time() if start is None else start
+        self.time = float(now - now % resolution_seconds)
+        self._noise_state = np.zeros((1, len(self.station_ids) + trains))
+
+    def block(self, steps: int) -> FeedBlock:
+        timestamps = self.time + np.arange(steps) * self.resolution_seconds
+        self.time += steps * self.resolution_seconds
+
+        shocks = self.rng.normal(0.0, self.noise, size=(steps, self._noise_state.shape[1]))
+        noise, self._noise_state = lfilter([1.0], [1.0, -self.persistence], shocks, axis=0,
+                                           zi=self._noise_state)
+        multiplier = np.exp(noise)
+        profile = demand_profile(timestamps)[:, np.newaxis]
+        stations = len(self.station_ids)
+
+        passengers = np.rint(self.base * profile * multiplier[:, :stations]).astype(np.int32)
+        occupancy = np.clip(np.rint(self.train_base * profile * multiplier[:, stations:]),
+                            0, self.train_capacity).astype(np.int32)
+        return FeedBlock(timestamps, passengers, occupancy)
+
+    def simulate(self, days: float) -> FeedBlock:
+        """Whole days of accelerated time in one block"""
+        return self.block(int(days * 86400 // self.resolution_seconds))
+
+
+class TraceFeed(_Feed):
+    """Replays a recorded .npz trace (see _Feed.record), optionally looping with shifted timestamps"""
+
+    def __init__(self, path: str, loop: bool = False):
+        with np.load(path) as trace:
+            self.station_ids = trace["station_ids"]
+            self.train_ids = trace["train_ids"].tolist()
+            self.resolution_seconds = float(trace["resolution_seconds"])
+            self.timestamps = trace["timestamps"]
+            self.passengers = trace["passengers"]
+            self.occupancy = trace["occupancy"]
+        self.loop = loop
+        self._position = 0
+        self._offset = 0.0
+
+    def block(self, steps: int) -> Optional[FeedBlock]:
+        total = len(self.timestamps)
+        if self._position >= total:
+            if not self.loop or not total:
+                return None
+            self._offset += self.timestamps[-1] - self.timestamps[0] + self.resolution_seconds
+            self._position = 0
+        rows = slice(self._position, min(self._position + steps, total))
+        self._position = rows.stop
+        return FeedBlock(self.timestamps[rows] + self._offset, self.passengers[rows], self.occupancy[rows])
+
+
+class FeedStatusSource:
+    """``metro_manager``-compatible status source backed by a feed.
+
+    Each get_network_status() call consumes one frame; get_train_status() reports the
+    trains of that same frame. Station and train templates supply ids, names and
+    lines; by default stations are named by id and split into lines of line_length.
+    """
+
+    STATUS_THRESHOLDS = (100, 300, 400)
+    STATUS_LEVELS = np.array(["LOW", "MEDIUM", "HIGH", "PEAK"])
+    RUSH_LEVELS = np.array(["Low Rush", "Moderate Rush", "High Rush"])
+
+    def __init__(self, feed: _Feed, stations: Optional[List[Dict]] = None, trains: Optional[List[Dict]] = None,
+                 line_length: int = 25, train_capacity: int = 300):
+        self.feed = feed
+        self.stations = stations or [
+            {"id": int(sid), "name": f"Station {sid}", "line": f"L{row // line_length}"}
+            for row, sid in enumerate(feed.station_ids.tolist())
+        ]
+        line_names = sorted({s["line"] for s in self.stations})
+        self.trains = trains or [
+            {"id": tid, "line": line_names[i % len(line_names)]} for i, tid in enumerate(feed.train_ids)
+        ]
+        self.train_capacity = train_capacity
+        self._frames = feed.frames()
+        self._frame: Optional[FeedFrame] = None
+
+    def get_network_status(self) -> Dict:
+        self._frame = next(self._frames)
+        passengers = self._frame.passengers
+        levels = self.STATUS_LEVELS[np.searchsorted(self.STATUS_THRESHOLDS, passengers, side="right")]
+        updated = datetime.fromtimestamp(self._frame.timestamp).isoformat()
+        stations = [dict(template, passengers=count, status=level, lastUpdated=updated)
+                    for template, count, level in zip(self.stations, passengers.tolist(), levels.tolist())]
+        return {"stations": stations, "summary": {"totalPassengers": int(passengers.sum()), "stations": len(stations)}}
+
+    def get_train_status(self) -> Dict:
+        if self._frame is None:
+            self.get_network_status()
+        occupancy = self._frame.occupancy
+        percent = np.round(occupancy / self.train_capacity * 100, 1)
+        rush = self.RUSH_LEVELS[(percent >= 40).astype(int) + (percent > 70).astype(int)]
+        return {"trains": [
+            dict(template, current_occupancy=count, total_capacity=self.train_capacity, occupancy_percent=pct,
+                 available_seats=self.train_capacity - count, seat_rush_level=level)
+            for template, count, pct, level in zip(self.trains, occupancy.tolist(), percent.tolist(), rush.tolist())
+        ]}
+
+
+def history_sink(store, station_ids: Sequence[int]) -> Callable[[FeedFrame], None]:
+    """Sink recording every frame into a StationHistoryStore"""
+    ids = [int(s) for s in station_ids]
+    return lambda frame: store.record_many(ids, frame.passengers, frame.timestamp)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Generate, record or replay a metro feed and report throughput")
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--trains", type=int, default=100)
+    parser.add_argument("--days", type=float, default=1.0, help="simulated days to produce")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=None, help="target events per second (default: unpaced)")
+    parser.add_argument("--record", help="write the generated steps to this .npz trace")
+    parser.add_argument("--replay", help="replay this .npz trace instead of simulating")
+    args = parser.parse_args()
+
+    feed = TraceFeed(args.replay) if args.replay else SimulationFeed(args.stations, args.trains, seed=args.seed)
+    steps = int(args.days * 86400 // feed.resolution_seconds)
+    if args.record:
+        feed.record(args.record, steps)
+        print(f"Recorded {steps} steps x {len(feed.station_ids)} stations to {args.record}")
+    else:
+        async def consume():
+            started, events = time.perf_counter(), 0
+            async for batch in feed.stream(args.rate, steps=steps):
+                events += len(batch)
+            elapsed = time.perf_counter() - started
+            return {"events": events, "seconds": round(elapsed, 3), "events_per_second": round(events / elapsed, 1)}
+        print(json.dumps(asyncio.run(consume()), indent=2))
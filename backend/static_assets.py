@@ -0,0 +1,186 @@
+"""
+Static Asset Server
+Serves the built frontend from memory with precompressed variants, ETags and SPA fallback
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli variants are simply not produced or served
+    brotli = None
+
+# Vite emits content-hashed names such as /assets/index-4f3a9c1b.js; files copied from public/ keep their names
+HASHED_ASSET = re.compile(
+    r"^/assets/.+-[A-Za-z0-9_-]{8}\.(js|mjs|css|map|json|wasm|svg|png|jpe?g|gif|webp|avif|ico|woff2?|ttf|otf)$")
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 1024
+
+
+def encoding_qualities(header: str) -> Dict[str, float]:
+    """Accept-Encoding parsed to {coding: q}; a missing or malformed q counts as 1"""
+    qualities = {}
+    for part in header.split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        params = params.replace(" ", "")
+        try:
+            qualities[token] = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            qualities[token] = 1.0
+    return qualities
+
+
+def accepts_encoding(qualities: Dict[str, float], encoding: str) -> bool:
+    """Whether the client accepts encoding; an explicit entry (even q=0) overrides '*'"""
+    return qualities.get(encoding, qualities.get("*", 0.0)) > 0
+
+
+def precompress(dist_path: str) -> int:
+    """Write .gz and (when brotli is installed) .br files next to every compressible asset"""
+    written = 0
+    for root, _, files in os.walk(dist_path):
+        for name in files:
+            if name.endswith((".gz", ".br")):
+                continue
+            path = os.path.join(root, name)
+            content_type = mimetypes.guess_type(name)[0] or ""
+            if os.path.getsize(path) < MIN_COMPRESS_BYTES or not content_type.startswith(COMPRESSIBLE_TYPES):
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(path + ".gz", "wb") as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            written += 1
+            if brotli is not None:
+                with open(path + ".br", "wb") as f:
+                    f.write(brotli.compress(data, quality=11))
+                written += 1
+    return written
+
+
+class _Asset:
+    __slots__ = ("variants",)
+
+    def __init__(self):
+        # encoding ("identity", "br", "gzip") -> (body, etag, response headers)
+        self.variants: Dict[str, Tuple[bytes, bytes, List[Tuple[bytes, bytes]]]] = {}
+
+
+class StaticAssets:
+    """ASGI app serving every file of a Vite build from memory.
+
+    Build-time .br/.gz siblings are picked by Accept-Encoding; assets without a
+    precompressed file get a gzip variant at load time. Hashed filenames under
+    /assets/ are served as immutable, everything else is revalidated with its ETag,
+    and unknown extensionless paths fall back to index.html.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.assets: Dict[str, _Asset] = {}
+        self.load()
+
+    def load(self):
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith((".gz", ".br")):
+                    continue
+                path = os.path.join(root, name)
+                url = "/" + os.path.relpath(path, self.directory).replace(os.sep, "/")
+                assets[url] = self._load_asset(path, url)
+        self.assets = assets
+        self.index = assets.get("/index.html")
+
+    def _load_asset(self, path: str, url: str) -> _Asset:
+        with open(path, "rb") as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        cache_control = "public, max-age=31536000, immutable" if HASHED_ASSET.search(url) else "no-cache"
+        etag = hashlib.sha256(data).hexdigest()[:20]
+
+        bodies = {"identity": data}
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if os.path.exists(path + suffix):
+                with open(path + suffix, "rb") as f:
+                    bodies[encoding] = f.read()
+        if "gzip" not in bodies and len(data) >= MIN_COMPRESS_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+            bodies["gzip"] = gzip.compress(data, mtime=0)
+
+        asset = _Asset()
+        for encoding, body in bodies.items():
+            variant_etag = f'"{etag}-{encoding}"'.encode()
+            headers = [
+                (b"content-type", content_type.encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"cache-control", cache_control.encode()),
+                (b"etag", variant_etag),
+                (b"vary", b"accept-encoding"),
+            ]
+            if encoding != "identity":
+                headers.append((b"content-encoding", encoding.encode()))
+            asset.variants[encoding] = (body, variant_etag, headers)
+        return asset
+
+    def _select(self, asset: _Asset, accept_encoding: str) -> Tuple[bytes, bytes, List[Tuple[bytes, bytes]]]:
+        if accept_encoding and len(asset.variants) > 1:
+            qualities = encoding_qualities(accept_encoding)
+            for encoding in ("br", "gzip"):
+                if encoding in asset.variants and accepts_encoding(qualities, encoding):
+                    return asset.variants[encoding]
+        return asset.variants["identity"]
+
+    def lookup(self, path: str) -> Optional[_Asset]:
+        asset = self.assets.get(path)
+        if asset is None and path.endswith("/"):
+            asset = self.assets.get(path + "index.html")
+        if asset is None and "." not in path.rsplit("/", 1)[-1]:
+            asset = self.index
+        return asset
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+
+        asset = self.lookup(scope["path"])
+        if scope["method"] not in ("GET", "HEAD"):
+            await self._respond(send, 405, b"Method Not Allowed", [(b"allow", b"GET, HEAD")])
+            return
+        if asset is None:
+            await self._respond(send, 404, b"Not Found")
+            return
+
+        request_headers = dict(scope["headers"])
+        body, etag, headers = self._select(asset, request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if_none_match = request_headers.get(b"if-none-match")
+        if if_none_match is not None:
+            if if_none_match.strip() == b"*" or etag in [tag.strip() for tag in if_none_match.split(b",")]:
+                await send({"type": "http.response.start", "status": 304,
+                            "headers": [h for h in headers if h[0] not in (b"content-length", b"content-type")]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+    @staticmethod
+    async def _respond(send, status: int, body: bytes, extra_headers: List[Tuple[bytes, bytes]] = ()):
+        headers = [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers + list(extra_headers)})
+        await send({"type": "http.response.body", "body": body})
+
+
+if __name__ == "__main__":
+    import sys
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend", "dist")
+    print(f"Precompressed {precompress(target)} files in {target}")
@@ -0,0 +1,167 @@
+"""
+Network Status Broadcaster
+Computes the network status once per tick and pushes only the changes to every subscriber
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+from network_state import NetworkState
+from shared_state import encode
+
+logger = logging.getLogger("HydroFlow.Broadcaster")
+
+
+class StatusMessage(NamedTuple):
+    event: str
+    seq: int
+    data: str
+
+    @property
+    def sse(self) -> str:
+        return f"event: {self.event}\nid: {self.seq}\ndata: {self.data}\n\n"
+
+    @property
+    def ws(self) -> str:
+        return f'{{"event": "{self.event}", "seq": {self.seq}, "data": {self.data}}}'
+
+
+class Subscriber:
+    """Bounded per-client queue; a full queue is coalesced into one resync snapshot"""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflows = 0
+        self.closed = False
+
+    async def next_message(self, timeout: float) -> Optional[StatusMessage]:
+        """Next message, None on timeout; raises ConnectionError once the client is dropped"""
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message is None:
+            raise ConnectionError("Subscriber dropped for falling behind")
+        return message
+
+
+class StatusBroadcaster:
+    """Single producer of status deltas shared by all SSE and WebSocket clients.
+
+    The tick loop only runs while at least one client is subscribed. Every change is
+    serialized once and fanned out to the subscriber queues. A tick that finds the
+    same status object as the last one publishes nothing.
+    """
+
+    def __init__(self, interval: float = 5.0, queue_size: int = 8, max_overflows: int = 3,
+                 ignore_keys: Set[str] = frozenset({"lastUpdated"})):
+        self.interval = interval
+        self.queue_size = queue_size
+        self.max_overflows = max_overflows
+        self.ignore_keys = ignore_keys
+        self.source: Optional[Callable[[], Dict]] = None
+        self.on_tick: List[Callable[[NetworkState], None]] = []
+        self.subscribers: Set[Subscriber] = set()
+        self.seq = 0
+        self.dropped = 0
+        self._previous: Optional[Dict] = None
+        self._snapshot_message: Optional[StatusMessage] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def configure(self, source: Callable[[], Dict], on_tick: List[Callable[[NetworkState], None]] = ()):
+        """Set the status source ({"stations", "trains", "summary"}, or None while there is none yet) and per-tick hooks"""
+        self.source = source
+        self.on_tick = list(on_tick)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        if self._previous is not None:
+            subscriber.queue.put_nowait(self._snapshot())
+        self.subscribers.add(subscriber)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Status broadcast tick failed")
+            await asyncio.sleep(self.interval)
+        self._task = None
+
+    def _snapshot(self) -> StatusMessage:
+        if self._snapshot_message is None or self._snapshot_message.seq != self.seq:
+            self._snapshot_message = StatusMessage("snapshot", self.seq, encode(self._previous).decode())
+        return self._snapshot_message
+
+    def _changed(self, previous: List[Dict], current: List[Dict]):
+        """Items whose non-volatile fields changed, plus ids that disappeared"""
+        ignore = self.ignore_keys
+        before = {item["id"]: item for item in previous}
+        changed = []
+        for item in current:
+            old = before.pop(item["id"], None)
+            if old is None or any(old.get(k) != v for k, v in item.items() if k not in ignore):
+                changed.append(item)
+        return changed, list(before)
+
+    def tick(self):
+        status = self.source()
+        if status is None or status is self._previous:
+            return
+        if self.on_tick:
+            state = NetworkState.from_status(status)
+            for hook in self.on_tick:
+                hook(state)
+
+        previous = self._previous
+        self._previous = status
+        self.seq += 1
+        if previous is None:
+            message = self._snapshot()
+        else:
+            stations, removed_stations = self._changed(previous.get("stations", []), status.get("stations", []))
+            trains, removed_trains = self._changed(previous.get("trains", []), status.get("trains", []))
+            if not (stations or trains or removed_stations or removed_trains) and status.get("summary") == previous.get("summary"):
+                return
+            delta = {"seq": self.seq, "stations": stations, "trains": trains}
+            if removed_stations or removed_trains:
+                delta["removed"] = {"stations": removed_stations, "trains": removed_trains}
+            if status.get("summary") != previous.get("summary"):
+                delta["summary"] = status.get("summary")
+            message = StatusMessage("delta", self.seq, encode(delta).decode())
+
+        self.publish(message)
+
+    def publish(self, message: StatusMessage):
+        for subscriber in list(self.subscribers):
+            if subscriber.queue.empty():
+                # Caught up since the last overflow
+                subscriber.overflows = 0
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._coalesce(subscriber)
+
+    def _coalesce(self, subscriber: Subscriber):
+        """Replace a slow client's backlog with one snapshot, or drop it if it keeps lagging"""
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.overflows += 1
+        if subscriber.overflows > self.max_overflows:
+            subscriber.closed = True
+            subscriber.queue.put_nowait(None)
+            self.subscribers.discard(subscriber)
+            self.dropped += 1
+        else:
+            subscriber.queue.put_nowait(self._snapshot())
+
+
+# Global instance
+status_broadcaster = StatusBroadcaster()
@@ -0,0 +1,351 @@
+"""
+Streaming Statistics Engine
+Incremental crowd statistics per station, per line and network-wide, now and over rolling windows
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class RunningStats:
+    """Welford running moments with min, max and sum"""
+
+    __slots__ = ("count", "mean", "m2", "min", "max", "total")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.total = 0.0
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.total += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        """Combine two summaries (Chan et al. parallel update) into a new one"""
+        merged = RunningStats()
+        merged.count = self.count + other.count
+        if merged.count == 0:
+            return merged
+        delta = other.mean - self.mean
+        merged.mean = self.mean + delta * other.count / merged.count
+        merged.m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / merged.count
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+        merged.total = self.total + other.total
+        return merged
+
+    @property
+    def std(self) -> float:
+        """Population standard deviation, matching np.std"""
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+
+class P2Quantile:
+    """Jain & Chlamtac P-square estimator: one quantile in O(1) time and memory.
+
+    The first observations are kept exactly; once the buffer fills, the five
+    markers are seeded from it and the buffer is dropped.
+    """
+
+    __slots__ = ("p", "exact_until", "buffer", "q", "n", "desired", "step")
+
+    def __init__(self, p: float, exact_until: int = 64):
+        self.p = p
+        self.exact_until = max(exact_until, 5)
+        self.buffer: List[float] = []
+        self.q: List[float] = []
+        self.step = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def _seed_markers(self):
+        last = len(self.buffer) - 1
+        self.desired = [last * f for f in self.step]
+        self.n = [0, 0, 0, 0, last]
+        for i in (1, 2, 3):
+            self.n[i] = min(max(int(round(self.desired[i])), self.n[i - 1] + 1), last - (4 - i))
+        self.q = [self.buffer[i] for i in self.n]
+        self.buffer = []
+
+    def add(self, x: float):
+        if not self.q:
+            bisect.insort(self.buffer, x)
+            if len(self.buffer) >= self.exact_until:
+                self._seed_markers()
+            return
+
+        q = self.q
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.n
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.step[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < candidate < q[i + 1]:
+                    q[i] = candidate
+                else:
+                    q[i] += d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self) -> float:
+        if self.q:
+            return self.q[2]
+        return _percentile(self.buffer, self.p)
+
+    def cdf_points(self) -> Tuple[List[float], List[float]]:
+        """(values, cumulative fractions) describing the distribution seen so far"""
+        if self.q:
+            last = self.n[4]
+            return list(self.q), [n / last for n in self.n]
+        if len(self.buffer) < 2:
+            return self.buffer * 2, [0.0, 1.0][:2 * len(self.buffer)]
+        last = len(self.buffer) - 1
+        return list(self.buffer), [i / last for i in range(last + 1)]
+
+
+def _percentile(ordered: List[float], p: float) -> float:
+    """Interpolated quantile of sorted values, as np.percentile computes it"""
+    if not ordered:
+        return 0.0
+    position = p * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class CurrentValues:
+    """The latest value of every station in a scope.
+
+    An update is O(1): it replaces the station's value and adjusts the running sum
+    and sum of squares, so mean, total and standard deviation are always current.
+    Order statistics (median, p95, min, max) are computed exactly at read time in
+    O(n) with one np.percentile pass, and cached until the next update. A scope read
+    once per tick therefore pays one pass per tick, however many stations changed.
+    Stations that have not reported again keep their last value, so the summary is
+    the cross-section of the network as it stands.
+    """
+
+    __slots__ = ("values", "total", "sum_squares", "_order")
+
+    def __init__(self):
+        self.values: Dict[int, float] = {}
+        self.total = 0.0
+        self.sum_squares = 0.0
+        self._order: Optional[Tuple[float, float, float, float]] = None
+
+    def set(self, station_id: int, value: Optional[float]):
+        """Replace a station's value; None removes the station"""
+        old = self.values.pop(station_id, None)
+        if old is not None:
+            self.total -= old
+            self.sum_squares -= old * old
+        if value is not None:
+            self.values[station_id] = value
+            self.total += value
+            self.sum_squares += value * value
+        self._order = None
+
+    def summary(self) -> Dict:
+        count = len(self.values)
+        mean = self.total / count if count else 0.0
+        if self._order is None and count:
+            values = np.fromiter(self.values.values(), dtype=np.float64, count=count)
+            median, p95 = np.percentile(values, [50, 95])
+            self._order = (float(median), float(p95), float(values.min()), float(values.max()))
+        median, p95, low, high = self._order if count else (0.0, 0.0, 0, 0)
+        return {
+            "mean": mean,
+            "median": median,
+            "p95": p95,
+            "std_dev": math.sqrt(max(self.sum_squares / count - mean * mean, 0.0)) if count else 0.0,
+            "min": low,
+            "max": high,
+            "total": self.total,
+            "stations": count,
+        }
+
+
+class WindowedStats:
+    """Rolling time window made of tumbling panes; updates touch only the newest pane"""
+
+    def __init__(self, window_seconds: int, panes: int = 6, quantiles: Tuple[float, ...] = (0.5, 0.95)):
+        self.window_seconds = window_seconds
+        self.pane_seconds = window_seconds / panes
+        self.quantiles = quantiles
+        self._pane_ids = [-1] * panes
+        self._stats = [RunningStats() for _ in range(panes)]
+        self._sketches = [[P2Quantile(p) for p in quantiles] for _ in range(panes)]
+
+    def add(self, x: float, timestamp: float):
+        pane_id = int(timestamp // self.pane_seconds)
+        slot = pane_id % len(self._pane_ids)
+        if self._pane_ids[slot] != pane_id:
+            self._pane_ids[slot] = pane_id
+            self._stats[slot] = RunningStats()
+            self._sketches[slot] = [P2Quantile(p) for p in self.quantiles]
+        self._stats[slot].add(x)
+        for sketch in self._sketches[slot]:
+            sketch.add(x)
+
+    def summary(self, now: float) -> Tuple[RunningStats, Dict[float, float]]:
+        """Merged moments plus quantiles of the pooled window.
+
+        Each pane's sketches give a piecewise-linear CDF (exact while the pane holds
+        few samples, from the P-square markers after that). The count-weighted sum
+        of the pane CDFs is inverted at each quantile.
+        """
+        oldest = int(now // self.pane_seconds) - len(self._pane_ids)
+        merged = RunningStats()
+        curves = []
+        for pane_id, stats, sketches in zip(self._pane_ids, self._stats, self._sketches):
+            if pane_id <= oldest or stats.count == 0:
+                continue
+            merged = merged.merge(stats)
+            points = sorted(point for sketch in sketches for point in zip(*sketch.cdf_points()))
+            values = np.maximum.accumulate([value for value, _ in points])
+            fractions = np.maximum.accumulate([fraction for _, fraction in points])
+            curves.append((values, fractions, stats.count))
+        if not curves:
+            return merged, dict.fromkeys(self.quantiles, 0.0)
+        grid = np.unique(np.concatenate([values for values, _, _ in curves]))
+        cdf = sum(count * np.interp(grid, values, fractions, left=0.0, right=1.0)
+                  for values, fractions, count in curves) / merged.count
+        return merged, {p: float(np.interp(p, cdf, grid)) for p in self.quantiles}
+
+
+class StreamingStatsEngine:
+    """Keeps crowd statistics for every station, line and the whole network.
+
+    Two views per scope: "current" is the cross-section over each station's latest
+    count, with unchanged stations carried forward. The rolling windows ("1m",
+    "15m", "1h") pool every reported sample in the window, so stations that report
+    more often weigh more there.
+    """
+
+    CURRENT = "current"
+
+    def __init__(self, windows: Dict[str, int] = None, panes: int = 6):
+        self.windows = windows or {"1m": 60, "15m": 900, "1h": 3600}
+        self.panes = panes
+        self._scopes: Dict[str, Dict[str, WindowedStats]] = {}
+        self._current: Dict[str, CurrentValues] = {}
+        self._latest: Dict[int, Tuple[object, float, str]] = {}
+        self._lock = threading.Lock()
+        self._scope("network")
+
+    def _scope(self, name: str) -> Dict[str, WindowedStats]:
+        scope = self._scopes.get(name)
+        if scope is None:
+            scope = {label: WindowedStats(seconds, self.panes) for label, seconds in self.windows.items()}
+            self._scopes[name] = scope
+            self._current[name] = CurrentValues()
+        return scope
+
+    def update(self, station_id: int, line: str, passengers: float,
+               timestamp: Optional[float] = None, marker: object = None):
+        """Fold one station observation into its station, line and network scopes"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            previous = self._latest.get(station_id)
+            if previous is not None and marker is not None and previous[0] == marker:
+                return
+            self._latest[station_id] = (marker, passengers, line)
+            line_key = f"line:{line}"
+            for scope_name in (f"station:{station_id}", line_key, "network"):
+                for window in self._scope(scope_name).values():
+                    window.add(passengers, timestamp)
+
+            if previous is not None and previous[2] != line:
+                self._current[f"line:{previous[2]}"].set(station_id, None)
+            for scope_name in (f"station:{station_id}", line_key, "network"):
+                self._current[scope_name].set(station_id, passengers)
+
+    def update_stations(self, stations: List[Dict], timestamp: Optional[float] = None):
+        """Ingest a network snapshot, skipping stations whose lastUpdated has not moved"""
+        for station in stations:
+            self.update(station["id"], station["line"], station["passengers"], timestamp,
+                        marker=station.get("lastUpdated"))
+
+    def update_state(self, state, timestamp: Optional[float] = None):
+        """Ingest a NetworkState, reading ids, lines and counts from its columns"""
+        lines = [state.lines[code] for code in state.station_line.tolist()]
+        for station, station_id, line, passengers in zip(state.stations, state.station_ids.tolist(), lines,
+                                                          state.passengers.tolist()):
+            self.update(station_id, line, passengers, timestamp, marker=station.get("lastUpdated"))
+
+    def get_stats(self, scope: str = "network", window: str = CURRENT, now: Optional[float] = None) -> Dict:
+        """Read summary statistics for a scope such as 'network', 'line:red' or 'station:4'.
+
+        window is "current" for the latest count of every station, or a rolling window label.
+        The window view reports sample_total, the sum of every sample in the window, in
+        place of the current view's total.
+        """
+        if window != self.CURRENT and window not in self.windows:
+            raise ValueError(f"Unknown window '{window}', expected one of {[self.CURRENT, *self.windows]}")
+        now = time.time() if now is None else now
+        with self._lock:
+            windows = self._scopes.get(scope)
+            if windows is None:
+                raise KeyError(scope)
+            if window == self.CURRENT:
+                current = self._current[scope].summary()
+                return {
+                    "view": self.CURRENT,
+                    **{key: round(value, 2) for key, value in current.items()
+                       if key in ("mean", "median", "p95", "std_dev")},
+                    "min": int(current["min"]),
+                    "max": int(current["max"]),
+                    "total": int(current["total"]),
+                    "stations": current["stations"],
+                }
+            stats, quantiles = windows[window].summary(now)
+
+        return {
+            "view": "window",
+            "mean": round(stats.mean, 2),
+            "median": round(quantiles.get(0.5, 0.0), 2),
+            "p95": round(quantiles.get(0.95, 0.0), 2),
+            "std_dev": round(stats.std, 2),
+            "min": int(stats.min) if stats.count else 0,
+            "max": int(stats.max) if stats.count else 0,
+            "sample_total": int(stats.total),
+            "samples": stats.count,
+            "window_seconds": self.windows[window]
+        }
+
+
+# Global instance
+streaming_stats = StreamingStatsEngine()
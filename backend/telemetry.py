@@ -0,0 +1,357 @@
+"""
+Telemetry
+Latency histograms, counters, Prometheus text exposition and an on-demand sampling profiler
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Bucket counts and sum for one label set; buckets are made cumulative on export.
+
+    observe() takes no lock: it runs on every instrumented call, and a lock would
+    double its cost. Under the GIL two threads updating the same bucket at once can
+    lose a single increment, which does not matter for latency distributions.
+    """
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+
+class Timer:
+    """Context manager recording the duration of its block into a histogram"""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class HistogramFamily:
+    """One histogram per label-value tuple; resolve children once and keep them on hot paths"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> Histogram:
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, Histogram(self.buckets))
+        return child
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in sorted(self._children.items()):
+            counts, total = list(child.counts), child.sum
+            count = sum(counts)
+            if not count:
+                continue  # resolved at decoration time but never called
+            running = 0
+            for bound, bucket in zip(child.bounds + (float("inf"),), counts):
+                running += bucket
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, values, le)} {running}")
+            labels = _label_text(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CounterFamily:
+    """Monotonic counts per label-value tuple"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # An unlabelled counter is exported from zero
+        self._values: Dict[Tuple, float] = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, *values) -> float:
+        return self._values.get(values, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}_total{_label_text(self.labelnames, values)} {_number(value)}" for values, value in items]
+
+
+class CollectedFamily:
+    """Counter or gauge whose samples are read from their owner at scrape time.
+
+    Suits counts the engines already keep (cache hits, rejections), which then cost
+    nothing on the hot path.
+    """
+
+    def __init__(self, name: str, kind: str, help_text: str, labelnames: Sequence[str],
+                 source: Callable[[], Dict[Tuple, float]]):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.source = source
+
+    def render(self) -> List[str]:
+        suffix = "_total" if self.kind == "counter" else ""
+        return [f"{self.name}{suffix}{_label_text(self.labelnames, values)} {_number(value)}"
+                for values, value in sorted(self.source().items())]
+
+
+class SamplingProfiler:
+    """Samples the Python stack of every thread from a daemon thread.
+
+    ``stop`` returns the samples in folded-stack format ("thread;file:func;... count"),
+    which flamegraph.pl, speedscope and inferno read directly. Sampling stops on its
+    own after max_seconds so a forgotten session cannot run indefinitely.
+    """
+
+    def __init__(self, interval_seconds: float = 0.01, max_seconds: float = 300.0):
+        self.interval_seconds = interval_seconds
+        self.max_seconds = max_seconds
+        self._samples: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.sample_count = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_seconds: float = None, max_seconds: float = None) -> bool:
+        """Begin a new session; False when one is already running"""
+        with self._lock:
+            if self.running:
+                return False
+            interval = interval_seconds or self.interval_seconds
+            duration = max_seconds or self.max_seconds
+            self._samples = Counter()
+            self.sample_count = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval, duration),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, interval: float, duration: float):
+        own = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + duration
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                thread = names.get(ident)
+                if thread is None:
+                    thread = names[ident] = next(
+                        (t.name for t in threading.enumerate() if t.ident == ident), str(ident))
+                stack.append(thread)
+                self._samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def stop(self) -> str:
+        """End the session (if running) and return its folded stacks"""
+        with self._lock:
+            thread = self._thread
+            self._stop.set()
+            if thread is not None:
+                thread.join()
+            return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common())
+
+    def describe(self) -> Dict:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "samples": self.sample_count,
+            "distinct_stacks": len(self._samples),
+        }
+
+
+class Telemetry:
+    """Registry of metric families, shared by the engines and the HTTP layer.
+
+    With ``enabled`` False the timing decorators call straight through. Set the
+    TELEMETRY_ENABLED environment variable to 0 to start disabled.
+    """
+
+    def __init__(self, enabled: bool = True, namespace: str = "hydroflow"):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._families: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.profiler = SamplingProfiler()
+        self.engine_seconds = self.histogram("engine_call_seconds", "Engine method latency", ("engine", "method"))
+        self.request_seconds = self.histogram("http_request_duration_seconds", "HTTP request latency by route",
+                                              ("method", "route", "status"))
+
+    def _register(self, family):
+        with self._lock:
+            existing = self._families.get(family.name)
+            if existing is not None:
+                return existing
+            self._families[family.name] = family
+            return family
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> HistogramFamily:
+        return self._register(HistogramFamily(f"{self.namespace}_{name}", help_text, labelnames, buckets))
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> CounterFamily:
+        return self._register(CounterFamily(f"{self.namespace}_{name}", help_text, labelnames))
+
+    def collect(self, name: str, kind: str, help_text: str, labelnames: Sequence[str],
+                source: Callable[[], Dict[Tuple, float]]) -> CollectedFamily:
+        """Export a counter or gauge read from source() at scrape time"""
+        return self._register(CollectedFamily(f"{self.namespace}_{name}", kind, help_text, labelnames, source))
+
+    def timed(self, engine: str, method: str = None):
+        """Decorator recording each call's latency under engine_call_seconds{engine, method}"""
+        def decorate(fn):
+            observe = self.engine_seconds.labels(engine, method or fn.__name__).observe
+            perf_counter = time.perf_counter
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    observe(perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def timer(self, engine: str, section: str) -> Timer:
+        """Context manager timing a block as engine_call_seconds{engine, method=section}"""
+        return self.engine_seconds.labels(engine, section).time()
+
+    def render(self) -> str:
+        """Every family in the Prometheus text exposition format (0.0.4)"""
+        lines = []
+        with self._lock:
+            families = sorted(self._families.values(), key=lambda f: f.name)
+        for family in families:
+            samples = family.render()
+            if not samples:
+                continue
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route request latency.
+
+    The route label is the matched path template ("/predictions/{station_id}"), so
+    label cardinality stays bounded; anything unrouted is "other". Streaming paths
+    are skipped, as their duration is the subscriber's connection time.
+    """
+
+    def __init__(self, app, registry: Telemetry = None, skip_paths: Iterable[str] = ("/status/stream",)):
+        self.app = app
+        self.telemetry = registry or telemetry
+        self.skip_paths = frozenset(skip_paths)
+        self._children: Dict[Tuple, Histogram] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.telemetry.enabled or scope["path"] in self.skip_paths:
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            key = (scope["method"], getattr(route, "path", "other"), status)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self.telemetry.request_seconds.labels(*key)
+            child.observe(elapsed)
+
+
+# Global instance
+telemetry = Telemetry(enabled=os.environ.get("TELEMETRY_ENABLED", "1") != "0")
@@ -0,0 +1,184 @@
+"""
+Train Position Index
+Trains kept sorted by track position per line, for bisect-based proximity queries
+"""
+
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from metro_topology import metro_topology
+from network_state import NetworkState
+
+
+class LineTrains(NamedTuple):
+    """Trains on one line, sorted by position (in station offsets along the line)"""
+    positions: np.ndarray
+    directions: np.ndarray
+    rows: np.ndarray
+
+
+class NearbyTrains(NamedTuple):
+    """Per-station counts of trains within a radius; ``toward_end``/``toward_start`` only count approaching trains"""
+    total: np.ndarray
+    toward_end: np.ndarray
+    toward_start: np.ndarray
+
+    @property
+    def approaching(self) -> np.ndarray:
+        return self.toward_end + self.toward_start
+
+
+class TrainPositionIndex:
+    """Per-line sorted train positions rebuilt once per tick.
+
+    A train's position is its offset along the line's station sequence: the offset of
+    its ``nextStation``, minus half a segment in its direction of travel. Direction is
+    +1 toward the last station of the sequence and -1 toward the first. It comes from
+    a ``direction`` field on the train when the feed provides one. Otherwise it is
+    inferred from how the train's next station moved since the previous tick, and kept
+    while the train dwells. Unknown direction is 0.
+
+    Proximity queries take a radius in station offsets, or in metres of track. Metres
+    are mapped to offsets through the cumulative ``km`` of the line's segments, so a
+    radius covers fewer stations where they are far apart.
+    """
+
+    def __init__(self, topology=metro_topology):
+        self.topology = topology
+        self.lines: Dict[str, LineTrains] = {}
+        self.station_offsets: Dict[int, Tuple[str, int]] = {}
+        self.terminals: Dict[str, Tuple[str, str]] = {}
+        self.line_km: Dict[str, np.ndarray] = {}
+        self._name_offsets: Dict[str, Dict[str, int]] = {}
+        self._last_offset: Dict[object, int] = {}
+        self._direction: Dict[object, int] = {}
+        self._state: Optional[NetworkState] = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _rebuild_lines(self):
+        """Station offsets along each line for the current topology version"""
+        station_offsets, name_offsets, terminals, line_km = {}, {}, {}, {}
+        edges = self.topology.graph.edges
+        for line, sequence in self.topology.line_sequences.items():
+            # Track distance from the first station to each offset
+            line_km[line] = np.cumsum([0.0] + [edges[a, b].get("km", 0.0) for a, b in zip(sequence, sequence[1:])])
+            names = name_offsets.setdefault(line, {})
+            for offset, station_id in enumerate(sequence):
+                station_offsets[station_id] = (line, offset)
+                names.setdefault(self.topology.graph.nodes[station_id]["name"].lower(), offset)
+            if sequence:
+                nodes = self.topology.graph.nodes
+                terminals[line] = (nodes[sequence[0]]["name"], nodes[sequence[-1]]["name"])
+        self.station_offsets, self._name_offsets, self.terminals = station_offsets, name_offsets, terminals
+        self.line_km = line_km
+        self._last_offset.clear()
+        self._direction.clear()
+        self._version = self.topology.version
+
+    def _train_direction(self, train_id, offset: int, reported) -> int:
+        if reported in (1, -1):
+            direction = reported
+        else:
+            last = self._last_offset.get(train_id)
+            if last is not None and last != offset:
+                direction = 1 if offset > last else -1
+            else:
+                direction = self._direction.get(train_id, 0)
+        self._last_offset[train_id] = offset
+        self._direction[train_id] = direction
+        return direction
+
+    def update(self, state: NetworkState):
+        """Re-index the trains of a new tick; repeated calls with the same state are no-ops"""
+        with self._lock:
+            if state is self._state:
+                return
+            self.topology.sync(state)
+            if self._version != self.topology.version:
+                self._rebuild_lines()
+
+            collected: Dict[str, Tuple[List[float], List[int], List[int]]] = {}
+            for row, (train_id, next_station, code) in enumerate(
+                    zip(state.train_ids, state.next_stations, state.train_line.tolist())):
+                line = state.lines[code]
+                offset = self._name_offsets.get(line, {}).get((next_station or "").lower())
+                if offset is None:
+                    continue
+                direction = self._train_direction(train_id, offset, state.trains[row].get("direction"))
+                positions, directions, rows = collected.setdefault(line, ([], [], []))
+                positions.append(offset - 0.5 * direction)
+                directions.append(direction)
+                rows.append(row)
+
+            lines = {}
+            for line, (positions, directions, rows) in collected.items():
+                positions = np.array(positions)
+                order = np.argsort(positions, kind="stable")
+                lines[line] = LineTrains(positions[order], np.array(directions, dtype=np.int8)[order],
+                                         np.array(rows, dtype=np.intp)[order])
+            self.lines = lines
+            self._state = state
+
+    def _bounds(self, line: str, offsets: np.ndarray, radius: Optional[float],
+                metres: Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Lowest and highest track positions within radius station offsets, or metres of track, of offsets"""
+        if metres is None:
+            if radius is None:
+                raise ValueError("Pass a radius in stations or in metres")
+            return offsets - radius, offsets + radius
+        km = self.line_km.get(line)
+        if km is None or len(km) < 2:
+            return offsets, offsets
+        steps = np.arange(len(km), dtype=np.float64)
+        centre = np.interp(offsets, steps, km)
+        # Open past the terminals, so a train half a segment beyond one still counts
+        reach = metres / 1000.0
+        # Rounded so a bound that lands on a station is not nudged past it by float error
+        return (np.interp(centre - reach, km, steps, left=-np.inf).round(9),
+                np.interp(centre + reach, km, steps, right=np.inf).round(9))
+
+    def within(self, line: str, offset: float, radius: Optional[float] = None,
+               metres: Optional[float] = None) -> np.ndarray:
+        """State rows of trains on a line within radius station offsets, or metres of track, of offset"""
+        trains = self.lines.get(line)
+        if trains is None:
+            return np.empty(0, dtype=np.intp)
+        low, high = self._bounds(line, np.array([offset], dtype=np.float64), radius, metres)
+        lo = np.searchsorted(trains.positions, low[0], side="left")
+        hi = np.searchsorted(trains.positions, high[0], side="right")
+        return trains.rows[lo:hi]
+
+    def count_nearby(self, line: str, offsets: np.ndarray, radius: Optional[float] = None,
+                     train_mask: Optional[np.ndarray] = None, metres: Optional[float] = None) -> NearbyTrains:
+        """Vectorized counts around many station offsets on one line.
+
+        The radius is in station offsets, or in metres of track when metres is given.
+        ``train_mask`` is a boolean array over state train rows (e.g. busy trains only).
+        Trains moving toward the end of the line approach from lower offsets, and
+        trains moving toward the start approach from higher ones.
+        """
+        offsets = np.asarray(offsets, dtype=np.float64)
+        low, high = self._bounds(line, offsets, radius, metres)
+        zeros = np.zeros(len(offsets), dtype=np.int64)
+        trains = self.lines.get(line)
+        if trains is None:
+            return NearbyTrains(zeros, zeros.copy(), zeros.copy())
+        keep = np.ones(len(trains.rows), dtype=bool) if train_mask is None else train_mask[trains.rows]
+        positions, directions = trains.positions[keep], trains.directions[keep]
+
+        def between(sorted_positions, low, high, include_low=True, include_high=True):
+            left = np.searchsorted(sorted_positions, low, side="left" if include_low else "right")
+            right = np.searchsorted(sorted_positions, high, side="right" if include_high else "left")
+            return right - left
+
+        total = between(positions, low, high)
+        toward_end = between(positions[directions == 1], low, offsets, include_high=False)
+        toward_start = between(positions[directions == -1], offsets, high, include_low=False)
+        return NearbyTrains(total, toward_end, toward_start)
+
+
+# Global instance
+train_index = TrainPositionIndex()
@@ -21,10 +21,54 @@ function App() {
         console.log('📊 Visitor Info:', visitorInfo)
 
         fetchData()
-        const interval = setInterval(fetchData, 5000)
-        return () => clearInterval(interval)
+
+        // Prefer server-pushed deltas; fall back to polling if the stream is unavailable
+        let interval = null
+        const stream = typeof EventSource !== 'undefined' ? new EventSource(`${API_URL}/status/stream`) : null
+        if (stream) {
+            stream.addEventListener('snapshot', (event) => applySnapshot(JSON.parse(event.data)))
+            stream.addEventListener('delta', (event) => applyDelta(JSON.parse(event.data)))
+            stream.onerror = () => {
+                if (stream.readyState === EventSource.CLOSED && !interval) {
+                    interval = setInterval(fetchData, 5000)
+                }
+            }
+        } else {
+            interval = setInterval(fetchData, 5000)
+        }
+        return () => {
+            if (stream) stream.close()
+            if (interval) clearInterval(interval)
+        }
     }, [])
 
+    const mergeById = (items, changed, removed = []) => {
+        const updates = new Map(changed.map(item => [item.id, item]))
+        const merged = items
+            .filter(item => !removed.includes(item.id))
+            .map(item => updates.get(item.id) || item)
+        const known = new Set(merged.map(item => item.id))
+        return merged.concat(changed.filter(item => !known.has(item.id)))
+    }
+
+    const applySnapshot = (snapshot) => {
+        setStationsData(snapshot.stations || [])
+        setSummary(snapshot.summary || {})
+        setTrainsData(snapshot.trains || [])
+        setLoading(false)
+    }
+
+    const applyDelta = (delta) => {
+        const removed = delta.removed || {}
+        if (delta.stations.length || removed.stations) {
+            setStationsData(prev => mergeById(prev, delta.stations, removed.stations))
+        }
+        if (delta.trains.length || removed.trains) {
+            setTrainsData(prev => mergeById(prev, delta.trains, removed.trains))
+        }
+        if (delta.summary) setSummary(delta.summary)
+    }
+
     const fetchData = async () => {
         try {
             const [statusRes, trainsRes] = await Promise.all([